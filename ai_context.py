@@ -0,0 +1,208 @@
+import os
+import sqlite3
+from itertools import chain
+
+from storage import connect_db
+
+# Default number of tokens the study materials may use in a prompt
+DEFAULT_TOKEN_BUDGET = int(os.getenv('AI_CONTEXT_TOKEN_BUDGET', '6000'))
+
+# Rough average for English text; good enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# No single note may use more than this many tokens, so one long note
+# cannot crowd out everything else
+MAX_ITEM_TOKENS = 1500
+
+# Items that would have to be cut below this size are skipped instead
+MIN_TRUNCATED_TOKENS = 64
+
+# Share of the budget reserved for dictionary terms before notes are packed
+DICTIONARY_SHARE = 0.4
+
+RANKINGS = ('views', 'recent', 'search')
+
+_ORDER_BY = {
+    'views': "COALESCE(views, 0) DESC, last_updated DESC",
+    'recent': "last_updated DESC, id DESC",
+}
+
+# Columns read for the prompt
+ENTRY_COLUMNS = ('id', 'word_phrase', 'definition', 'example')
+NOTE_COLUMNS = ('id', 'title', 'content')
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in a piece of text"""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, preferring a word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 3]
+    space = cut.rfind(' ')
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut + '...'
+
+def _connect(name):
+    """Open a read-only connection so context building never blocks writers"""
+    conn = connect_db(name, readonly=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _has_table(conn, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+def ranked_rows_sql(table, columns, unit_number, rank):
+    """Rows of table (in a unit, if given) in ranking order"""
+    where = "WHERE unit_number = ?" if unit_number is not None else ""
+    return f"SELECT {', '.join(columns)} FROM {table} {where} ORDER BY {_ORDER_BY.get(rank, _ORDER_BY['views'])}"
+
+def search_rows_sql(table, columns, unit_number):
+    """Full-text matches in table (in a unit, if given), best first"""
+    fts_table = f"{table}_fts"
+    select = ", ".join(f"t.{column}" for column in columns)
+    return f"""
+        SELECT {select}
+        FROM {fts_table}
+        JOIN {table} t ON t.id = {fts_table}.rowid
+        WHERE {fts_table} MATCH ?
+        {"AND t.unit_number = ?" if unit_number is not None else ""}
+        ORDER BY bm25({fts_table})
+    """
+
+def _stream_rows(conn, table, columns, unit_number, rank, query):
+    """Yield rows from table in ranking order without loading them all.
+
+    For the 'search' ranking, full-text matches (when the FTS index from
+    setup_fts.py exists) come first, followed by the remaining rows by views.
+    """
+    params = [] if unit_number is None else [unit_number]
+
+    seen = set()
+    if rank == 'search' and query:
+        if _has_table(conn, f"{table}_fts"):
+            sql = search_rows_sql(table, columns, unit_number)
+            # Quote each word so user input cannot inject FTS query syntax
+            match = " OR ".join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+            try:
+                for row in conn.execute(sql, [match] + params):
+                    seen.add(row['id'])
+                    yield row
+            except sqlite3.OperationalError:
+                pass
+        rank = 'views'
+
+    for row in conn.execute(ranked_rows_sql(table, columns, unit_number, rank), params):
+        if row['id'] not in seen:
+            yield row
+
+def _format_entry(entry):
+    line = f"- {entry['word_phrase']}: {entry['definition']}"
+    if entry['example']:
+        line += f" (Example: {entry['example']})"
+    return line + "\n"
+
+def _format_note(note):
+    return f"- {note['title']}: {note['content']}\n"
+
+def _pack(lines, header, budget, usage, key):
+    """Append formatted lines to a section until budget is spent.
+
+    Returns the section text and an iterator over the lines not used
+    (starting with one that was read but did not fit), or None once the
+    source is exhausted.
+    """
+    header_tokens = estimate_tokens(header)
+    if budget <= header_tokens + MIN_TRUNCATED_TOKENS:
+        return "", lines
+
+    parts = []
+    spent = header_tokens
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if tokens > MAX_ITEM_TOKENS:
+            line = truncate_to_tokens(line.rstrip("\n"), MAX_ITEM_TOKENS) + "\n"
+            tokens = estimate_tokens(line)
+            usage['truncated'] += 1
+        remaining = budget - spent
+        if tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                # Put the line back so a later pass starts with it
+                return (header + "".join(parts) if parts else ""), chain([line], lines)
+            line = truncate_to_tokens(line.rstrip("\n"), remaining - 1) + "\n"
+            parts.append(line)
+            spent += estimate_tokens(line)
+            usage[key] += 1
+            usage['truncated'] += 1
+            return header + "".join(parts), lines
+        parts.append(line)
+        spent += tokens
+        usage[key] += 1
+    return (header + "".join(parts) if parts else ""), None
+
+def build_study_context(unit_number=None, token_budget=None, rank='views', query=None):
+    """Assemble dictionary terms and notes into a prompt context under a token budget.
+
+    Rows are streamed from the databases in ranking order ('views', 'recent'
+    or 'search'), so only as much content as fits the budget is ever read.
+    Dictionary terms get a reserved share of the budget; anything they leave
+    unused goes to notes, and anything notes leave unused goes back to terms.
+
+    Returns a (context, usage) tuple, where usage reports the token budget,
+    the estimated tokens used and how many items were included.
+    """
+    if token_budget is None:
+        token_budget = DEFAULT_TOKEN_BUDGET
+    if rank not in RANKINGS:
+        rank = 'views'
+
+    usage = {
+        'token_budget': token_budget,
+        'tokens_used': 0,
+        'rank': rank,
+        'dictionary_entries': 0,
+        'notes': 0,
+        'truncated': 0,
+    }
+
+    dict_conn = notes_conn = None
+    try:
+        dict_conn = _connect('dictionary')
+        notes_conn = _connect('notes')
+
+        entry_lines = (_format_entry(row) for row in _stream_rows(
+            dict_conn, 'entries', ENTRY_COLUMNS, unit_number, rank, query))
+        note_lines = (_format_note(row) for row in _stream_rows(
+            notes_conn, 'notes', NOTE_COLUMNS, unit_number, rank, query))
+
+        # Terms first, limited to their share of the budget
+        terms, terms_left = _pack(entry_lines, "Dictionary Terms:\n",
+                                  int(token_budget * DICTIONARY_SHARE), usage, 'dictionary_entries')
+        spent = estimate_tokens(terms)
+
+        notes, _ = _pack(note_lines, "\nNotes:\n", token_budget - spent, usage, 'notes')
+        spent += estimate_tokens(notes)
+
+        # Give any budget the notes did not need back to the remaining terms
+        if terms_left is not None and token_budget - spent > MIN_TRUNCATED_TOKENS:
+            more_terms, _ = _pack(terms_left, "" if terms else "Dictionary Terms:\n",
+                                  token_budget - spent, usage, 'dictionary_entries')
+            terms += more_terms
+            spent += estimate_tokens(more_terms)
+
+        context = terms + notes
+        usage['tokens_used'] = estimate_tokens(context)
+        return context, usage
+    finally:
+        if dict_conn:
+            dict_conn.close()
+        if notes_conn:
+            notes_conn.close()
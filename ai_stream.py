@@ -0,0 +1,77 @@
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Stop forwarding a generation that runs longer than this, in seconds
+MAX_STREAM_SECONDS = 120
+
+# Sent to the client when the model call fails; the details are only logged
+STREAM_ERROR_MESSAGE = 'The AI service did not respond. Please try again.'
+
+def sse_event(data, event=None):
+    """Format one server-sent event carrying JSON data"""
+    message = ""
+    if event:
+        message += f"event: {event}\n"
+    message += f"data: {json.dumps(data)}\n\n"
+    return message
+
+def stream_chat_completion(client, messages, on_complete=None, **options):
+    """Yield a chat completion as server-sent events while tokens arrive.
+
+    Emits a 'delta' event per chunk of text, then a 'done' event with the
+    finish reason (or an 'error' event with a generic message; the
+    exception itself is logged). The generator only pulls the next chunk
+    from the model when the WSGI server asks for the next event, so a
+    slow client slows the upstream read down instead of buffering the whole
+    reply in memory. When the client disconnects the server closes the
+    generator, which closes the upstream response and stops generation.
+
+    on_complete, if given, is called with the full reply text once the
+    stream finishes normally.
+    """
+    started = time.monotonic()
+    stream = None
+    parts = []
+    try:
+        stream = client.chat.completions.create(messages=messages, stream=True, **options)
+
+        # Tell the client (and any proxy) that the stream has started
+        yield sse_event({}, event='start')
+
+        finish_reason = None
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                parts.append(choice.delta.content)
+                yield sse_event({'content': choice.delta.content}, event='delta')
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+            if time.monotonic() - started > MAX_STREAM_SECONDS:
+                finish_reason = 'timeout'
+                break
+
+        content = "".join(parts)
+        if on_complete and content:
+            on_complete(content)
+        yield sse_event({'finish_reason': finish_reason}, event='done')
+    except GeneratorExit:
+        # Client went away; the finally block cancels the upstream request
+        raise
+    except Exception:
+        logger.exception("Chat completion stream failed")
+        yield sse_event({'error': STREAM_ERROR_MESSAGE}, event='error')
+    finally:
+        if stream is not None:
+            stream.close()
+
+def sse_headers():
+    """Response headers that keep proxies from buffering an event stream"""
+    return {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }
@@ -1,53 +1,78 @@
 
-from flask import Flask, render_template, request, redirect, session, jsonify, flash, url_for
-from flask_session import Session
-from datetime import datetime, date
-import pytz
+from dotenv import load_dotenv
+
+# Settings such as DATA_DIR and SCRYPT_N are read when modules are imported,
+# so .env is loaded before anything else
+load_dotenv()
+
+from flask import Flask, current_app, render_template, request, redirect, jsonify, url_for
+import importlib
 import os
 import re
-from sql import *  # Used for database connection and management
-from SarvAuth import *  # Used for user authentication functions
-from auth import auth_blueprint
-from dictionary_routes import dict_bp as dictionary_blueprint
-from notes_routes import notes_bp as notes_blueprint
-from test_routes import test_bp as test_blueprint
-from calendar_routes import calendar_bp as calendar_blueprint
+import migrate
+import quiz_store
+import sessions
+import storage
+from storage import get_sql
 
-app = Flask(__name__)
-
-# Configure session
-app.config["SESSION_PERMANENT"] = True
-app.config["SESSION_TYPE"] = "filesystem"
-app.config['SECRET_KEY'] = os.urandom(24)  # Required for flash messages
+# Configuration
+autoRun = True  # Set to True to run the server automatically when app.py is executed
+port = 5000  # Change to any available port
+authentication = True  # Set to False to disable authentication
 
-# Initialize extensions
-Session(app)
+# Blueprints by name: (module, blueprint attribute, URL prefix). Modules are
+# imported by create_app, not here, so importing this file stays cheap; set
+# BLUEPRINTS in the config to a list of names to register only some of them.
+BLUEPRINTS = {
+    'auth': ('auth', 'auth_blueprint', '/auth'),
+    'dictionary': ('dictionary_routes', 'dict_bp', '/dictionary'),
+    'notes': ('notes_routes', 'notes_bp', '/notes'),
+    'calendar': ('calendar_routes', 'calendar_bp', '/calendar'),
+    'tests': ('test_routes', 'test_bp', '/tests'),
+}
 
 # Initialize blueprints
 def init_blueprints(app):
-    app.register_blueprint(auth_blueprint, url_prefix='/auth')
-    app.register_blueprint(dictionary_blueprint, url_prefix='/dictionary')
-    app.register_blueprint(notes_blueprint, url_prefix='/notes')
-    app.register_blueprint(calendar_blueprint, url_prefix='/calendar')
-    
-    # Initialize test blueprint
-    from test_routes import init_app as init_test_app
-    init_test_app(app)
+    for name in app.config.get('BLUEPRINTS', BLUEPRINTS):
+        module_name, attribute, url_prefix = BLUEPRINTS[name]
+        blueprint = getattr(importlib.import_module(module_name), attribute)
+        app.register_blueprint(blueprint, url_prefix=url_prefix)
 
-# Initialize all blueprints
-init_blueprints(app)
+def init_routes(app):
+    app.add_url_rule("/", view_func=index, methods=["GET"])
+    app.add_url_rule('/search', view_func=search)
+    app.add_url_rule('/api/search/dictionary', view_func=api_search_dictionary)
+    app.add_url_rule('/api/search/notes', view_func=api_search_notes)
+    app.add_template_filter(highlight_filter, 'highlight')
 
-# Configuration
-autoRun = True  # Set to True to run the server automatically when app.py is executed
-port = 5000  # Change to any available port
-authentication = True  # Set to False to disable authentication
+def create_app(config=None):
+    """Build a configured app; WSGI servers call this once per process (or once before forking).
+
+    config is a dict or an object with upper-case attributes, applied
+    before sessions, storage and blueprints are set up. Tests can pass a
+    SECRET_KEY and a short BLUEPRINTS list for a lightweight app.
+    """
+    app = Flask(__name__)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    # Sessions live in signed cookies; the key comes from SECRET_KEY or DATA_DIR
+    sessions.init_app(app)
+    storage.init_app(app)
+    # Refuse to start on an out-of-date schema, or migrate first if MIGRATE_ON_START is set
+    migrate.check_schema(apply=app.config.get('MIGRATE_ON_START', os.getenv('MIGRATE_ON_START') == '1'))
+    quiz_store.init_app(app)
+
+    init_blueprints(app)
+    init_routes(app)
+    return app
 
 # This route always redirects to the dictionary
-@app.route("/", methods=["GET"])
 def index():
     return redirect(url_for('dictionary.index'))
 
-@app.route('/search')
 def search():
     """Unified search across dictionary and notes"""
     query = request.args.get('q', '').strip()
@@ -66,7 +91,7 @@ def search():
         
         # Search in dictionary
         try:
-            db = SQL("sqlite:///dictionary.db")
+            db = get_sql('dictionary')
             
             # Use a simple LIKE query that works with the existing schema
             dict_query = """
@@ -80,12 +105,12 @@ def search():
             dictionary_results = db.execute(dict_query, query=f"%{clean_query}%")
                     
         except Exception as e:
-            app.logger.error(f"Error searching dictionary: {str(e)}")
+            current_app.logger.error(f"Error searching dictionary: {str(e)}")
             dictionary_results = []
         
         # Search in notes
         try:
-            db = SQL("sqlite:///notes.db")
+            db = get_sql('notes')
             
             # Use a simple LIKE query that works with the existing schema
             notes_query = """
@@ -99,7 +124,7 @@ def search():
             notes_results = db.execute(notes_query, query=f"%{clean_query}%")
                     
         except Exception as e:
-            app.logger.error(f"Error searching notes: {str(e)}")
+            current_app.logger.error(f"Error searching notes: {str(e)}")
             notes_results = []
     
     # Highlight the search terms in the results
@@ -133,11 +158,10 @@ def highlight_text(text, query):
         # Replace matches with highlighted span
         return pattern.sub(r'<span class="highlight">\1</span>', text)
     except Exception as e:
-        app.logger.error(f"Error highlighting text: {str(e)}")
+        current_app.logger.error(f"Error highlighting text: {str(e)}")
         return text
 
 # Add a custom filter to highlight text in search results
-@app.template_filter('highlight')
 def highlight_filter(s, query):
     if not query or not s:
         return s
@@ -151,8 +175,8 @@ def highlight_filter(s, query):
         return s
 
 def get_db_connection(db_name):
-    """Create and return a database connection"""
-    return SQL(f"sqlite:///{db_name}")
+    """Return the shared SQL wrapper for a database (by name, e.g. 'notes')"""
+    return get_sql(db_name)
 
 def close_db_connection(db):
     """Close a database connection if it exists"""
@@ -164,7 +188,6 @@ def close_db_connection(db):
         # Clear the connection
         db.db = None
 
-@app.route('/api/search/dictionary')
 def api_search_dictionary():
     """API endpoint for searching dictionary entries"""
     query = request.args.get('q', '').strip()
@@ -174,7 +197,7 @@ def api_search_dictionary():
     db = None
     try:
         # Get database connection
-        db = get_db_connection('dictionary.db')
+        db = get_db_connection('dictionary')
         # Search in word_phrase, definition, and example fields
         results = db.execute("""
             SELECT id, word_phrase, definition, example, 
@@ -200,7 +223,6 @@ def api_search_dictionary():
         if db:
             close_db_connection(db)
 
-@app.route('/api/search/notes')
 def api_search_notes():
     """API endpoint for searching notes"""
     query = request.args.get('q', '').strip()
@@ -210,7 +232,7 @@ def api_search_notes():
     db = None
     try:
         # Get database connection
-        db = get_db_connection('notes.db')
+        db = get_db_connection('notes')
         
         # Split query into individual words for more flexible searching
         search_terms = [f"%{term}%" for term in query.split() if term.strip()]
@@ -267,12 +289,13 @@ def api_search_notes():
         return jsonify(formatted_results)
     except Exception as e:
         print(f"Error in notes search: {str(e)}")
-        app.logger.error(f"API search error (notes): {str(e)}")
+        current_app.logger.error(f"API search error (notes): {str(e)}")
         return jsonify({"error": "An error occurred while searching notes"}), 500
     finally:
         if db:
             close_db_connection(db)
 
+# Development server only; run serve.py in production
 if autoRun:
     if __name__ == '__main__':
-        app.run(debug=True, port=port, use_reloader=False)
+        create_app().run(debug=True, port=port, use_reloader=False)
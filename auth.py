@@ -1,12 +1,12 @@
-from flask import Flask, render_template, request, redirect, session, jsonify, Blueprint, url_for
-from flask_session import Session
-from datetime import datetime
-import pytz
-from sql import *  # Used for database connection and management
-from SarvAuth import *  # Used for user authentication functions
+from flask import render_template, request, redirect, session, Blueprint, url_for
+from user_store import get_user, login_retry_after, record_login, set_password_hash
+from passwords import verify_password, hash_password
 
 auth_blueprint = Blueprint('auth', __name__)
 
+# Seconds a login refused while password checks are backed up should wait
+BUSY_RETRY_AFTER = 5
+
 @auth_blueprint.route("/login", methods=["GET", "POST"])
 def login():
     if session.get("name"):
@@ -22,18 +22,38 @@ def login():
     if not username or not password:
         return render_template("/auth/login.html", error="Username and password are required")
         
-    password_hash = hash(password)
-    db = SQL("sqlite:///users.db")
-    users = db.execute("SELECT * FROM users WHERE username = :username", username=username)
-
-    if not users or users[0]["password"] != password_hash:
+    # Refuse quickly while this account or address is over its failure limit
+    address = request.remote_addr
+    retry_after = login_retry_after(username, address)
+    if retry_after:
+        response = render_template("/auth/login.html",
+                                   error=f"Too many failed attempts. Try again in {retry_after} seconds.")
+        return response, 429, {'Retry-After': str(retry_after)}
+        
+    user = get_user(username)
+    # Unknown users are checked against a dummy hash so they take as long
+    result = verify_password(password, user["password"] if user else None)
+    if result is None:
+        # Too many logins are being checked at once; not counted as a failure
+        response = render_template("/auth/login.html", error="The server is busy. Please try again in a moment.")
+        return response, 503, {'Retry-After': str(BUSY_RETRY_AFTER)}
+    matches, needs_rehash = result
+    if not matches:
+        record_login(username, address, False)
         return render_template("/auth/login.html", error="Invalid username or password")
             
-    # Successful login
+    # Successful login; upgrade an old or weaker hash while we have the password
+    record_login(username, address, True)
+    if needs_rehash:
+        set_password_hash(user, hash_password(password))
+    session.clear()
+    session.permanent = True
     session["name"] = username
+    session["username"] = username
+    session["user_id"] = user["id"]
     return redirect(url_for('dictionary.index'))
     
 @auth_blueprint.route("/logout")
 def logout():
-    session["name"] = None
+    session.clear()
     return redirect("/")
@@ -0,0 +1,222 @@
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+from datetime import datetime
+
+from storage import database_path
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Databases covered by backups (quizzes.db only holds short-lived sessions)
+DATABASES = ('notes', 'dictionary', 'calendar', 'users')
+
+BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(ROOT, 'backups'))
+
+# Pages copied per backup step, and the pause between steps in seconds, so
+# writers get the database back between steps
+PAGES_PER_STEP = 256
+STEP_PAUSE = 0.01
+
+# Retention: the newest KEEP_LAST backups, plus the newest backup of each of
+# the last KEEP_DAILY days and KEEP_WEEKLY weeks
+KEEP_LAST = 5
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+
+# <name>_backup_<YYYYmmdd_HHMMSS>[_<content hash>].db[.gz]
+BACKUP_NAME = re.compile(r'^(?P<name>\w+?)_backup_(?P<stamp>\d{8}_\d{6})(?:_(?P<digest>[0-9a-f]{12}))?\.db(?P<gz>\.gz)?$')
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def list_backups(name=None, backup_dir=BACKUP_DIR):
+    """Return backups as dicts (name, path, created, digest), newest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for filename in os.listdir(backup_dir):
+        match = BACKUP_NAME.match(filename)
+        if not match or (name and match.group('name') != name):
+            continue
+        backups.append({
+            'name': match.group('name'),
+            'path': os.path.join(backup_dir, filename),
+            'created': datetime.strptime(match.group('stamp'), '%Y%m%d_%H%M%S'),
+            'digest': match.group('digest'),
+            'compressed': bool(match.group('gz')),
+        })
+    backups.sort(key=lambda backup: backup['created'], reverse=True)
+    return backups
+
+def backup_database(name, backup_dir=BACKUP_DIR, compress=False):
+    """Take a consistent snapshot of a live database with SQLite's online backup API.
+
+    Pages are copied a step at a time, so the app keeps writing while the
+    backup runs, and any write during the backup makes SQLite restart it
+    from a consistent state. If the snapshot is identical to the newest
+    existing backup, it is discarded and that backup's path is returned.
+    Returns the path of the backup, or None if the database does not exist.
+    """
+    source_path = database_path(name)
+    if not os.path.exists(source_path):
+        return None
+    os.makedirs(backup_dir, exist_ok=True)
+
+    tmp_path = os.path.join(backup_dir, f".{name}_backup.tmp")
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=PAGES_PER_STEP, sleep=STEP_PAUSE)
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        digest = _file_digest(tmp_path)
+        latest = list_backups(name, backup_dir)
+        if latest and latest[0]['digest'] == digest:
+            # Nothing changed since the last backup
+            return latest[0]['path']
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_path = os.path.join(backup_dir, f"{name}_backup_{timestamp}_{digest}.db")
+        if compress:
+            backup_path += '.gz'
+            with open(tmp_path, 'rb') as src, gzip.open(backup_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            os.replace(tmp_path, backup_path)
+        return backup_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def backup_all(backup_dir=BACKUP_DIR, compress=False):
+    """Back up every database and apply the retention policy; return {name: path}"""
+    paths = {}
+    for name in DATABASES:
+        paths[name] = backup_database(name, backup_dir, compress)
+        prune_backups(name, backup_dir)
+    return paths
+
+def prune_backups(name, backup_dir=BACKUP_DIR, keep_last=KEEP_LAST,
+                  keep_daily=KEEP_DAILY, keep_weekly=KEEP_WEEKLY):
+    """Delete backups of a database that fall outside the retention policy.
+
+    Returns the paths that were removed.
+    """
+    backups = list_backups(name, backup_dir)
+    keep = set(backup['path'] for backup in backups[:keep_last])
+
+    days, weeks = set(), set()
+    for backup in backups:
+        day = backup['created'].date()
+        week = backup['created'].isocalendar()[:2]
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            keep.add(backup['path'])
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            keep.add(backup['path'])
+
+    removed = []
+    for backup in backups:
+        if backup['path'] not in keep:
+            os.remove(backup['path'])
+            removed.append(backup['path'])
+    return removed
+
+def restore_database(backup_path, name=None):
+    """Copy a backup back into the live database.
+
+    The restore also goes through the online backup API, so connections
+    the app holds stay valid and see the restored data. The current
+    database is backed up first. Returns the path of that safety backup.
+    """
+    filename = os.path.basename(backup_path)
+    match = BACKUP_NAME.match(filename)
+    if name is None:
+        if not match:
+            raise ValueError(f"Cannot tell which database {filename} belongs to; pass the name")
+        name = match.group('name')
+    if name not in DATABASES:
+        raise ValueError(f"Unknown database: {name}")
+
+    safety_backup = backup_database(name)
+
+    tmp_path = None
+    source_path = backup_path
+    if backup_path.endswith('.gz'):
+        tmp_path = os.path.join(os.path.dirname(backup_path), f".{name}_restore.tmp")
+        with gzip.open(backup_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        source_path = tmp_path
+
+    try:
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(database_path(name), timeout=30)
+        try:
+            if source.execute("PRAGMA integrity_check").fetchone()[0] != 'ok':
+                raise ValueError(f"{filename} failed its integrity check")
+            source.backup(target, pages=PAGES_PER_STEP, sleep=STEP_PAUSE)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return safety_backup
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up and restore the app databases')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help='Take backups and apply retention')
+    backup_parser.add_argument('names', nargs='*', help=f"Databases to back up: {', '.join(DATABASES)} (default: all)")
+    backup_parser.add_argument('--compress', action='store_true', help='Gzip the backups')
+
+    list_parser = subparsers.add_parser('list', help='List backups')
+    list_parser.add_argument('name', nargs='?', choices=list(DATABASES))
+
+    prune_parser = subparsers.add_parser('prune', help='Apply the retention policy')
+    prune_parser.add_argument('--keep-last', type=int, default=KEEP_LAST)
+    prune_parser.add_argument('--keep-daily', type=int, default=KEEP_DAILY)
+    prune_parser.add_argument('--keep-weekly', type=int, default=KEEP_WEEKLY)
+
+    restore_parser = subparsers.add_parser('restore', help='Restore a database from a backup')
+    restore_parser.add_argument('backup_path')
+    restore_parser.add_argument('--db', choices=list(DATABASES), help='Database to restore into')
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        unknown = set(args.names) - set(DATABASES)
+        if unknown:
+            parser.error(f"unknown database: {', '.join(sorted(unknown))}")
+        for name in args.names or DATABASES:
+            path = backup_database(name, compress=args.compress)
+            removed = prune_backups(name)
+            print(f"{name}: {path or 'no database'}" + (f" (pruned {len(removed)})" if removed else ""))
+    elif args.command == 'list':
+        for backup in list_backups(args.name):
+            size = os.path.getsize(backup['path'])
+            print(f"{backup['created']:%Y-%m-%d %H:%M:%S}  {backup['name']:<10}  {size:>10}  {backup['path']}")
+    elif args.command == 'prune':
+        for name in DATABASES:
+            for path in prune_backups(name, keep_last=args.keep_last,
+                                      keep_daily=args.keep_daily, keep_weekly=args.keep_weekly):
+                print(f"Removed {path}")
+    elif args.command == 'restore':
+        safety_backup = restore_database(args.backup_path, args.db)
+        print(f"Restored {args.backup_path} (previous state saved to {safety_backup})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passwords import ScryptHasher, SCRYPT_R, SCRYPT_P, HASH_WORKERS
+
+def time_hash(hasher, rounds):
+    """Median seconds to verify one password with a hasher"""
+    encoded = hasher.encode('benchmark-password')
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        hasher.verify('benchmark-password', encoded)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def time_concurrent(hasher, workers, logins):
+    """Seconds for a burst of logins through a pool of the given size"""
+    encoded = hasher.encode('benchmark-password')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda _: hasher.verify('benchmark-password', encoded), range(logins)))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Find the scrypt cost that keeps password checks near a target time on this machine')
+    parser.add_argument('--target-ms', type=float, default=250,
+                        help='Acceptable time for one password check (default: 250)')
+    parser.add_argument('--min-log2n', type=int, default=12)
+    parser.add_argument('--max-log2n', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5, help='Timings per setting (median is used)')
+    args = parser.parse_args()
+
+    print(f"scrypt r={SCRYPT_R} p={SCRYPT_P}, {os.cpu_count()} CPU(s)")
+    print(f"{'N':>10} {'memory':>8} {'ms':>8}")
+    chosen = None
+    for log2n in range(args.min_log2n, args.max_log2n + 1):
+        n = 2 ** log2n
+        seconds = time_hash(ScryptHasher(n, SCRYPT_R, SCRYPT_P), args.rounds)
+        memory_mb = 128 * n * SCRYPT_R * SCRYPT_P / 2 ** 20
+        print(f"{'2^' + str(log2n):>10} {memory_mb:>6.0f}MB {seconds * 1000:>8.1f}")
+        if seconds * 1000 <= args.target_ms:
+            chosen = n
+        else:
+            break
+
+    if chosen is None:
+        print(f"\nEven N=2^{args.min_log2n} takes longer than {args.target_ms:.0f}ms; lower --min-log2n")
+        return
+
+    burst = HASH_WORKERS * 4
+    seconds = time_concurrent(ScryptHasher(chosen, SCRYPT_R, SCRYPT_P), HASH_WORKERS, burst)
+    print(f"\n{burst} simultaneous logins through {HASH_WORKERS} hashing worker(s): "
+          f"{seconds:.2f}s, the last one waits {seconds * 1000:.0f}ms")
+    print(f"\nRecommended setting (add to .env):\nSCRYPT_N={chosen}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import uuid
+from datetime import date, datetime, timezone
+
+from calendar_recurrence import insert_series, prepare_series, set_exception
+
+PRODID = '-//LexiconJuris//Calendar//EN'
+UID_DOMAIN = 'lexiconjuris'
+
+# Events written per transaction during an import
+IMPORT_BATCH_SIZE = 500
+
+# Longest content line allowed by RFC 5545, in octets (without CRLF)
+MAX_LINE_OCTETS = 75
+
+def escape_text(value):
+    """Escape a TEXT property value"""
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+def unescape_text(value):
+    """Undo escape_text (and the other escapes RFC 5545 allows)"""
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            result.append('\n' if char in ('n', 'N') else char)
+        else:
+            result.append(char)
+    return ''.join(result)
+
+def fold_line(line):
+    """Split a content line into CRLF-terminated pieces of at most 75 octets"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= MAX_LINE_OCTETS:
+        return line + '\r\n'
+    pieces = []
+    piece, size, limit = [], 0, MAX_LINE_OCTETS
+    for char in line:
+        octets = len(char.encode('utf-8'))
+        if size + octets > limit:
+            pieces.append(''.join(piece))
+            # Continuation lines start with a space, which counts towards the limit
+            piece, size, limit = [], 0, MAX_LINE_OCTETS - 1
+        piece.append(char)
+        size += octets
+    pieces.append(''.join(piece))
+    return '\r\n '.join(pieces) + '\r\n'
+
+def _ics_date(iso_date):
+    return iso_date[:10].replace('-', '')
+
+def _event(uid, stamp, dtstart, title, description, extra=()):
+    lines = ['BEGIN:VEVENT', f'UID:{uid}', f'DTSTAMP:{stamp}',
+             f'DTSTART;VALUE=DATE:{_ics_date(dtstart)}', f'SUMMARY:{escape_text(title)}']
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    lines.extend(extra)
+    lines.append('END:VEVENT')
+    return ''.join(fold_line(line) for line in lines)
+
+def iter_ics(conn, user_id):
+    """Yield a user's calendar as iCalendar text, one event at a time.
+
+    Rows are read straight off the cursor, so memory use does not grow
+    with the size of the calendar. Series are exported with their RRULE,
+    cancelled occurrences as EXDATE and overrides as RECURRENCE-ID events.
+    """
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield ''.join(fold_line(line) for line in (
+        'BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN'))
+
+    for entry_id, entry_date, title, description in conn.execute("""
+        SELECT id, entry_date, title, description
+        FROM calendar_entries WHERE user_id = ?
+        ORDER BY entry_date
+    """, (user_id,)):
+        yield _event(f'entry-{entry_id}@{UID_DOMAIN}', stamp, entry_date, title, description)
+
+    for series_id, dtstart, rrule, title, description in conn.execute("""
+        SELECT id, dtstart, rrule, title, description
+        FROM calendar_recurrences WHERE user_id = ?
+        ORDER BY dtstart
+    """, (user_id,)):
+        uid = f'series-{series_id}@{UID_DOMAIN}'
+        exceptions = conn.execute("""
+            SELECT original_date, cancelled, entry_date, title, description
+            FROM calendar_recurrence_exceptions WHERE recurrence_id = ?
+            ORDER BY original_date
+        """, (series_id,)).fetchall()
+        extra = [f'RRULE:{rrule}']
+        cancelled = [_ics_date(row[0]) for row in exceptions if row[1]]
+        if cancelled:
+            extra.append('EXDATE;VALUE=DATE:' + ','.join(cancelled))
+        yield _event(uid, stamp, dtstart, title, description, extra)
+
+        for original_date, is_cancelled, entry_date, new_title, new_description in exceptions:
+            if is_cancelled:
+                continue
+            yield _event(uid, stamp, entry_date or original_date, new_title or title,
+                         new_description if new_description is not None else description,
+                         [f'RECURRENCE-ID;VALUE=DATE:{_ics_date(original_date)}'])
+
+    yield fold_line('END:VCALENDAR')
+
+def _unfolded_lines(lines):
+    """Join folded continuation lines, reading the input lazily.
+
+    Folding may split a multi-octet character, so lines are joined as
+    bytes and only a whole logical line is decoded.
+    """
+    current = None
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        line = line.rstrip(b'\r\n')
+        if line[:1] in (b' ', b'\t') and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current.decode('utf-8', errors='replace')
+        current = line
+    if current:
+        yield current.decode('utf-8', errors='replace')
+
+def _split_content_line(line):
+    """Split 'NAME;PARAM=x:value' into (NAME, value), respecting quoted parameters"""
+    quoted = False
+    for index, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            return line[:index].split(';', 1)[0].upper(), line[index + 1:]
+    return line.upper(), ''
+
+def _parse_date(value):
+    """Date part of a DATE or DATE-TIME value, as an ISO string (None if invalid)"""
+    try:
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8])).isoformat()
+    except ValueError:
+        return None
+
+def iter_events(lines):
+    """Parse VEVENTs from iCalendar lines (str or bytes), yielding one dict per event.
+
+    Works line by line, so an uploaded file is never held in memory whole.
+    Only the date of DTSTART is kept, as calendar entries are all-day.
+    Properties of components nested in an event (VALARM) are ignored.
+    """
+    stack = []
+    event = None
+    for line in _unfolded_lines(lines):
+        name, value = _split_content_line(line)
+        if name == 'BEGIN':
+            stack.append(value.upper())
+            if value.upper() == 'VEVENT':
+                event = {'uid': None, 'dtstart': None, 'summary': None, 'description': None,
+                         'rrule': None, 'exdates': [], 'recurrence_id': None}
+            continue
+        if name == 'END':
+            if stack and stack.pop() == 'VEVENT' and event is not None:
+                yield event
+                event = None
+            continue
+        if event is None or stack[-1] != 'VEVENT':
+            continue
+
+        if name == 'UID':
+            event['uid'] = value
+        elif name == 'DTSTART':
+            event['dtstart'] = _parse_date(value)
+        elif name == 'SUMMARY':
+            event['summary'] = unescape_text(value)
+        elif name == 'DESCRIPTION':
+            event['description'] = unescape_text(value)
+        elif name == 'RRULE':
+            event['rrule'] = value
+        elif name == 'EXDATE':
+            event['exdates'].extend(filter(None, (_parse_date(item) for item in value.split(','))))
+        elif name == 'RECURRENCE-ID':
+            event['recurrence_id'] = _parse_date(value)
+
+def _write_batch(conn, user_id, import_id, entries, series, series_by_uid, counts):
+    """Insert one prepared batch in its own transaction"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO calendar_entries (user_id, entry_date, title, description, import_id)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(user_id, *entry, import_id) for entry in entries])
+        for prepared, title, description, uid, exdates in series:
+            series_id = insert_series(cursor, user_id, prepared, title, description, import_id)
+            if uid:
+                series_by_uid[uid] = series_id
+            cursor.executemany("""
+                INSERT OR REPLACE INTO calendar_recurrence_exceptions (recurrence_id, original_date, cancelled)
+                VALUES (?, ?, 1)
+            """, [(series_id, exdate) for exdate in exdates])
+            counts['exceptions'] += len(exdates)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    counts['entries'] += len(entries)
+    counts['series'] += len(series)
+
+def _write_overrides(conn, overrides, series_by_uid, counts):
+    """Apply RECURRENCE-ID events to series imported earlier, in one transaction"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        for event in overrides:
+            set_exception(cursor, series_by_uid[event['uid']], event['recurrence_id'],
+                          entry_date=event['dtstart'] if event['dtstart'] != event['recurrence_id'] else None,
+                          title=event['summary'], description=event['description'])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    counts['exceptions'] += len(overrides)
+
+def remove_import(conn, user_id, import_id):
+    """Delete everything one import added (exceptions go with their series)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM calendar_entries WHERE user_id = ? AND import_id = ?", (user_id, import_id))
+        conn.execute("DELETE FROM calendar_recurrences WHERE user_id = ? AND import_id = ?", (user_id, import_id))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def import_events(conn, user_id, events, batch_size=IMPORT_BATCH_SIZE):
+    """Store parsed events for a user, batch_size events per transaction.
+
+    conn must be in autocommit mode (isolation_level=None). Each batch is
+    parsed and validated before the write lock is taken, so other writers
+    only wait for the inserts. Repeating events become series, EXDATEs
+    cancelled occurrences and RECURRENCE-ID events overrides of the series
+    with the same UID. Every row is tagged with a fresh import_id; if the
+    import fails part way, the batches already committed are removed again.
+    Returns counts per kind.
+    """
+    import_id = uuid.uuid4().hex
+    counts = {'entries': 0, 'series': 0, 'exceptions': 0, 'skipped': 0}
+    series_by_uid = {}
+    overrides = []
+    entries, series = [], []
+
+    try:
+        for event in events:
+            if not event['dtstart']:
+                counts['skipped'] += 1
+                continue
+            title = event['summary'] or 'Untitled'
+
+            if event['recurrence_id']:
+                # Applied once every series in the file exists
+                overrides.append(event)
+            elif event['rrule']:
+                try:
+                    prepared = prepare_series(event['dtstart'], event['rrule'])
+                except ValueError:
+                    counts['skipped'] += 1
+                    continue
+                series.append((prepared, title, event['description'], event['uid'], event['exdates']))
+            else:
+                entries.append((event['dtstart'], title, event['description']))
+            if len(entries) + len(series) >= batch_size:
+                _write_batch(conn, user_id, import_id, entries, series, series_by_uid, counts)
+                entries, series = [], []
+        _write_batch(conn, user_id, import_id, entries, series, series_by_uid, counts)
+
+        # The series itself was not in the file; keep the occurrence on its own
+        entries = [(event['dtstart'], event['summary'] or 'Untitled', event['description'])
+                   for event in overrides if event['uid'] not in series_by_uid]
+        overrides = [event for event in overrides if event['uid'] in series_by_uid]
+        for offset in range(0, len(entries), batch_size):
+            _write_batch(conn, user_id, import_id, entries[offset:offset + batch_size], [], series_by_uid, counts)
+        for offset in range(0, len(overrides), batch_size):
+            _write_overrides(conn, overrides[offset:offset + batch_size], series_by_uid, counts)
+    except Exception:
+        remove_import(conn, user_id, import_id)
+        raise
+    return counts
@@ -0,0 +1,390 @@
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import islice
+
+# The subset of RFC 5545 recurrence rules that series can use
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+# Upper bound on the occurrences one series contributes to a window
+MAX_OCCURRENCES = 1000
+
+# Larger COUNT and INTERVAL values are clamped to these
+MAX_COUNT = 5000
+MAX_INTERVAL = 1000
+
+# Expanded windows kept per process, least recently used dropped first
+WINDOW_CACHE_SIZE = 256
+
+SIGNATURE_SQL = """
+    SELECT COUNT(*), MAX(updated_at), TOTAL(id)
+    FROM calendar_recurrences WHERE user_id = ?
+"""
+
+# Series that can have occurrences in [start, end): (user_id, end, start)
+WINDOW_SERIES_SQL = """
+    SELECT id, dtstart, rrule, until, title, description
+    FROM calendar_recurrences
+    WHERE user_id = ? AND dtstart < ? AND (until IS NULL OR until >= ?)
+"""
+WINDOW_EXCEPTIONS_SQL = """
+    SELECT recurrence_id, original_date, cancelled, entry_date, title, description
+    FROM calendar_recurrence_exceptions
+    WHERE recurrence_id = ? AND original_date >= ? AND original_date < ?
+"""
+# Overrides moving an occurrence of any series into [start, end): (start, end, user_id)
+MOVED_IN_SQL = """
+    SELECT e.recurrence_id, e.original_date, e.cancelled, e.entry_date, e.title, e.description,
+           r.title, r.description
+    FROM calendar_recurrence_exceptions e
+    JOIN calendar_recurrences r ON r.id = e.recurrence_id
+    WHERE e.entry_date >= ? AND e.entry_date < ? AND r.user_id = ?
+"""
+# The same for one series: (recurrence_id, start, end)
+SERIES_MOVED_IN_SQL = """
+    SELECT recurrence_id, original_date, cancelled, entry_date, title, description
+    FROM calendar_recurrence_exceptions
+    WHERE recurrence_id = ? AND entry_date >= ? AND entry_date < ?
+"""
+EXCEPTION_COLUMNS = ('recurrence_id', 'original_date', 'cancelled', 'entry_date', 'title', 'description')
+
+def _positive_int(value, name, maximum):
+    """Parse a positive integer, clamped to maximum"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return min(number, maximum)
+
+def _parse_rrule_date(value):
+    """Accept UNTIL as YYYYMMDD, YYYYMMDDTHHMMSS[Z] or an ISO date"""
+    try:
+        if '-' in value:
+            return date.fromisoformat(value[:10])
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    except ValueError:
+        raise ValueError(f"Invalid UNTIL date: {value}")
+
+def parse_rrule(text):
+    """Parse a recurrence rule into a dict (freq, interval, count, until, byday).
+
+    Supports FREQ=DAILY|WEEKLY|MONTHLY|YEARLY with INTERVAL, COUNT, UNTIL
+    and, for weekly rules, BYDAY. Raises ValueError for anything else.
+    """
+    parts = {}
+    for part in text.strip().upper().removeprefix('RRULE:').split(';'):
+        if not part:
+            continue
+        key, _, value = part.partition('=')
+        if not value:
+            raise ValueError(f"Malformed RRULE part: {part}")
+        parts[key] = value
+
+    rule = {'freq': parts.pop('FREQ', None), 'interval': 1, 'count': None, 'until': None, 'byday': None}
+    if rule['freq'] not in FREQUENCIES:
+        raise ValueError(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+    if 'INTERVAL' in parts:
+        rule['interval'] = _positive_int(parts.pop('INTERVAL'), 'INTERVAL', MAX_INTERVAL)
+    if 'COUNT' in parts:
+        rule['count'] = _positive_int(parts.pop('COUNT'), 'COUNT', MAX_COUNT)
+    if 'UNTIL' in parts:
+        rule['until'] = _parse_rrule_date(parts.pop('UNTIL'))
+    if rule['count'] and rule['until']:
+        raise ValueError("COUNT and UNTIL cannot both be given")
+    if 'BYDAY' in parts:
+        if rule['freq'] != 'WEEKLY':
+            raise ValueError("BYDAY is only supported for weekly rules")
+        days = parts.pop('BYDAY').split(',')
+        if not set(days) <= set(WEEKDAYS):
+            raise ValueError(f"BYDAY must list days from {','.join(WEEKDAYS)}")
+        rule['byday'] = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+    if parts:
+        raise ValueError(f"Unsupported RRULE parts: {', '.join(sorted(parts))}")
+    return rule
+
+def format_rrule(rule):
+    """Return the canonical RRULE text of a parsed rule"""
+    text = f"FREQ={rule['freq']}"
+    if rule['interval'] != 1:
+        text += f";INTERVAL={rule['interval']}"
+    if rule['byday']:
+        text += ";BYDAY=" + ','.join(WEEKDAYS[day] for day in rule['byday'])
+    if rule['count']:
+        text += f";COUNT={rule['count']}"
+    if rule['until']:
+        text += f";UNTIL={rule['until'].strftime('%Y%m%d')}"
+    return text
+
+def _occurrences_from(dtstart, rule, start):
+    """Yield a rule's occurrences in order, beginning at the period containing start.
+
+    Jumps straight to that period instead of walking from dtstart, so the
+    cost depends on the window, not on how long the series has run. Stops
+    at the last date Python can represent.
+    """
+    try:
+        yield from _unbounded_occurrences(dtstart, rule, start)
+    except OverflowError:
+        return
+
+def _unbounded_occurrences(dtstart, rule, start):
+    interval = rule['interval']
+    freq = rule['freq']
+
+    if freq == 'DAILY':
+        step = max(0, -(-(start - dtstart).days // interval))
+        day = dtstart + timedelta(days=step * interval)
+        while True:
+            yield day
+            day += timedelta(days=interval)
+
+    elif freq == 'WEEKLY':
+        weekdays = rule['byday'] or (dtstart.weekday(),)
+        first_week = dtstart - timedelta(days=dtstart.weekday())
+        step = max(0, (start - first_week).days // 7 // interval)
+        week = first_week + timedelta(weeks=step * interval)
+        while True:
+            for weekday in weekdays:
+                day = week + timedelta(days=weekday)
+                if day >= dtstart:
+                    yield day
+            week += timedelta(weeks=interval)
+
+    else:
+        # Months (or years) without the start's day, e.g. the 31st, are
+        # skipped rather than clamped, as RFC 5545 specifies
+        months = 1 if freq == 'MONTHLY' else 12
+        first = dtstart.year * 12 + dtstart.month - 1
+        step = max(0, (start.year * 12 + start.month - 1 - first) // (interval * months))
+        month = first + step * interval * months
+        while True:
+            year, index = divmod(month, 12)
+            if year > date.max.year:
+                return
+            try:
+                yield date(year, index + 1, dtstart.day)
+            except ValueError:
+                pass
+            month += interval * months
+
+def last_occurrence(dtstart, rule):
+    """Return the date a rule ends on, or None if it repeats forever.
+
+    Daily and weekly COUNT rules are worked out directly; monthly and
+    yearly ones (which skip months without the start's day) are counted,
+    at most MAX_COUNT steps. Raises ValueError if the series would run
+    past the last representable date.
+    """
+    count = rule['count']
+    if not count:
+        return rule['until']
+    try:
+        if rule['freq'] == 'DAILY':
+            return dtstart + timedelta(days=(count - 1) * rule['interval'])
+        if rule['freq'] == 'WEEKLY':
+            weekdays = rule['byday'] or (dtstart.weekday(),)
+            first_week = dtstart - timedelta(days=dtstart.weekday())
+            # The first week only has the days from dtstart on
+            in_first_week = [day for day in weekdays if day >= dtstart.weekday()]
+            if count <= len(in_first_week):
+                return first_week + timedelta(days=in_first_week[count - 1])
+            weeks, index = divmod(count - len(in_first_week) - 1, len(weekdays))
+            return first_week + timedelta(weeks=(weeks + 1) * rule['interval'], days=weekdays[index])
+    except OverflowError:
+        raise ValueError("The series runs past the last supported date")
+    last = next(islice(_occurrences_from(dtstart, rule, dtstart), count - 1, None), None)
+    if last is None:
+        raise ValueError("The series runs past the last supported date")
+    return last
+
+def expand(dtstart, rule, start, end, until=None):
+    """Return the occurrence dates of a rule in [start, end).
+
+    until is the series' last occurrence (see last_occurrence); passing it
+    means COUNT rules need not be counted from dtstart again.
+    """
+    if until is None:
+        until = last_occurrence(dtstart, rule)
+    dates = []
+    for day in _occurrences_from(dtstart, rule, start):
+        if day >= end or (until and day > until) or len(dates) >= MAX_OCCURRENCES:
+            break
+        if day >= start:
+            dates.append(day)
+    return dates
+
+def recurrence_signature(conn, user_id):
+    """Return a value that changes whenever any of a user's series or exceptions change"""
+    return tuple(conn.execute(SIGNATURE_SQL, (user_id,)).fetchone())
+
+def _occurrence(series, original_date, exception=None):
+    occurrence = {
+        'id': f"{series['id']}:{original_date}",
+        'recurrence_id': series['id'],
+        'original_date': original_date,
+        'entry_date': original_date,
+        'title': series['title'],
+        'description': series['description'],
+    }
+    if exception:
+        for column in ('entry_date', 'title', 'description'):
+            if exception[column] is not None:
+                occurrence[column] = exception[column]
+    return occurrence
+
+def _generated(series, exceptions, start, end):
+    """Occurrences a series generates in [start, end) that are not cancelled or moved out.
+
+    exceptions maps the series' original dates in the window to their rows.
+    """
+    rule = parse_rrule(series['rrule'])
+    until = date.fromisoformat(series['until']) if series['until'] else None
+    occurrences = []
+    for day in expand(date.fromisoformat(series['dtstart']), rule,
+                      date.fromisoformat(start), date.fromisoformat(end), until):
+        original_date = day.isoformat()
+        exception = exceptions.get(original_date)
+        if exception and exception['cancelled']:
+            continue
+        if exception and exception['entry_date'] and not start <= exception['entry_date'] < end:
+            # Moved out of the window
+            continue
+        occurrences.append(_occurrence(series, original_date, exception))
+    return occurrences
+
+def _moved_in(series, exception, start, end):
+    """The occurrence an override moves into [start, end) from outside it, or None"""
+    if exception['cancelled'] or start <= exception['original_date'] < end:
+        return None
+    return _occurrence(series, exception['original_date'], exception)
+
+def _expand_window(conn, user_id, start, end):
+    series_rows = conn.execute(WINDOW_SERIES_SQL, (user_id, end, start)).fetchall()
+    columns = ('id', 'dtstart', 'rrule', 'until', 'title', 'description')
+    series_by_id = {row[0]: dict(zip(columns, row)) for row in series_rows}
+
+    # Exceptions for occurrences generated in the window, plus overrides
+    # that move an occurrence of any series into it
+    occurrences = []
+    for series in series_by_id.values():
+        exceptions = {row[1]: dict(zip(EXCEPTION_COLUMNS, row))
+                      for row in conn.execute(WINDOW_EXCEPTIONS_SQL, (series['id'], start, end))}
+        occurrences.extend(_generated(series, exceptions, start, end))
+
+    for row in conn.execute(MOVED_IN_SQL, (start, end, user_id)).fetchall():
+        series = {'id': row[0], 'title': row[6], 'description': row[7]}
+        occurrence = _moved_in(series, dict(zip(EXCEPTION_COLUMNS, row[:6])), start, end)
+        if occurrence:
+            occurrences.append(occurrence)
+
+    occurrences.sort(key=lambda occurrence: (occurrence['entry_date'], occurrence['recurrence_id']))
+    return occurrences
+
+def series_occurrences(conn, series, start, end):
+    """Return one series' occurrences in [start, end) with its exceptions applied, sorted by date"""
+    exceptions = {row[1]: dict(zip(EXCEPTION_COLUMNS, row))
+                  for row in conn.execute(WINDOW_EXCEPTIONS_SQL, (series['id'], start, end)).fetchall()}
+    occurrences = _generated(series, exceptions, start, end)
+    for row in conn.execute(SERIES_MOVED_IN_SQL, (series['id'], start, end)).fetchall():
+        occurrence = _moved_in(series, dict(zip(EXCEPTION_COLUMNS, row)), start, end)
+        if occurrence:
+            occurrences.append(occurrence)
+    occurrences.sort(key=lambda occurrence: occurrence['entry_date'])
+    return occurrences
+
+def next_occurrence(series, after):
+    """Return the first date on or after a date that a series generates, or None"""
+    until = date.fromisoformat(series['until']) if series['until'] else None
+    for day in _occurrences_from(date.fromisoformat(series['dtstart']), parse_rrule(series['rrule']), after):
+        if until and day > until:
+            return None
+        if day >= after:
+            return day
+    return None
+
+_window_cache = OrderedDict()
+_window_cache_lock = threading.Lock()
+
+def get_occurrences(conn, user_id, start, end):
+    """Return a user's series occurrences in [start, end), sorted by date.
+
+    Expansions are cached per (user, window) and reused while the user's
+    recurrence_signature is unchanged. Treat the result as read-only.
+    """
+    key = (user_id, start, end)
+    signature = recurrence_signature(conn, user_id)
+    with _window_cache_lock:
+        cached = _window_cache.get(key)
+        if cached and cached[0] == signature:
+            _window_cache.move_to_end(key)
+            return cached[1]
+
+    occurrences = _expand_window(conn, user_id, start, end) if signature[0] else []
+    with _window_cache_lock:
+        _window_cache[key] = (signature, occurrences)
+        _window_cache.move_to_end(key)
+        while len(_window_cache) > WINDOW_CACHE_SIZE:
+            _window_cache.popitem(last=False)
+    return occurrences
+
+def get_series(conn, user_id, series_id):
+    """Return one of a user's series as a dict, or None"""
+    row = conn.execute("""
+        SELECT id, dtstart, rrule, until, title, description
+        FROM calendar_recurrences WHERE id = ? AND user_id = ?
+    """, (series_id, user_id)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('id', 'dtstart', 'rrule', 'until', 'title', 'description'), row))
+
+def prepare_series(dtstart, rrule):
+    """Validate a series; returns (dtstart, rrule, until) as stored. Raises ValueError for an unusable rule"""
+    rule = parse_rrule(rrule)
+    start = date.fromisoformat(dtstart)
+    until = last_occurrence(start, rule)
+    if until and until < start:
+        raise ValueError("UNTIL is before the first occurrence")
+    return start.isoformat(), format_rrule(rule), until.isoformat() if until else None
+
+def insert_series(cursor, user_id, prepared, title, description=None, import_id=None):
+    """Store a series checked by prepare_series; returns its id"""
+    cursor.execute("""
+        INSERT INTO calendar_recurrences (user_id, dtstart, rrule, until, title, description,
+                                          import_id, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    """, (user_id, *prepared, title, description, import_id))
+    return cursor.lastrowid
+
+def add_series(cursor, user_id, dtstart, rrule, title, description=None):
+    """Store a series; returns its id. Raises ValueError for an unusable rule"""
+    return insert_series(cursor, user_id, prepare_series(dtstart, rrule), title, description)
+
+def touch_series(cursor, series_id):
+    """Bump a series' updated_at so cached expansions and ETags are invalidated"""
+    cursor.execute("""
+        UPDATE calendar_recurrences SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE id = ?
+    """, (series_id,))
+
+def set_exception(cursor, series_id, original_date, cancelled=False, entry_date=None,
+                  title=None, description=None):
+    """Cancel or override one occurrence of a series (replacing any earlier exception)"""
+    cursor.execute("""
+        INSERT OR REPLACE INTO calendar_recurrence_exceptions
+            (recurrence_id, original_date, cancelled, entry_date, title, description)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (series_id, original_date, 1 if cancelled else 0, entry_date, title, description))
+    touch_series(cursor, series_id)
+
+def is_occurrence(series, original_date):
+    """Whether a series generates an occurrence on an ISO date (False if it is not a date)"""
+    try:
+        day = date.fromisoformat(original_date)
+    except ValueError:
+        return False
+    until = date.fromisoformat(series['until']) if series['until'] else None
+    return day in expand(date.fromisoformat(series['dtstart']), parse_rrule(series['rrule']),
+                         day, day + timedelta(days=1), until)
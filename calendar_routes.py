@@ -1,14 +1,48 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, session,
+                   make_response, Response, stream_with_context)
 from datetime import datetime, date
-from sql import SQL
+from storage import get_sql, get_db, connect_db
+from calendar_service import month_range, parse_range, window_etag, get_window, entries_by_day
+from calendar_recurrence import FREQUENCIES, add_series, get_series, set_exception, is_occurrence
+from calendar_ics import iter_ics, iter_events, import_events
+from study_scheduler import get_study_scheduler, due_tasks, upcoming_tasks, finish_task
+import hashlib
 import os
 
+# Templates the month page is rendered from
+PAGE_TEMPLATES = ('calendar/index.html', 'calendar/base.html', 'base.html')
+
+def template_version(names):
+    """Short hash of the templates' contents"""
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    digest = hashlib.sha256()
+    for name in names:
+        with open(os.path.join(folder, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+# Part of the month page's ETag, so a deploy with new templates invalidates
+# cached pages; the same in every worker process, unlike a start time
+PAGE_VERSION = template_version(PAGE_TEMPLATES)
+
 # Create blueprint
 calendar_bp = Blueprint('calendar', __name__, url_prefix='/calendar')
 
 def get_calendar_db():
     """Helper function to get a database connection for the calendar."""
-    return SQL("sqlite:///calendar.db")
+    return get_sql('calendar')
+
+def calendar_not_modified(etag):
+    """304 response for a client that already has the current version"""
+    response = make_response('', 304)
+    set_calendar_cache_headers(response, etag)
+    return response
+
+def set_calendar_cache_headers(response, etag):
+    """Let the browser keep a response but revalidate it on every use"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @calendar_bp.route('/')
 def index():
@@ -22,43 +56,30 @@ def index():
     year = request.args.get('year', today.year, type=int)
     month = request.args.get('month', today.month, type=int)
     
-    # Get entries for the month
-    db = get_calendar_db()
-    start_date = date(year, month, 1)
-    if month == 12:
-        end_date = date(year + 1, 1, 1)
-    else:
-        end_date = date(year, month + 1, 1)
+    # One range query over the (user_id, entry_date) index plus the month's
+    # series occurrences, grouped by day
+    db = get_db()
+    user_id = session.get('user_id')
+    start_date, end_date = month_range(year, month)
     
-    entries = db.execute(
-        """
-        SELECT id, entry_date, title, description 
-        FROM calendar_entries 
-        WHERE user_id = :user_id 
-        AND entry_date >= :start_date 
-        AND entry_date < :end_date
-        ORDER BY entry_date
-        """,
-        user_id=session.get("id"),
-        start_date=start_date.isoformat(),
-        end_date=end_date.isoformat()
-    )
+    # The page also shows today's date and any flashed messages
+    etag = f"{window_etag(db, user_id, start_date, end_date)}-{today.isoformat()}-{PAGE_VERSION}"
+    cacheable = not session.get('_flashes')
+    if cacheable and request.if_none_match.contains(etag):
+        return calendar_not_modified(etag)
     
-    # Organize entries by date
-    entries_by_date = {}
-    for entry in entries:
-        entry_date = datetime.strptime(entry['entry_date'], '%Y-%m-%d').date()
-        if entry_date not in entries_by_date:
-            entries_by_date[entry_date] = []
-        entries_by_date[entry_date].append(entry)
+    entries_by_date = entries_by_day(get_window(db, user_id, start_date, end_date))
     
-    return render_template(
+    response = make_response(render_template(
         'calendar/index.html',
         year=year,
         month=month,
         today=today,
         entries=entries_by_date
-    )
+    ))
+    if cacheable:
+        set_calendar_cache_headers(response, etag)
+    return response
 
 @calendar_bp.route('/add', methods=['GET', 'POST'])
 def add_entry():
@@ -71,13 +92,32 @@ def add_entry():
         entry_date = request.form.get('entry_date')
         title = request.form.get('title', '').strip()
         description = request.form.get('description', '').strip()
+        repeat = request.form.get('repeat', '').upper()
+        repeat_until = request.form.get('repeat_until', '').strip()
+        form = dict(entry_date=entry_date, title=title, description=description,
+                    repeat=repeat, repeat_until=repeat_until)
         
         if not title:
             flash('Title is required.', 'error')
-            return render_template('calendar/add.html', 
-                               entry_date=entry_date,
-                               title=title,
-                               description=description)
+            return render_template('calendar/add.html', **form)
+        
+        if repeat in FREQUENCIES:
+            # Repeating entries are stored once as a series and expanded when viewed
+            conn = connect_db('calendar')
+            try:
+                rrule = f"FREQ={repeat}" + (f";UNTIL={repeat_until}" if repeat_until else "")
+                add_series(conn.cursor(), session['user_id'], entry_date, rrule, title,
+                           description if description else None)
+                conn.commit()
+            except ValueError as e:
+                flash(f'Invalid repeat settings: {str(e)}', 'error')
+                return render_template('calendar/add.html', **form)
+            finally:
+                conn.close()
+            
+            get_study_scheduler().wake()
+            flash('Repeating calendar entry added successfully!', 'success')
+            return redirect(url_for('calendar.index'))
         
         try:
             db = get_calendar_db()
@@ -92,15 +132,13 @@ def add_entry():
                 description=description if description else None
             )
             
+            get_study_scheduler().wake()
             flash('Calendar entry added successfully!', 'success')
             return redirect(url_for('calendar.index'))
             
         except Exception as e:
             flash(f'Error adding calendar entry: {str(e)}', 'error')
-            return render_template('calendar/add.html', 
-                               entry_date=entry_date,
-                               title=title,
-                               description=description)
+            return render_template('calendar/add.html', **form)
     
     # For GET request, pre-fill the date if provided
     entry_date = request.args.get('date')
@@ -165,7 +203,7 @@ def edit_entry(entry_id):
                 UPDATE calendar_entries 
                 SET title = :title, 
                     description = :description,
-                    updated_at = CURRENT_TIMESTAMP
+                    updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
                 WHERE id = :id AND user_id = :user_id
                 """,
                 id=entry_id,
@@ -174,6 +212,7 @@ def edit_entry(entry_id):
                 description=description if description else None
             )
             
+            get_study_scheduler().wake()
             flash('Calendar entry updated successfully!', 'success')
             return redirect(url_for('calendar.view_entry', entry_id=entry_id))
             
@@ -218,7 +257,8 @@ def delete_entry(entry_id):
             user_id=session['user_id']
         )
         
-        if result.rowcount > 0:
+        # The SQL wrapper returns the number of rows deleted
+        if result > 0:
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Entry not found or access denied'}), 404
@@ -226,46 +266,227 @@ def delete_entry(entry_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@calendar_bp.route('/series/<int:series_id>/<occurrence_date>')
+def view_occurrence(series_id, occurrence_date):
+    """View one occurrence of a repeating entry."""
+    if 'user_id' not in session:
+        flash('Please log in to view calendar entries.', 'error')
+        return redirect(url_for('auth.login'))
+    
+    db = get_db()
+    series = get_series(db, session['user_id'], series_id)
+    if not series or not is_occurrence(series, occurrence_date):
+        flash('Calendar entry not found or access denied.', 'error')
+        return redirect(url_for('calendar.index'))
+    
+    occurrence = dict(series, original_date=occurrence_date, entry_date=occurrence_date)
+    exception = db.execute("""
+        SELECT cancelled, entry_date, title, description
+        FROM calendar_recurrence_exceptions
+        WHERE recurrence_id = ? AND original_date = ?
+    """, (series_id, occurrence_date)).fetchone()
+    if exception:
+        if exception['cancelled']:
+            flash('That occurrence was removed from the series.', 'error')
+            return redirect(url_for('calendar.index'))
+        for column in ('entry_date', 'title', 'description'):
+            if exception[column] is not None:
+                occurrence[column] = exception[column]
+    
+    return render_template('calendar/occurrence.html', entry=occurrence)
+
+@calendar_bp.route('/series/<int:series_id>/<occurrence_date>/edit', methods=['POST'])
+def edit_occurrence(series_id, occurrence_date):
+    """Change the date, title or description of one occurrence."""
+    if 'user_id' not in session:
+        flash('Please log in to edit calendar entries.', 'error')
+        return redirect(url_for('auth.login'))
+    
+    title = request.form.get('title', '').strip()
+    description = request.form.get('description', '').strip()
+    entry_date = parse_range(request.form.get('entry_date'), occurrence_date)
+    if not title or not entry_date:
+        flash('Title and a valid date are required.', 'error')
+        return redirect(url_for('calendar.view_occurrence', series_id=series_id, occurrence_date=occurrence_date))
+    
+    conn = connect_db('calendar')
+    try:
+        series = get_series(conn, session['user_id'], series_id)
+        if not series or not is_occurrence(series, occurrence_date):
+            flash('Calendar entry not found or access denied.', 'error')
+            return redirect(url_for('calendar.index'))
+        set_exception(conn.cursor(), series_id, occurrence_date,
+                      entry_date=entry_date[0] if entry_date[0] != occurrence_date else None,
+                      title=title if title != series['title'] else None,
+                      description=description if description != (series['description'] or '') else None)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    get_study_scheduler().wake()
+    flash('Occurrence updated successfully!', 'success')
+    return redirect(url_for('calendar.view_occurrence', series_id=series_id, occurrence_date=occurrence_date))
+
+@calendar_bp.route('/series/<int:series_id>/<occurrence_date>/skip', methods=['POST'])
+def skip_occurrence(series_id, occurrence_date):
+    """Remove one occurrence from a repeating entry."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+    
+    conn = connect_db('calendar')
+    try:
+        series = get_series(conn, session['user_id'], series_id)
+        if not series or not is_occurrence(series, occurrence_date):
+            return jsonify({'success': False, 'error': 'Entry not found or access denied'}), 404
+        set_exception(conn.cursor(), series_id, occurrence_date, cancelled=True)
+        conn.commit()
+    finally:
+        conn.close()
+    get_study_scheduler().wake()
+    return jsonify({'success': True})
+
+@calendar_bp.route('/series/<int:series_id>/delete', methods=['POST'])
+def delete_series(series_id):
+    """Delete a repeating entry with all its occurrences."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+    
+    # connect_db turns foreign keys on, so exceptions cascade with the series
+    conn = connect_db('calendar')
+    try:
+        deleted = conn.execute(
+            "DELETE FROM calendar_recurrences WHERE id = ? AND user_id = ?",
+            (series_id, session['user_id'])
+        ).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if deleted:
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': 'Entry not found or access denied'}), 404
+
+@calendar_bp.route('/export.ics')
+def export_ics():
+    """Download the user's calendar as an iCalendar feed."""
+    if 'user_id' not in session:
+        flash('Please log in to export your calendar.', 'error')
+        return redirect(url_for('auth.login'))
+    
+    user_id = session['user_id']
+    
+    def generate():
+        # A read-only connection of its own, open only while the feed is sent
+        conn = connect_db('calendar', readonly=True)
+        try:
+            yield from iter_ics(conn, user_id)
+        finally:
+            conn.close()
+    
+    return Response(stream_with_context(generate()), mimetype='text/calendar',
+                    headers={'Content-Disposition': 'attachment; filename=calendar.ics'})
+
+@calendar_bp.route('/import', methods=['POST'])
+def import_ics():
+    """Add the events of an uploaded .ics file to the user's calendar."""
+    if 'user_id' not in session:
+        flash('Please log in to import calendar entries.', 'error')
+        return redirect(url_for('auth.login'))
+    
+    upload = request.files.get('ics_file')
+    if not upload or not upload.filename:
+        flash('Please choose an .ics file to import.', 'error')
+        return redirect(url_for('calendar.index'))
+    
+    conn = connect_db('calendar', isolation_level=None)
+    try:
+        counts = import_events(conn, session['user_id'], iter_events(upload.stream))
+    except Exception as e:
+        flash(f'Error importing calendar: {str(e)}', 'error')
+        return redirect(url_for('calendar.index'))
+    finally:
+        conn.close()
+    
+    get_study_scheduler().wake()
+    message = f"Imported {counts['entries']} entries and {counts['series']} repeating entries"
+    if counts['skipped']:
+        message += f" ({counts['skipped']} events without a date or with unsupported repeat rules skipped)"
+    flash(message + '.', 'success')
+    return redirect(url_for('calendar.index'))
+
+@calendar_bp.route('/tasks')
+def study_tasks():
+    """List study tasks that are due now or in the coming week."""
+    if 'user_id' not in session:
+        flash('Please log in to view your study tasks.', 'error')
+        return redirect(url_for('auth.login'))
+    
+    # Tasks are generated in the background; make sure this process's worker runs
+    get_study_scheduler().wake()
+    
+    db = get_db()
+    today = date.today().isoformat()
+    return render_template('calendar/tasks.html',
+                           due=due_tasks(db, session['user_id'], today),
+                           upcoming=upcoming_tasks(db, session['user_id'], today),
+                           today=today)
+
+@calendar_bp.route('/tasks/<int:task_id>/<action>', methods=['POST'])
+def finish_study_task(task_id, action):
+    """Mark a study task done or dismiss it."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+    if action not in ('done', 'dismiss'):
+        return jsonify({'success': False, 'error': 'Unknown action'}), 400
+    
+    conn = connect_db('calendar')
+    try:
+        finished = finish_task(conn.cursor(), session['user_id'], task_id,
+                               'done' if action == 'done' else 'dismissed')
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if finished:
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': 'Task not found or already finished'}), 404
+
 @calendar_bp.route('/api/entries')
 def api_entries():
     """API endpoint to get calendar entries for a date range."""
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    start_date = request.args.get('start')
-    end_date = request.args.get('end')
-    
-    if not start_date or not end_date:
+    date_range = parse_range(request.args.get('start'), request.args.get('end'))
+    if not date_range:
         return jsonify({'error': 'Start and end dates are required'}), 400
+    start_date, end_date = date_range
     
     try:
-        db = get_calendar_db()
-        entries = db.execute(
-            """
-            SELECT id, entry_date as start, title, description
-            FROM calendar_entries 
-            WHERE user_id = :user_id 
-            AND entry_date >= :start_date 
-            AND entry_date <= :end_date
-            ORDER BY entry_date
-            """,
-            user_id=session['user_id'],
-            start_date=start_date,
-            end_date=end_date
-        )
+        db = get_db()
+        
+        # Month navigation revalidates; unchanged ranges cost one index lookup
+        etag = window_etag(db, session['user_id'], start_date, end_date)
+        if request.if_none_match.contains(etag):
+            return calendar_not_modified(etag)
         
         # Format for FullCalendar
         formatted_entries = []
-        for entry in entries:
+        for entry in get_window(db, session['user_id'], start_date, end_date):
+            if entry['recurrence_id']:
+                url = url_for('calendar.view_occurrence', series_id=entry['recurrence_id'],
+                              occurrence_date=entry['original_date'])
+            else:
+                url = url_for('calendar.view_entry', entry_id=entry['id'])
             formatted_entries.append({
                 'id': entry['id'],
                 'title': entry['title'],
-                'start': entry['start'],
+                'start': entry['entry_date'],
                 'description': entry['description'],
-                'url': url_for('calendar.view_entry', entry_id=entry['id'])
+                'url': url
             })
         
-        return jsonify(formatted_entries)
+        return set_calendar_cache_headers(jsonify(formatted_entries), etag)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
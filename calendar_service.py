@@ -0,0 +1,75 @@
+import hashlib
+from datetime import date
+from itertools import groupby
+
+from calendar_recurrence import get_occurrences, recurrence_signature
+
+# Both are answered from the (user_id, entry_date, updated_at) index
+RANGE_ETAG_SQL = """
+    SELECT COUNT(*), MAX(updated_at), TOTAL(id)
+    FROM calendar_entries
+    WHERE user_id = ? AND entry_date >= ? AND entry_date < ?
+"""
+RANGE_ENTRIES_SQL = """
+    SELECT id, entry_date, title, description
+    FROM calendar_entries
+    WHERE user_id = ? AND entry_date >= ? AND entry_date < ?
+    ORDER BY entry_date
+"""
+
+def month_range(year, month):
+    """Return the ISO start (inclusive) and end (exclusive) dates of a month"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start.isoformat(), end.isoformat()
+
+def parse_range(start, end):
+    """Normalize a FullCalendar start/end pair (dates or ISO datetimes) to ISO dates.
+
+    FullCalendar's end is exclusive and falls on midnight, so only the date
+    parts matter. Returns (start, end), or None if either is not a date.
+    """
+    try:
+        return date.fromisoformat(start[:10]).isoformat(), date.fromisoformat(end[:10]).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+def range_etag(conn, user_id, start, end):
+    """Return an ETag for a user's entries in [start, end) without reading them.
+
+    Built from the count, latest updated_at and id sum of the rows in the
+    range, all of which come from the covering (user_id, entry_date,
+    updated_at) index, so any add, edit or delete in the range changes it.
+    """
+    count, last_updated, id_sum = conn.execute(RANGE_ETAG_SQL, (user_id, start, end)).fetchone()
+    key = f"{user_id}:{start}:{end}:{count}:{last_updated}:{id_sum}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def get_entries(conn, user_id, start, end):
+    """Return a user's entries in [start, end) in date order as dicts"""
+    cursor = conn.execute(RANGE_ENTRIES_SQL, (user_id, start, end))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+def window_etag(conn, user_id, start, end):
+    """ETag for everything shown in [start, end): single entries and series occurrences"""
+    key = f"{range_etag(conn, user_id, start, end)}:{recurrence_signature(conn, user_id)}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def get_window(conn, user_id, start, end):
+    """Return entries and expanded series occurrences in [start, end), in date order.
+
+    Occurrences carry recurrence_id and original_date; single entries have
+    recurrence_id None.
+    """
+    entries = get_entries(conn, user_id, start, end)
+    for entry in entries:
+        entry['recurrence_id'] = None
+    occurrences = get_occurrences(conn, user_id, start, end)
+    if not occurrences:
+        return entries
+    return sorted(entries + occurrences, key=lambda entry: entry['entry_date'][:10])
+
+def entries_by_day(entries):
+    """Group date-ordered entries into {ISO date: [entries]}, preserving order"""
+    return {day: list(group) for day, group in groupby(entries, key=lambda entry: entry['entry_date'][:10])}
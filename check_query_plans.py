@@ -0,0 +1,26 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+import storage
+
+# The hot queries and the check itself live with the tests, so pytest
+# catches a new full table scan; this runs them from the command line
+TEST_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'test_query_plans.py')
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if a hot query falls back to a full table scan')
+    parser.add_argument('--fresh', action='store_true',
+                        help='Check a freshly created and migrated schema instead of DATA_DIR')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every query plan')
+    args = parser.parse_args()
+
+    if not args.fresh:
+        os.environ['QUERY_PLANS_DATA_DIR'] = storage.DATA_DIR
+    options = ['-v', '-s'] if args.verbose else ['-q', '-rs']
+    sys.exit(pytest.main([TEST_MODULE, *options]))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
 import sqlite3
 import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from migrations.add_calendar_change_seq import CHANGE_SEQ_TRIGGERS
+from migrations.add_series_study_tasks import SERIES_CHANGE_SEQ_TRIGGERS
 
 def create_calendar_db():
     # Create or overwrite the calendar database
@@ -19,12 +25,88 @@ def create_calendar_db():
         description TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
+        change_seq INTEGER,
+        import_id TEXT
+    )
+    """)
+
+    # Month and range queries (and their ETags) are answered from this index
+    crsr.execute("CREATE INDEX idx_calendar_entries_user_date_updated ON calendar_entries(user_id, entry_date, updated_at)")
+
+    # Repeating entries, stored once and expanded per requested window
+    crsr.execute("""
+    CREATE TABLE calendar_recurrences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        dtstart DATE NOT NULL,
+        rrule TEXT NOT NULL,
+        until DATE,
+        title TEXT NOT NULL,
+        description TEXT,
+        import_id TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        change_seq INTEGER,
+        next_schedule_date DATE
+    )
+    """)
+    crsr.execute("CREATE INDEX idx_calendar_recurrences_user_range ON calendar_recurrences(user_id, dtstart, until)")
+    crsr.execute("CREATE INDEX idx_calendar_recurrences_next_schedule ON calendar_recurrences(next_schedule_date) WHERE next_schedule_date IS NOT NULL")
+
+    # Rows added by an .ics import, so a failed import can be removed
+    crsr.execute("CREATE INDEX idx_calendar_entries_import ON calendar_entries(user_id, import_id) WHERE import_id IS NOT NULL")
+    crsr.execute("CREATE INDEX idx_calendar_recurrences_import ON calendar_recurrences(user_id, import_id) WHERE import_id IS NOT NULL")
+
+    # Cancelled or changed occurrences of a series
+    crsr.execute("""
+    CREATE TABLE calendar_recurrence_exceptions (
+        recurrence_id INTEGER NOT NULL,
+        original_date DATE NOT NULL,
+        cancelled INTEGER NOT NULL DEFAULT 0,
+        entry_date DATE,
+        title TEXT,
+        description TEXT,
+        PRIMARY KEY (recurrence_id, original_date),
+        FOREIGN KEY (recurrence_id) REFERENCES calendar_recurrences (id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    """)
+    crsr.execute("CREATE INDEX idx_calendar_recurrence_exceptions_moved ON calendar_recurrence_exceptions(entry_date) WHERE entry_date IS NOT NULL")
+
+    # Study tasks generated from exam entries and series, and how far the scheduler has got
+    crsr.execute("""
+    CREATE TABLE study_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        source_entry_id INTEGER,
+        source_series_id INTEGER,
+        unit_number INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        due_date DATE NOT NULL,
+        exam_date DATE NOT NULL,
+        title TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        completed_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (source_entry_id, unit_number, kind, due_date),
+        UNIQUE (source_series_id, exam_date, unit_number, kind, due_date),
+        CHECK ((source_entry_id IS NULL) <> (source_series_id IS NULL)),
+        FOREIGN KEY (source_entry_id) REFERENCES calendar_entries (id) ON DELETE CASCADE,
+        FOREIGN KEY (source_series_id) REFERENCES calendar_recurrences (id) ON DELETE CASCADE
+    )
+    """)
+    crsr.execute("CREATE INDEX idx_study_tasks_pending_due ON study_tasks(user_id, due_date) WHERE status = 'pending'")
+    crsr.execute("""
+    CREATE TABLE study_scheduler_state (
+        name TEXT PRIMARY KEY,
+        change_seq INTEGER NOT NULL
     )
     """)
 
-    # Create an index for faster date-based queries
-    crsr.execute("CREATE INDEX idx_calendar_entries_user_date ON calendar_entries(user_id, entry_date)")
+    # Every write to an entry or series gets the next change_seq, for the scheduler
+    crsr.execute("CREATE UNIQUE INDEX idx_calendar_entries_change_seq ON calendar_entries(change_seq)")
+    crsr.execute("CREATE UNIQUE INDEX idx_calendar_recurrences_change_seq ON calendar_recurrences(change_seq)")
+    for trigger in CHANGE_SEQ_TRIGGERS + SERIES_CHANGE_SEQ_TRIGGERS:
+        crsr.execute(trigger)
     
     connection.commit()
     crsr.close()
@@ -35,6 +35,9 @@ for field in fields:
 dbCreateString+="PRIMARY KEY(id))"
 
 crsr.execute(dbCreateString)
+
+# Logins look users up by username, which must be unique
+crsr.execute("CREATE UNIQUE INDEX idx_users_username ON users(username)")
 connection.commit()
 crsr.close()
 connection.close()
@@ -28,7 +28,10 @@ CREATE TABLE entries (
 # Create indexes for faster lookups
 indexes = [
     "CREATE INDEX idx_word_phrase ON entries(word_phrase)",
-    "CREATE INDEX idx_views ON entries(views)"
+    "CREATE INDEX idx_views ON entries(views)",
+    # Per-unit lookups: quiz pools (COUNT/MAX per unit) and AI context ranking
+    "CREATE INDEX idx_entries_unit_updated ON entries(unit_number, last_updated)",
+    "CREATE INDEX idx_entries_unit_views ON entries(unit_number, COALESCE(views, 0) DESC, last_updated DESC)"
 ]
 
 # Execute the table creation and indexes
@@ -36,6 +39,33 @@ crsr.execute(create_table_sql)
 for index in indexes:
     crsr.execute(index)
 
+# Spaced-repetition state per user and term, and each user's new-term watermark
+crsr.execute("""
+CREATE TABLE review_state (
+    user_id INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL,
+    ease REAL NOT NULL DEFAULT 2.5,
+    interval INTEGER NOT NULL DEFAULT 0,
+    repetitions INTEGER NOT NULL DEFAULT 0,
+    lapses INTEGER NOT NULL DEFAULT 0,
+    due_date DATE NOT NULL,
+    last_grade INTEGER,
+    last_reviewed TIMESTAMP,
+    PRIMARY KEY (user_id, entry_id),
+    FOREIGN KEY (entry_id) REFERENCES entries (id) ON DELETE CASCADE
+) WITHOUT ROWID
+""")
+crsr.execute("CREATE INDEX idx_review_state_due ON review_state(user_id, due_date)")
+crsr.execute("CREATE INDEX idx_review_state_entry ON review_state(entry_id)")
+crsr.execute("""
+CREATE TABLE review_progress (
+    user_id INTEGER PRIMARY KEY,
+    last_new_entry_id INTEGER NOT NULL,
+    new_day DATE NOT NULL,
+    new_count INTEGER NOT NULL
+)
+""")
+
 # Create a trigger to update the last_updated timestamp
 crsr.execute("""
 CREATE TRIGGER update_entry_timestamp
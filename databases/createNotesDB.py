@@ -43,14 +43,58 @@ CREATE TABLE worksheet_images (
 )
 """
 
+# Define the worksheet_blobs table structure (one row per distinct stored file)
+create_worksheet_blobs_table_sql = """
+CREATE TABLE worksheet_blobs (
+    sha256 TEXT PRIMARY KEY,            -- content hash of the stored file
+    filename TEXT NOT NULL UNIQUE,      -- stored filename on disk
+    size INTEGER,                       -- file size in bytes
+    refcount INTEGER NOT NULL DEFAULT 0,-- number of worksheet_images rows using it
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Define the file_cleanup_queue table structure (files waiting to be unlinked)
+create_file_cleanup_queue_table_sql = """
+CREATE TABLE file_cleanup_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL UNIQUE,      -- stored filename no longer referenced
+    queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Define the note_revisions table structure (history of note content)
+create_note_revisions_table_sql = """
+CREATE TABLE note_revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    note_id INTEGER NOT NULL,
+    revision INTEGER NOT NULL,          -- 1, 2, 3... per note
+    kind TEXT NOT NULL,                 -- 'snapshot' (full content) or 'delta' (edits against the previous revision)
+    title TEXT NOT NULL,
+    data BLOB NOT NULL,                 -- zlib-compressed JSON content or delta
+    size INTEGER NOT NULL,              -- stored size of data in bytes
+    source TEXT,                        -- 'edit', 'enhance', 'restore', ...
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (note_id, revision),
+    FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+)
+"""
+
 # Create the tables
 crsr.execute(create_notes_table_sql)
 crsr.execute(create_worksheet_images_table_sql)
+crsr.execute(create_worksheet_blobs_table_sql)
+crsr.execute(create_file_cleanup_queue_table_sql)
+crsr.execute(create_note_revisions_table_sql)
 
 # Create indexes for better performance
-crsr.execute("CREATE INDEX idx_notes_unit ON notes(unit_number)")
+# Per-unit lookups: quiz pools (COUNT/MAX per unit) and AI context ranking
+crsr.execute("CREATE INDEX idx_notes_unit_updated ON notes(unit_number, last_updated)")
+crsr.execute("CREATE INDEX idx_notes_unit_views ON notes(unit_number, COALESCE(views, 0) DESC, last_updated DESC)")
 crsr.execute("CREATE INDEX idx_notes_favorite ON notes(is_favorite)")
+crsr.execute("CREATE INDEX idx_notes_last_updated ON notes(last_updated)")
 crsr.execute("CREATE INDEX idx_worksheet_images_note_id ON worksheet_images(note_id)")
+crsr.execute("CREATE INDEX idx_worksheet_images_filename ON worksheet_images(filename)")
 
 # Create trigger for automatic last_updated timestamp
 crsr.execute("""
@@ -1,7 +1,11 @@
-from sql import SQL
-from SarvAuth import hash
+import os
+import sys
 import getpass
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage import get_sql
+from passwords import hash_password
+
 def create_user():
     print("=== Create New User ===")
     
@@ -12,10 +16,10 @@ def create_user():
     full_name = input("Full Name: ").strip()
     
     # Hash the password
-    hashed_password = hash(password)
+    hashed_password = hash_password(password)
     
     # Connect to the database
-    db = SQL("sqlite:///users.db")
+    db = get_sql('users')
     
     try:
         # Check if username already exists
@@ -1,12 +1,29 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, abort, jsonify
-from sql import SQL
+from storage import get_sql
 import sqlite3
 from datetime import datetime
 import re
 
+# The full list of terms, alphabetical (in idx_word_phrase order)
+INDEX_SQL = """
+    SELECT id, word_phrase, definition, example, views,
+           strftime('%Y-%m-%d', created_at) as created_date
+    FROM entries
+    ORDER BY word_phrase ASC
+"""
+
+# One entry with all fields, for its page
+ENTRY_SQL = """
+    SELECT id, word_phrase, definition, example, views, unit_number, comments,
+           strftime('%Y-%m-%d', created_at) as created_date,
+           strftime('%Y-%m-%d', last_updated) as last_updated
+    FROM entries
+    WHERE id = :id
+"""
+
 def render_entry(entry_id, is_public=False):
     """Helper function to render an entry (used by both public and authenticated views)"""
-    db = SQL("sqlite:///dictionary.db")
+    db = get_sql('dictionary')
     
     try:
         # Increment view count only for public views
@@ -18,13 +35,7 @@ def render_entry(entry_id, is_public=False):
             """, id=entry_id)
         
         # Get the entry with all fields
-        entry = db.execute("""
-            SELECT id, word_phrase, definition, example, views, unit_number, comments,
-                   strftime('%Y-%m-%d', created_at) as created_date,
-                   strftime('%Y-%m-%d', last_updated) as last_updated
-            FROM entries 
-            WHERE id = :id
-        """, id=entry_id)
+        entry = db.execute(ENTRY_SQL, id=entry_id)
         
         if not entry:
             flash('Entry not found', 'error')
@@ -56,7 +67,7 @@ def get_related_terms(word_phrase, current_id=None, limit=5):
         return []
     
     # Build a query to find related terms
-    db = SQL("sqlite:///dictionary.db")
+    db = get_sql('dictionary')
     
     # Create a list to hold conditions and params
     conditions = []
@@ -101,13 +112,8 @@ def get_related_terms(word_phrase, current_id=None, limit=5):
 @dict_bp.route('')
 def index():
     
-    db = SQL("sqlite:///dictionary.db")
-    entries = db.execute("""
-        SELECT id, word_phrase, definition, example, views, 
-               strftime('%Y-%m-%d', created_at) as created_date
-        FROM entries 
-        ORDER BY word_phrase ASC
-    """)
+    db = get_sql('dictionary')
+    entries = db.execute(INDEX_SQL)
     return render_template("dictionary/index.html", entries=entries)
 
 @dict_bp.route('/add', methods=['GET', 'POST'])
@@ -138,7 +144,7 @@ def add_entry():
             unit_number = None
         
         try:
-            db = SQL("sqlite:///dictionary.db")
+            db = get_sql('dictionary')
             db.execute("""
                 INSERT INTO entries (word_phrase, definition, example, unit_number, comments)
                 VALUES (:word_phrase, :definition, :example, :unit_number, :comments)
@@ -178,7 +184,7 @@ def edit_entry(entry_id):
     if not session.get("name"):
         return redirect("/auth/login")
         
-    db = SQL("sqlite:///dictionary.db")
+    db = get_sql('dictionary')
     
     # Get the existing entry with all fields
     entry = db.execute("""
@@ -247,7 +253,7 @@ def delete_entry(entry_id):
         return jsonify({'success': False, 'error': 'Not authorized. Please log in.'}), 401
     
     try:
-        db = SQL("sqlite:///dictionary.db")
+        db = get_sql('dictionary')
         
         # Verify the entry exists
         entry = db.execute("SELECT * FROM entries WHERE id = ?", entry_id)
@@ -273,7 +279,7 @@ def search():
         return redirect(url_for('dictionary.index'))
         
     try:
-        db = SQL("sqlite:///dictionary.db")
+        db = get_sql('dictionary')
         
         # Split query into keywords
         keywords = re.findall(r'\b\w+\b', query.lower())
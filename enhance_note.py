@@ -4,6 +4,9 @@ import time
 import google.generativeai as genai
 from dotenv import load_dotenv
 import argparse
+from backup import backup_database
+from note_revisions import record_revision
+from storage import database_path
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,7 +36,7 @@ def get_db_connection(db_path):
 
 def get_note(note_id):
     """Retrieve a single note by ID from the database."""
-    db_path = os.path.join(os.path.dirname(__file__), 'notes.db')
+    db_path = database_path('notes')
     conn = get_db_connection(db_path)
     cursor = conn.cursor()
     
@@ -132,17 +135,25 @@ def enhance_note_content(title, content, comment=None):
 
 def update_note(note_id, enhanced_content):
     """Update the note in the database with enhanced content."""
-    db_path = os.path.join(os.path.dirname(__file__), 'notes.db')
+    db_path = database_path('notes')
     conn = get_db_connection(db_path)
     cursor = conn.cursor()
     
     try:
+        # Record the change so the enhancement can be undone from the note's history
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT title, content FROM notes WHERE id = ?", (note_id,))
+        previous = cursor.fetchone()
+        if not previous:
+            conn.rollback()
+            return False
         cursor.execute(
-            "UPDATE notes SET content = ? WHERE id = ?",
+            "UPDATE notes SET content = ?, last_updated = CURRENT_TIMESTAMP WHERE id = ?",
             (enhanced_content, note_id)
         )
+        record_revision(cursor, note_id, tuple(previous), (previous[0], enhanced_content), 'enhance')
         conn.commit()
-        return cursor.rowcount > 0
+        return True
     except Exception as e:
         print(f"  ❌ Error updating note: {str(e)}")
         return False
@@ -151,21 +162,10 @@ def update_note(note_id, enhanced_content):
 
 def backup_notes():
     """Create a backup of the notes database."""
-    import shutil
-    from datetime import datetime
-    
-    db_path = os.path.join(os.path.dirname(__file__), 'notes.db')
-    backup_dir = os.path.join(os.path.dirname(__file__), 'backups')
-    
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_path = os.path.join(backup_dir, f'notes_backup_{timestamp}.db')
-    
     try:
-        shutil.copy2(db_path, backup_path)
+        backup_path = backup_database('notes')
         print(f"✅ Created backup at: {backup_path}")
+        return backup_path
     except Exception as e:
         print(f"❌ Failed to create backup: {str(e)}")
         return False
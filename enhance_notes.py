@@ -4,6 +4,9 @@ import time
 import google.generativeai as genai
 from dotenv import load_dotenv
 from pathlib import Path
+from backup import backup_database
+from note_revisions import record_revision
+from storage import database_path
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,7 +35,7 @@ def get_db_connection(db_path):
 
 def get_notes():
     """Retrieve all notes from the database."""
-    db_path = os.path.join(os.path.dirname(__file__), 'notes.db')
+    db_path = database_path('notes')
     conn = get_db_connection(db_path)
     cursor = conn.cursor()
     
@@ -122,17 +125,25 @@ def enhance_note_content(title, content):
 
 def update_note(note_id, enhanced_content):
     """Update the note in the database with enhanced content."""
-    db_path = os.path.join(os.path.dirname(__file__), 'notes.db')
+    db_path = database_path('notes')
     conn = get_db_connection(db_path)
     cursor = conn.cursor()
     
     try:
+        # Record the change so the enhancement can be undone from the note's history
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT title, content FROM notes WHERE id = ?", (note_id,))
+        previous = cursor.fetchone()
+        if not previous:
+            conn.rollback()
+            return False
         cursor.execute(
-            "UPDATE notes SET content = ? WHERE id = ?",
+            "UPDATE notes SET content = ?, last_updated = CURRENT_TIMESTAMP WHERE id = ?",
             (enhanced_content, note_id)
         )
+        record_revision(cursor, note_id, tuple(previous), (previous[0], enhanced_content), 'enhance')
         conn.commit()
-        return cursor.rowcount > 0
+        return True
     except Exception as e:
         print(f"Error updating note {note_id}: {str(e)}")
         return False
@@ -141,20 +152,7 @@ def update_note(note_id, enhanced_content):
 
 def backup_notes():
     """Create a backup of the notes database."""
-    import shutil
-    from datetime import datetime
-    
-    original_db = os.path.join(os.path.dirname(__file__), 'notes.db')
-    backup_dir = os.path.join(os.path.dirname(__file__), 'backups')
-    
-    # Create backups directory if it doesn't exist
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    # Create timestamped backup
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = os.path.join(backup_dir, f'notes_backup_{timestamp}.db')
-    
-    shutil.copy2(original_db, backup_file)
+    backup_file = backup_database('notes')
     print(f"Created backup at: {backup_file}")
     return backup_file
 
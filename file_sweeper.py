@@ -0,0 +1,82 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from storage import database_path
+from worksheet_storage import UPLOAD_FOLDER, sweep_removed_files
+
+# Seconds between sweeps when nobody has deleted anything
+SWEEP_INTERVAL = 5 * 60
+
+# Files unlinked per transaction
+BATCH_SIZE = 100
+
+# Pause between batches so uploads get a turn at the write lock
+BATCH_PAUSE = 0.05
+
+logger = logging.getLogger(__name__)
+
+class FileSweeper(object):
+    """Background thread that deletes worksheet files queued in file_cleanup_queue.
+
+    Deleting notes only records unused files in the queue, so requests never
+    wait on the filesystem. The sweeper wakes up when told there is work
+    (and periodically in case another process queued some) and unlinks the
+    files in small batches.
+    """
+
+    def __init__(self, db_path=None, upload_folder=UPLOAD_FOLDER,
+                 interval=SWEEP_INTERVAL, batch_size=BATCH_SIZE):
+        self.db_path = db_path or database_path('notes')
+        self.upload_folder = upload_folder
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        """Ask for a sweep soon, starting the thread in this process if needed"""
+        with self._lock:
+            # Threads do not survive fork, so each worker process starts its own
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._wakeup = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='file-sweeper', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error sweeping deleted worksheet files")
+
+    def sweep(self):
+        """Process the whole queue in batches; return the number of files handled"""
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            total = 0
+            while True:
+                processed = sweep_removed_files(conn, self.upload_folder, self.batch_size)
+                total += processed
+                if processed < self.batch_size:
+                    return total
+                time.sleep(BATCH_PAUSE)
+        finally:
+            conn.close()
+
+_sweeper = FileSweeper()
+
+def get_file_sweeper():
+    """Return the process-wide file sweeper"""
+    return _sweeper
+
+if __name__ == '__main__':
+    print(f"Removed {_sweeper.sweep()} queued file(s).")
@@ -0,0 +1,121 @@
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# Pages requested in turn by every client; all need a login
+PATHS = ('/dictionary', '/notes', '/calendar/')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# How each server is started; {port} is filled in
+SERVERS = {
+    # What `python app.py` runs: Werkzeug's development server with debug on
+    'dev': [sys.executable, '-c',
+            'from app import create_app; create_app().run(debug=True, port={port}, use_reloader=False)'],
+    'serve': [sys.executable, os.path.join(ROOT, 'serve.py'), '--port', '{port}'],
+}
+
+def session_cookie(user_id, name):
+    """A signed session cookie for a user, made with the app's own key"""
+    from app import create_app
+    app = create_app()
+    return app.session_interface.get_signing_serializer(app).dumps(
+        {'user_id': user_id, 'name': name, 'username': name})
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/auth/login')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+def client(port, cookie, paths, stop_at, latencies, errors):
+    """Request paths in turn over one keep-alive connection until stop_at"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Cookie': f'session={cookie}'}
+    i = 0
+    while time.monotonic() < stop_at:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+
+def run(port, cookie, paths, concurrency, duration):
+    """Run concurrent clients for duration seconds; return (latencies, errors, seconds)"""
+    latencies, errors = [], []
+    stop_at = time.monotonic() + duration
+    threads = [threading.Thread(target=client, args=(port, cookie, paths, stop_at, latencies, errors))
+               for _ in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.monotonic() - start
+
+def report(label, latencies, errors, seconds):
+    if not latencies:
+        print(f"{label:>8} no successful requests ({len(errors)} errors)")
+        return
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"{label:>8} {len(latencies) / seconds:>9.1f} {statistics.median(latencies) * 1000:>8.1f}"
+          f" {pct(0.95):>8.1f} {pct(0.99):>8.1f} {len(errors):>7}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare throughput of the development server and serve.py under concurrent load')
+    parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='Simultaneous clients (default: 16)')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Seconds per server (default: 10)')
+    parser.add_argument('--path', dest='paths', action='append', help=f"Path to request (default: {', '.join(PATHS)})")
+    parser.add_argument('--user-id', type=int, default=1, help='User the requests are made as (default: 1)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('serve_args', nargs=argparse.REMAINDER,
+                        help='Options after -- are passed to serve.py (e.g. -- --workers 4)')
+    args = parser.parse_args()
+    paths = args.paths or list(PATHS)
+    serve_args = [arg for arg in args.serve_args if arg != '--']
+
+    cookie = session_cookie(args.user_id, 'loadtest')
+    print(f"{args.concurrency} clients, {args.duration:.0f}s each, paths: {', '.join(paths)}")
+    print(f"{'server':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name in args.servers:
+        command = [part.format(port=args.port) for part in SERVERS[name]]
+        if name == 'serve':
+            command += serve_args
+        server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            # Warm up connections and caches before measuring
+            run(args.port, cookie, paths, args.concurrency, 1)
+            report(name, *run(args.port, cookie, paths, args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+if __name__ == '__main__':
+    main()
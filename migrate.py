@@ -0,0 +1,226 @@
+import argparse
+import os
+
+from storage import DATABASES, connect_db, database_path, get_schema_version, set_schema_version
+from setup_fts import create_fts, rebuild_fts, DICTIONARY_FTS_COLUMNS, NOTES_FTS_COLUMNS
+from migrations import (add_unit_and_comments, add_worksheet_images, add_worksheet_blobs,
+                        add_file_cleanup_queue, add_note_revisions, drop_calendar_users_fk,
+                        add_calendar_recurrences, add_study_tasks, add_review_state,
+                        add_calendar_change_seq, add_calendar_import_id, add_series_study_tasks)
+
+def ensure_index(conn, name, table, columns, unique=False, where=None):
+    """Create an index unless it already exists"""
+    conn.execute(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} "
+        f"ON {table} ({', '.join(columns)})" + (f" WHERE {where}" if where else "")
+    )
+
+def replace_index(conn, old_name, name, table, columns):
+    """Create an index that supersedes an older, narrower one"""
+    ensure_index(conn, name, table, columns)
+    conn.execute(f"DROP INDEX IF EXISTS {old_name}")
+
+def index_notes_last_updated(conn):
+    ensure_index(conn, 'idx_notes_last_updated', 'notes', ['last_updated'])
+
+def index_notes_fts(conn):
+    create_fts(conn, 'notes_fts', 'notes', NOTES_FTS_COLUMNS)
+
+def index_notes_by_unit(conn):
+    # Covers the quiz engine's per-unit COUNT/MAX signature and 'recent' ranking
+    replace_index(conn, 'idx_notes_unit', 'idx_notes_unit_updated', 'notes', ['unit_number', 'last_updated'])
+    # Matches the AI context's 'views' ranking, so it needs no sort
+    ensure_index(conn, 'idx_notes_unit_views', 'notes',
+                 ['unit_number', 'COALESCE(views, 0) DESC', 'last_updated DESC'])
+    conn.execute("ANALYZE notes")
+
+def index_entries_unit(conn):
+    ensure_index(conn, 'idx_entries_unit', 'entries', ['unit_number'])
+
+def index_entries_fts(conn):
+    create_fts(conn, 'entries_fts', 'entries', DICTIONARY_FTS_COLUMNS)
+
+def index_entries_by_unit(conn):
+    replace_index(conn, 'idx_entries_unit', 'idx_entries_unit_updated', 'entries', ['unit_number', 'last_updated'])
+    ensure_index(conn, 'idx_entries_unit_views', 'entries',
+                 ['unit_number', 'COALESCE(views, 0) DESC', 'last_updated DESC'])
+    conn.execute("ANALYZE entries")
+
+def index_calendar_range(conn):
+    # Range queries and their ETag aggregate need nothing but this index
+    replace_index(conn, 'idx_calendar_entries_user_date', 'idx_calendar_entries_user_date_updated',
+                  'calendar_entries', ['user_id', 'entry_date', 'updated_at'])
+
+def index_users_username(conn):
+    # Logins look users up by username; it must also be unique to be a key
+    duplicates = [row[0] for row in conn.execute(
+        "SELECT username FROM users GROUP BY username HAVING COUNT(*) > 1")]
+    if duplicates:
+        raise RuntimeError(f"Resolve duplicate usernames first: {', '.join(duplicates)}")
+    ensure_index(conn, 'idx_users_username', 'users', ['username'], unique=True)
+
+# Ordered migrations per database: (version, description, step). A step gets
+# a connection inside an open transaction and must not commit. Versions are
+# recorded in PRAGMA user_version; append new steps, never renumber old ones.
+MIGRATIONS = {
+    'notes': [
+        (1, 'worksheet_images table', add_worksheet_images.upgrade),
+        (2, 'worksheet_blobs table', add_worksheet_blobs.upgrade),
+        (3, 'file_cleanup_queue table', add_file_cleanup_queue.upgrade),
+        (4, 'note_revisions table', add_note_revisions.upgrade),
+        (5, 'index notes by last_updated', index_notes_last_updated),
+        (6, 'full-text index of notes', index_notes_fts),
+        (7, 'unit-scoped covering indexes on notes', index_notes_by_unit),
+    ],
+    'dictionary': [
+        (1, 'unit_number and comments columns', add_unit_and_comments.upgrade),
+        (2, 'index entries by unit', index_entries_unit),
+        (3, 'full-text index of entries', index_entries_fts),
+        (4, 'unit-scoped covering indexes on entries', index_entries_by_unit),
+        (5, 'spaced-repetition review state', add_review_state.upgrade),
+    ],
+    'calendar': [
+        (1, 'covering index for date range queries', index_calendar_range),
+        (2, 'drop cross-database users foreign key', drop_calendar_users_fk.upgrade),
+        (3, 'recurring entries and their exceptions', add_calendar_recurrences.upgrade),
+        (4, 'study task queue and scheduler watermark', add_study_tasks.upgrade),
+        (5, 'change sequence for the study scheduler', add_calendar_change_seq.upgrade),
+        (6, 'import id on imported entries and series', add_calendar_import_id.upgrade),
+        (7, 'study tasks for repeating entries', add_series_study_tasks.upgrade),
+    ],
+    'users': [
+        (1, 'unique index on username', index_users_username),
+    ],
+}
+
+# FTS indexes per database, for rebuild-fts
+FTS_TABLES = {
+    'notes': ['notes_fts'],
+    'dictionary': ['entries_fts'],
+}
+
+def latest_version(name):
+    steps = MIGRATIONS.get(name, [])
+    return steps[-1][0] if steps else 0
+
+def current_version(name):
+    conn = connect_db(name, readonly=True)
+    try:
+        return get_schema_version(conn)
+    finally:
+        conn.close()
+
+def pending_migrations(name):
+    """Return the (version, description) pairs not yet applied to a database"""
+    if not os.path.exists(database_path(name)):
+        return []
+    version = current_version(name)
+    return [(v, description) for v, description, _ in MIGRATIONS.get(name, []) if v > version]
+
+def upgrade(name, target=None):
+    """Apply pending migrations to a database, each in its own transaction.
+
+    Each step runs under BEGIN IMMEDIATE together with the user_version
+    bump, so a failed step leaves the database at the previous version and
+    two processes upgrading at once cannot apply a step twice. Readers keep
+    working throughout (the databases use WAL). Returns the steps applied.
+    """
+    if not os.path.exists(database_path(name)):
+        return []
+    conn = connect_db(name, isolation_level=None)
+    applied = []
+    try:
+        for version, description, step in MIGRATIONS.get(name, []):
+            if target is not None and version > target:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied it while we waited for the lock
+                if get_schema_version(conn) >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                step(conn)
+                set_schema_version(conn, version)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append((version, description))
+    finally:
+        conn.close()
+    return applied
+
+def upgrade_all():
+    """Bring every database up to date; return {name: steps applied}"""
+    return {name: upgrade(name) for name in DATABASES}
+
+def check_schema(apply=False):
+    """Make sure no database is behind the code, e.g. when the app starts.
+
+    With apply, pending migrations are run first (safe from several
+    processes at once); any still pending raise a RuntimeError naming them.
+    """
+    if apply:
+        upgrade_all()
+    behind = [f"{name} (version {current_version(name)} of {latest_version(name)})"
+              for name in DATABASES if pending_migrations(name)]
+    if behind:
+        raise RuntimeError(f"Run python migrate.py first; these databases need migrating: {', '.join(behind)}")
+
+def rebuild_search_indexes(name):
+    """Rebuild a database's FTS indexes from their tables in one transaction"""
+    conn = connect_db(name, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for fts_table in FTS_TABLES.get(name, []):
+                rebuild_fts(conn, fts_table)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+def reindex(name):
+    """Rebuild every index of a database and refresh the planner's statistics"""
+    conn = connect_db(name, isolation_level=None)
+    try:
+        conn.execute("REINDEX")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply schema migrations and maintain indexes')
+    parser.add_argument('command', nargs='?', default='upgrade',
+                        choices=['upgrade', 'status', 'rebuild-fts', 'reindex'])
+    parser.add_argument('--db', choices=list(DATABASES), help='Only this database (default: all)')
+    parser.add_argument('--to', type=int, help='Stop at this version (upgrade only)')
+    args = parser.parse_args()
+
+    names = [args.db] if args.db else list(DATABASES)
+    for name in names:
+        if not os.path.exists(database_path(name)):
+            print(f"{name}: no database")
+            continue
+        if args.command == 'status':
+            print(f"{name}: version {current_version(name)} of {latest_version(name)}")
+            pending = pending_migrations(name)
+            for version, description in pending:
+                print(f"  pending {version}: {description}")
+        elif args.command == 'upgrade':
+            applied = upgrade(name, args.to)
+            for version, description in applied:
+                print(f"{name}: applied {version} ({description})")
+            if not applied:
+                print(f"{name}: up to date")
+        elif args.command == 'rebuild-fts':
+            rebuild_search_indexes(name)
+            print(f"{name}: rebuilt {', '.join(FTS_TABLES.get(name, [])) or 'nothing'}")
+        elif args.command == 'reindex':
+            reindex(name)
+            print(f"{name}: reindexed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+# Written by these triggers on every insert and on edits that matter to
+# the study scheduler; SQLite allows one writer at a time, so the numbers
+# follow commit order whatever the timestamps look like
+CHANGE_SEQ_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS calendar_entries_change_seq_insert
+    AFTER INSERT ON calendar_entries
+    BEGIN
+        UPDATE calendar_entries
+        SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM calendar_entries)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS calendar_entries_change_seq_update
+    AFTER UPDATE OF user_id, entry_date, title, description ON calendar_entries
+    BEGIN
+        UPDATE calendar_entries
+        SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM calendar_entries)
+        WHERE id = NEW.id;
+    END
+    """,
+)
+
+# updated_at is either CURRENT_TIMESTAMP ('... HH:MM:SS') or written with
+# milliseconds ('... HH:MM:SS.fff'); pad the former so both sort together
+NORMALIZED_UPDATED_AT = "substr(updated_at || '.000', 1, 23)"
+
+def upgrade(conn):
+    """Number calendar changes with change_seq and move the scheduler onto it (no commit)"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(calendar_entries)")]
+    if 'change_seq' not in columns:
+        conn.execute("ALTER TABLE calendar_entries ADD COLUMN change_seq INTEGER")
+        conn.execute(f"""
+            UPDATE calendar_entries SET change_seq = numbered.seq
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY {NORMALIZED_UPDATED_AT}, id) AS seq
+                FROM calendar_entries
+            ) AS numbered
+            WHERE numbered.id = calendar_entries.id
+        """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_calendar_entries_change_seq
+        ON calendar_entries (change_seq)
+    """)
+    for trigger in CHANGE_SEQ_TRIGGERS:
+        conn.execute(trigger)
+
+    # The scheduler's (updated_at, id) watermark becomes the change_seq of
+    # the last entry it had reached
+    state_columns = [row[1] for row in conn.execute("PRAGMA table_info(study_scheduler_state)")]
+    if 'change_seq' not in state_columns:
+        marks = conn.execute("SELECT name, updated_at, entry_id FROM study_scheduler_state").fetchall()
+        conn.execute("DROP TABLE study_scheduler_state")
+        conn.execute("""
+            CREATE TABLE study_scheduler_state (
+                name TEXT PRIMARY KEY,
+                change_seq INTEGER NOT NULL
+            )
+        """)
+        for name, updated_at, entry_id in marks:
+            seq = conn.execute(f"""
+                SELECT COALESCE(MAX(change_seq), 0) FROM calendar_entries
+                WHERE ({NORMALIZED_UPDATED_AT}, id) <= (substr(? || '.000', 1, 23), ?)
+            """, (updated_at, entry_id)).fetchone()[0]
+            conn.execute("INSERT INTO study_scheduler_state (name, change_seq) VALUES (?, ?)", (name, seq))
+    conn.execute("DROP INDEX IF EXISTS idx_calendar_entries_updated")
+
+def migrate():
+    print(f"Connecting to database at: {database_path('calendar')}")
+
+    conn = connect_db('calendar')
+
+    try:
+        upgrade(conn)
+
+        conn.commit()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
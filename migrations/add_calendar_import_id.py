@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Tag imported entries and series with the import that added them (no commit)"""
+    for table in ('calendar_entries', 'calendar_recurrences'):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if 'import_id' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN import_id TEXT")
+        # Finds an import's rows to remove it; most rows have no import_id
+        conn.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{table}_import
+            ON {table} (user_id, import_id) WHERE import_id IS NOT NULL
+        """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('calendar')}")
+
+    conn = connect_db('calendar')
+
+    try:
+        upgrade(conn)
+
+        conn.commit()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
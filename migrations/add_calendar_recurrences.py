@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Add the calendar_recurrences and calendar_recurrence_exceptions tables (no commit)"""
+    cursor = conn.cursor()
+    
+    # One row per repeating event; until is the last possible occurrence
+    # (from UNTIL or COUNT), NULL for series that never end
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS calendar_recurrences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        dtstart DATE NOT NULL,
+        rrule TEXT NOT NULL,
+        until DATE,
+        title TEXT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_calendar_recurrences_user_range
+    ON calendar_recurrences (user_id, dtstart, until)
+    """)
+    
+    # Cancelled or changed occurrences, keyed by the date they were generated for
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS calendar_recurrence_exceptions (
+        recurrence_id INTEGER NOT NULL,
+        original_date DATE NOT NULL,
+        cancelled INTEGER NOT NULL DEFAULT 0,
+        entry_date DATE,
+        title TEXT,
+        description TEXT,
+        PRIMARY KEY (recurrence_id, original_date),
+        FOREIGN KEY (recurrence_id) REFERENCES calendar_recurrences (id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_calendar_recurrence_exceptions_moved
+    ON calendar_recurrence_exceptions (entry_date) WHERE entry_date IS NOT NULL
+    """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('calendar')}")
+    
+    conn = connect_db('calendar')
+    
+    try:
+        upgrade(conn)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Add the file_cleanup_queue table (no commit)"""
+    cursor = conn.cursor()
+    
+    # Create file_cleanup_queue table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS file_cleanup_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL UNIQUE,
+        queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('notes')}")
+    
+    conn = connect_db('notes')
+    
+    try:
+        upgrade(conn)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
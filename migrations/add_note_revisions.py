@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Add the note_revisions table (no commit)"""
+    cursor = conn.cursor()
+    
+    # Create note_revisions table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS note_revisions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        title TEXT NOT NULL,
+        data BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        source TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (note_id, revision),
+        FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+    )
+    """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('notes')}")
+    
+    conn = connect_db('notes')
+    
+    try:
+        upgrade(conn)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Add the review_state and review_progress tables (no commit)"""
+    cursor = conn.cursor()
+    
+    # Spaced-repetition state of each term a user has started
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS review_state (
+        user_id INTEGER NOT NULL,
+        entry_id INTEGER NOT NULL,
+        ease REAL NOT NULL DEFAULT 2.5,
+        interval INTEGER NOT NULL DEFAULT 0,
+        repetitions INTEGER NOT NULL DEFAULT 0,
+        lapses INTEGER NOT NULL DEFAULT 0,
+        due_date DATE NOT NULL,
+        last_grade INTEGER,
+        last_reviewed TIMESTAMP,
+        PRIMARY KEY (user_id, entry_id),
+        FOREIGN KEY (entry_id) REFERENCES entries (id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_review_state_due
+    ON review_state (user_id, due_date)
+    """)
+    # Lets entry deletes find the rows to cascade to
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_review_state_entry
+    ON review_state (entry_id)
+    """)
+    
+    # Where each user's introduction of new terms has got to
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS review_progress (
+        user_id INTEGER PRIMARY KEY,
+        last_new_entry_id INTEGER NOT NULL,
+        new_day DATE NOT NULL,
+        new_count INTEGER NOT NULL
+    )
+    """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('dictionary')}")
+    
+    conn = connect_db('dictionary')
+    
+    try:
+        upgrade(conn)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,117 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+# Series are numbered like calendar_entries (see add_calendar_change_seq);
+# touch_series bumps updated_at whenever an exception changes, so edits
+# to single occurrences move the series forward too
+SERIES_CHANGE_SEQ_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS calendar_recurrences_change_seq_insert
+    AFTER INSERT ON calendar_recurrences
+    BEGIN
+        UPDATE calendar_recurrences
+        SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM calendar_recurrences)
+        WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS calendar_recurrences_change_seq_update
+    AFTER UPDATE OF user_id, dtstart, rrule, until, title, description, updated_at ON calendar_recurrences
+    BEGIN
+        UPDATE calendar_recurrences
+        SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM calendar_recurrences)
+        WHERE id = NEW.id;
+    END
+    """,
+)
+
+def upgrade(conn):
+    """Let the study scheduler follow series: change_seq, next_schedule_date and series tasks (no commit)"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(calendar_recurrences)")]
+    if 'change_seq' not in columns:
+        conn.execute("ALTER TABLE calendar_recurrences ADD COLUMN change_seq INTEGER")
+        conn.execute("""
+            UPDATE calendar_recurrences SET change_seq = numbered.seq
+            FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS seq FROM calendar_recurrences) AS numbered
+            WHERE numbered.id = calendar_recurrences.id
+        """)
+    if 'next_schedule_date' not in columns:
+        # The day the next occurrence of an exam series enters the look-ahead window
+        conn.execute("ALTER TABLE calendar_recurrences ADD COLUMN next_schedule_date DATE")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_calendar_recurrences_change_seq
+        ON calendar_recurrences (change_seq)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_calendar_recurrences_next_schedule
+        ON calendar_recurrences (next_schedule_date) WHERE next_schedule_date IS NOT NULL
+    """)
+    for trigger in SERIES_CHANGE_SEQ_TRIGGERS:
+        conn.execute(trigger)
+
+    # Tasks come from either an entry or an occurrence of a series, so
+    # source_entry_id becomes nullable; SQLite needs the table rebuilt for that
+    task_columns = [row[1] for row in conn.execute("PRAGMA table_info(study_tasks)")]
+    if 'source_series_id' not in task_columns:
+        conn.execute("""
+            CREATE TABLE study_tasks_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                source_entry_id INTEGER,
+                source_series_id INTEGER,
+                unit_number INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                due_date DATE NOT NULL,
+                exam_date DATE NOT NULL,
+                title TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                completed_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (source_entry_id, unit_number, kind, due_date),
+                UNIQUE (source_series_id, exam_date, unit_number, kind, due_date),
+                CHECK ((source_entry_id IS NULL) <> (source_series_id IS NULL)),
+                FOREIGN KEY (source_entry_id) REFERENCES calendar_entries (id) ON DELETE CASCADE,
+                FOREIGN KEY (source_series_id) REFERENCES calendar_recurrences (id) ON DELETE CASCADE
+            )
+        """)
+        # Tasks of entries deleted while foreign keys were off are dropped
+        conn.execute("""
+            INSERT INTO study_tasks_new
+                (id, user_id, source_entry_id, unit_number, kind, due_date, exam_date, title,
+                 status, completed_at, created_at)
+            SELECT id, user_id, source_entry_id, unit_number, kind, due_date, exam_date, title,
+                   status, completed_at, created_at
+            FROM study_tasks
+            WHERE source_entry_id IN (SELECT id FROM calendar_entries)
+        """)
+        conn.execute("DROP TABLE study_tasks")
+        conn.execute("ALTER TABLE study_tasks_new RENAME TO study_tasks")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_study_tasks_pending_due
+        ON study_tasks (user_id, due_date) WHERE status = 'pending'
+    """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('calendar')}")
+
+    conn = connect_db('calendar')
+
+    try:
+        upgrade(conn)
+
+        conn.commit()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
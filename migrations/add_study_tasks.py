@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Add the study_tasks queue and the scheduler's watermark (no commit)"""
+    cursor = conn.cursor()
+    
+    # Study tasks generated from exam entries; removed with their entry
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS study_tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        source_entry_id INTEGER NOT NULL,
+        unit_number INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        due_date DATE NOT NULL,
+        exam_date DATE NOT NULL,
+        title TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        completed_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (source_entry_id, unit_number, kind, due_date),
+        FOREIGN KEY (source_entry_id) REFERENCES calendar_entries (id) ON DELETE CASCADE
+    )
+    """)
+    
+    # The "due now" query only ever looks at pending tasks
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_study_tasks_pending_due
+    ON study_tasks (user_id, due_date) WHERE status = 'pending'
+    """)
+    
+    # How far through calendar_entries (by updated_at, id) the scheduler has got
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS study_scheduler_state (
+        name TEXT PRIMARY KEY,
+        updated_at TEXT NOT NULL,
+        entry_id INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_calendar_entries_updated
+    ON calendar_entries (updated_at)
+    """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('calendar')}")
+    
+    conn = connect_db('calendar')
+    
+    try:
+        upgrade(conn)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
@@ -1,35 +1,48 @@
-import sqlite3
-from datetime import datetime
+import os
+import sys
 
-def migrate():
-    # Connect to the database
-    conn = sqlite3.connect('dictionary.db')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def column_exists(cursor, table, column):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+def upgrade(conn):
+    """Add unit_number and comments columns to entries (no commit)"""
     cursor = conn.cursor()
     
-    try:
-        # Add unit_number column if it doesn't exist
+    # Add unit_number column if it doesn't exist
+    if not column_exists(cursor, 'entries', 'unit_number'):
         cursor.execute("""
         ALTER TABLE entries 
         ADD COLUMN unit_number INTEGER DEFAULT NULL
         """)
-        
-        # Add comments column if it doesn't exist
+    
+    # Add comments column if it doesn't exist
+    if not column_exists(cursor, 'entries', 'comments'):
         cursor.execute("""
         ALTER TABLE entries 
         ADD COLUMN comments TEXT DEFAULT NULL
         """)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('dictionary')}")
+    
+    conn = connect_db('dictionary')
+    
+    try:
+        upgrade(conn)
         
         # Commit changes
         conn.commit()
         print("Migration completed successfully!")
         
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            print("Columns already exist. Migration not needed.")
-        else:
-            print(f"Error during migration: {e}")
-            conn.rollback()
-    
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
     finally:
         conn.close()
 
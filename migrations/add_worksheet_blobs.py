@@ -0,0 +1,80 @@
+import os
+import sys
+import hashlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+sys.path.insert(0, ROOT)
+
+from storage import connect_db, database_path
+
+def file_sha256(path):
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def upgrade(conn, upload_folder=os.path.join(ROOT, 'uploads', 'worksheets')):
+    """Add worksheet_blobs and register existing files; returns how many (no commit)"""
+    cursor = conn.cursor()
+    
+    # Create worksheet_blobs table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS worksheet_blobs (
+        sha256 TEXT PRIMARY KEY,
+        filename TEXT NOT NULL UNIQUE,
+        size INTEGER,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    
+    # Shared files are looked up by name when their references are released
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_worksheet_images_filename
+    ON worksheet_images (filename)
+    """)
+    
+    # Register files uploaded before blobs existed, keeping their names
+    cursor.execute("""
+        SELECT filename, COUNT(*) FROM worksheet_images
+        WHERE filename NOT IN (SELECT filename FROM worksheet_blobs)
+        GROUP BY filename
+    """)
+    registered = 0
+    for filename, references in cursor.fetchall():
+        path = os.path.join(upload_folder, filename)
+        if not os.path.exists(path):
+            continue
+        sha256 = file_sha256(path)
+        # Byte-identical legacy copies stay separate files; only the
+        # hash of the first one seen is recorded under its own name
+        cursor.execute("""
+            INSERT INTO worksheet_blobs (sha256, filename, size, refcount)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(sha256) DO NOTHING
+        """, (sha256, filename, os.path.getsize(path), references))
+        registered += cursor.rowcount
+    return registered
+
+def migrate():
+    print(f"Connecting to database at: {database_path('notes')}")
+    
+    conn = connect_db('notes')
+    
+    try:
+        registered = upgrade(conn)
+        conn.commit()
+        print(f"Migration completed successfully! Registered {registered} existing file(s).")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
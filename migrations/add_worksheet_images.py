@@ -1,48 +1,50 @@
 import os
-import sqlite3
-from datetime import datetime
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Add the worksheet_images table and notes.has_worksheet (no commit)"""
+    cursor = conn.cursor()
+    
+    # Create worksheet_images table
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS worksheet_images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        note_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        original_filename TEXT NOT NULL,
+        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
+    )
+    """)
+    
+    # Create index for better performance
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_worksheet_images_note_id 
+    ON worksheet_images (note_id)
+    """)
+    
+    # Add a column to notes table to track if it has worksheet images
+    cursor.execute("PRAGMA table_info(notes)")
+    if not any(row[1] == 'has_worksheet' for row in cursor.fetchall()):
+        cursor.execute("""
+        ALTER TABLE notes 
+        ADD COLUMN has_worksheet BOOLEAN DEFAULT 0
+        """)
 
 def migrate():
     # Create uploads/worksheets directory if it doesn't exist
     os.makedirs('uploads/worksheets', exist_ok=True)
     
-    # Get the absolute path to the database file in the project root
-    db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'notes.db'))
-    print(f"Connecting to database at: {db_path}")
+    print(f"Connecting to database at: {database_path('notes')}")
     
-    # Connect to the database using absolute path
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = connect_db('notes')
     
     try:
-        # Create worksheet_images table
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS worksheet_images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            note_id INTEGER NOT NULL,
-            filename TEXT NOT NULL,
-            original_filename TEXT NOT NULL,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (note_id) REFERENCES notes (id) ON DELETE CASCADE
-        )
-        """)
-        
-        # Create index for better performance
-        cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_worksheet_images_note_id 
-        ON worksheet_images (note_id)
-        """)
-        
-        # Add a column to notes table to track if it has worksheet images
-        try:
-            cursor.execute("""
-            ALTER TABLE notes 
-            ADD COLUMN has_worksheet BOOLEAN DEFAULT 0
-            """)
-        except sqlite3.OperationalError:
-            # Column already exists
-            pass
-            
+        upgrade(conn)
         conn.commit()
         print("Migration completed successfully!")
         
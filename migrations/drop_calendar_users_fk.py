@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from storage import connect_db, database_path
+
+def upgrade(conn):
+    """Rebuild calendar_entries without its foreign key to users (no commit).
+
+    users lives in users.db, so SQLite cannot resolve the reference and
+    every insert fails once foreign keys are enforced.
+    """
+    cursor = conn.cursor()
+    
+    sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'calendar_entries'"
+    ).fetchone()
+    if not sql or 'REFERENCES users' not in sql[0]:
+        return
+    
+    cursor.execute("""
+    CREATE TABLE calendar_entries_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        entry_date DATE NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    INSERT INTO calendar_entries_new (id, user_id, entry_date, title, description, created_at, updated_at)
+    SELECT id, user_id, entry_date, title, description, created_at, updated_at FROM calendar_entries
+    """)
+    
+    # Indexes go with the old table and are recreated on the new one
+    indexes = cursor.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'calendar_entries' AND sql IS NOT NULL
+    """).fetchall()
+    cursor.execute("DROP TABLE calendar_entries")
+    cursor.execute("ALTER TABLE calendar_entries_new RENAME TO calendar_entries")
+    for (index_sql,) in indexes:
+        cursor.execute(index_sql)
+
+def migrate():
+    print(f"Connecting to database at: {database_path('calendar')}")
+    
+    conn = connect_db('calendar')
+    
+    try:
+        upgrade(conn)
+        
+        conn.commit()
+        print("Migration completed successfully!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {str(e)}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate()
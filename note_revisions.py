@@ -0,0 +1,155 @@
+import difflib
+import json
+import zlib
+
+# Store a full snapshot every this many revisions, so rebuilding any
+# revision applies at most this many deltas
+SNAPSHOT_INTERVAL = 10
+
+# A revision and the chain back to its nearest snapshot:
+# (note_id, revision, note_id, revision)
+REVISION_CHAIN_SQL = """
+    SELECT revision, title, kind, data FROM note_revisions
+    WHERE note_id = ? AND revision <= ? AND revision >= (
+        SELECT MAX(revision) FROM note_revisions
+        WHERE note_id = ? AND revision <= ? AND kind = 'snapshot'
+    )
+    ORDER BY revision
+"""
+
+def _split(content):
+    return (content or '').splitlines(keepends=True)
+
+def make_delta(old, new):
+    """Encode new content as line edits against old content.
+
+    The delta is a list of [start, end] ranges of old lines to copy and
+    strings of inserted text, so its size follows the size of the edit.
+    """
+    old_lines, new_lines = _split(old), _split(new)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(new_lines[j1:j2]))
+    return ops
+
+def apply_delta(old, ops):
+    """Rebuild content from the previous version and a delta from make_delta"""
+    old_lines = _split(old)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_lines[op[0]:op[1]])
+    return ''.join(parts)
+
+def _pack(value):
+    return zlib.compress(json.dumps(value).encode('utf-8'))
+
+def _unpack(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def _latest(cursor, note_id):
+    cursor.execute("""
+        SELECT revision, title FROM note_revisions
+        WHERE note_id = ?
+        ORDER BY revision DESC
+        LIMIT 1
+    """, (note_id,))
+    return cursor.fetchone()
+
+def get_revision(cursor, note_id, revision):
+    """Return (title, content) of a revision, or None if it does not exist.
+
+    Starts from the nearest snapshot at or before the revision and applies
+    the deltas after it.
+    """
+    cursor.execute(REVISION_CHAIN_SQL, (note_id, revision, note_id, revision))
+    rows = cursor.fetchall()
+    if not rows or rows[-1][0] != revision:
+        return None
+
+    content = None
+    for _, title, kind, data in rows:
+        if kind == 'snapshot':
+            content = _unpack(data)
+        else:
+            content = apply_delta(content, _unpack(data))
+    return rows[-1][1], content
+
+def _append(cursor, note_id, revision, title, previous_content, content, source):
+    delta = make_delta(previous_content, content) if previous_content is not None else None
+    if delta is None or revision % SNAPSHOT_INTERVAL == 1:
+        kind, data = 'snapshot', _pack(content)
+    else:
+        kind, data = 'delta', _pack(delta)
+        # An edit that rewrites most of the note is cheaper to store whole
+        snapshot = _pack(content)
+        if len(snapshot) <= len(data):
+            kind, data = 'snapshot', snapshot
+
+    cursor.execute("""
+        INSERT INTO note_revisions (note_id, revision, kind, title, data, size, source)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (note_id, revision, kind, title, data, len(data), source))
+    return revision
+
+def record_revision(cursor, note_id, previous, current, source='edit'):
+    """Record a change to a note; previous and current are (title, content).
+
+    Call in the same transaction as the UPDATE of the note. The first time
+    a note changes, its previous version is stored too, so the change can
+    be undone. Returns the new revision number, or None if nothing changed.
+    """
+    if tuple(current) == tuple(previous):
+        return None
+
+    latest = _latest(cursor, note_id)
+    if latest:
+        revision = latest[0]
+        stored = get_revision(cursor, note_id, revision)
+        if stored != tuple(previous):
+            # Changed by something that did not record a revision
+            revision = _append(cursor, note_id, revision + 1, previous[0], stored[1], previous[1], 'external')
+    else:
+        revision = _append(cursor, note_id, 1, previous[0], None, previous[1], 'original')
+    return _append(cursor, note_id, revision + 1, current[0], previous[1], current[1], source)
+
+def list_revisions(cursor, note_id):
+    """Return a note's revisions, newest first, without their content"""
+    cursor.execute("""
+        SELECT revision, kind, title, size, source, created_at
+        FROM note_revisions
+        WHERE note_id = ?
+        ORDER BY revision DESC
+    """, (note_id,))
+    return [
+        {'revision': revision, 'kind': kind, 'title': title, 'size': size,
+         'source': source, 'created_at': created_at}
+        for revision, kind, title, size, source, created_at in cursor.fetchall()
+    ]
+
+def _diff_lines(content):
+    """Lines without their newline, marking a last line that has none the way diff does"""
+    lines = (content or '').split('\n')
+    if lines[-1]:
+        lines[-1] += '\n\\ No newline at end of file'
+    else:
+        lines.pop()
+    return lines
+
+def diff_revisions(cursor, note_id, from_revision, to_revision):
+    """Return a unified diff between two revisions, or None if either is missing"""
+    old = get_revision(cursor, note_id, from_revision)
+    new = get_revision(cursor, note_id, to_revision)
+    if old is None or new is None:
+        return None
+    lines = list(difflib.unified_diff(
+        _diff_lines(old[1]), _diff_lines(new[1]),
+        fromfile=f"revision {from_revision}", tofile=f"revision {to_revision}", lineterm=''
+    ))
+    return '\n'.join(lines) + '\n' if lines else ''
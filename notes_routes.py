@@ -1,81 +1,68 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort, send_from_directory, jsonify, current_app
-from sql import SQL
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort, send_from_directory, send_file, jsonify, current_app
+from storage import get_sql, get_db, connect_db
 import sqlite3
 from datetime import datetime
 import re
 import os
 import uuid
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import HTTPException
+import mimetypes
+import hashlib
 import subprocess
 import json
+from worksheet_storage import UPLOAD_FOLDER, save_uploads, share_note_files, release_file_reference, queue_file_removal
+from file_sweeper import get_file_sweeper
+from note_revisions import record_revision, get_revision, list_revisions, diff_revisions
+from worksheet_thumbnails import get_thumbnail_service, THUMBNAIL_SIZES
 
-# Configure upload folder and allowed extensions
-UPLOAD_FOLDER = os.path.join('uploads', 'worksheets')
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'txt'}
+# Every note for the list page, grouped by unit (sorted by an expression,
+# so this reads the whole table)
+INDEX_SQL = """
+    SELECT id, title, unit_number,
+           strftime('%Y-%m-%d', created_at) as created_date,
+           strftime('%Y-%m-%d', last_updated) as last_updated,
+           is_favorite, has_worksheet
+    FROM notes
+    ORDER BY
+        CASE WHEN unit_number = '' OR unit_number IS NULL THEN 1 ELSE 0 END,
+        CAST(unit_number AS INTEGER) DESC,
+        last_updated DESC
+"""
 
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# One note for its page
+NOTE_SQL = """
+    SELECT *,
+           strftime('%Y-%m-%d', created_at) as created_date,
+           strftime('%Y-%m-%d', last_updated) as last_updated
+    FROM notes
+    WHERE id = ?
+"""
+
+WORKSHEET_IMAGES_SQL = """
+    SELECT id, filename, original_filename,
+           strftime('%Y-%m-%d %H:%M', upload_date) as upload_date
+    FROM worksheet_images
+    WHERE note_id = ?
+    ORDER BY upload_date DESC
+"""
 
 def save_worksheet_images(note_id, files):
     """Save uploaded worksheet images and return a list of saved filenames"""
     if 'worksheet_images' not in files:
         return []
     
-    saved_files = []
-    for file in files.getlist('worksheet_images'):
-        if file and allowed_file(file.filename):
-            # Generate a unique filename to prevent collisions
-            ext = file.filename.rsplit('.', 1)[1].lower()
-            filename = f"{uuid.uuid4()}.{ext}"
-            
-            # Ensure the upload directory exists
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            
-            # Save the file
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            
-            # Save file info to database using raw SQLite connection
-            conn = sqlite3.connect('notes.db')
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO worksheet_images (note_id, filename, original_filename)
-                VALUES (?, ?, ?)
-            """, (note_id, filename, file.filename))
-            
-            # Get the ID of the last inserted row
-            worksheet_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            saved_files.append({
-                'id': worksheet_id,
-                'filename': filename,
-                'original_filename': file.filename
-            })
-    
-    # Update the has_worksheet flag on the note
-    if saved_files:
-        db = SQL("sqlite:///notes.db")
-        db.execute("""
-            UPDATE notes 
-            SET has_worksheet = 1 
-            WHERE id = :note_id
-        """, note_id=note_id)
-    
-    return saved_files
+    # Files are streamed to content-addressed blobs; all rows go in one commit
+    conn = connect_db('notes')
+    try:
+        return save_uploads(conn, note_id, files.getlist('worksheet_images'))
+    finally:
+        conn.close()
 
 def get_worksheet_images(note_id):
     """Get all worksheet images for a note"""
-    db = SQL("sqlite:///notes.db")
-    return db.execute("""
-        SELECT id, filename, original_filename, 
-               strftime('%Y-%m-%d %H:%M', upload_date) as upload_date
-        FROM worksheet_images 
-        WHERE note_id = :note_id
-        ORDER BY upload_date DESC
-    """, note_id=note_id)
+    return [dict(row) for row in get_db().execute(WORKSHEET_IMAGES_SQL, (note_id,))]
 
 # Initialize Blueprint
 notes_bp = Blueprint('notes', __name__, url_prefix='/notes')
@@ -84,18 +71,8 @@ notes_bp = Blueprint('notes', __name__, url_prefix='/notes')
 def index():
     """Display all notes"""
     
-    db = SQL("sqlite:///notes.db")
-    notes = db.execute("""
-        SELECT id, title, unit_number, 
-               strftime('%Y-%m-%d', created_at) as created_date,
-               strftime('%Y-%m-%d', last_updated) as last_updated,
-               is_favorite, has_worksheet
-        FROM notes 
-        ORDER BY 
-            CASE WHEN unit_number = '' OR unit_number IS NULL THEN 1 ELSE 0 END,
-            CAST(unit_number AS INTEGER) DESC,
-            last_updated DESC
-    """)
+    db = get_sql('notes')
+    notes = db.execute(INDEX_SQL)
     
     # Group notes by unit number for better organization
     notes_by_unit = {}
@@ -138,7 +115,7 @@ def add_note():
             unit_number = int(unit_number) if unit_number else None
             
             # Use a raw SQLite connection to get the lastrowid
-            conn = sqlite3.connect('notes.db')
+            conn = connect_db('notes')
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -185,7 +162,7 @@ def edit_note(note_id):
     if not session.get("name"):
         return redirect("/auth/login")
     
-    db = SQL("sqlite:///notes.db")
+    db = get_sql('notes')
     
     # Get the note first to ensure it exists
     note = db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
@@ -220,27 +197,41 @@ def edit_note(note_id):
         try:
             unit_number = int(unit_number) if unit_number else None
             
-            # Update the note
-            db.execute("""
-                UPDATE notes 
-                SET title = :title,
-                    content = :content,
-                    unit_number = :unit_number,
-                    tags = :tags,
-                    related_entries = :related_entries,
-                    comments = :comments,
-                    is_favorite = :is_favorite,
-                    last_updated = CURRENT_TIMESTAMP
-                WHERE id = :id
-            """, 
-            id=note_id,
-            title=title,
-            content=content,
-            unit_number=unit_number,
-            tags=tags if tags else None,
-            related_entries=related_entries if related_entries else None,
-            comments=comments if comments else None,
-            is_favorite=is_favorite)
+            # Update the note and record the change in its history together
+            conn = connect_db('notes')
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT title, content FROM notes WHERE id = ?", (note_id,))
+                previous = cursor.fetchone()
+                if previous is None:
+                    # Deleted since it was read above
+                    conn.rollback()
+                    abort(404)
+                cursor.execute("""
+                    UPDATE notes 
+                    SET title = ?,
+                        content = ?,
+                        unit_number = ?,
+                        tags = ?,
+                        related_entries = ?,
+                        comments = ?,
+                        is_favorite = ?,
+                        last_updated = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, 
+                (title,
+                 content,
+                 unit_number,
+                 tags if tags else None,
+                 related_entries if related_entries else None,
+                 comments if comments else None,
+                 is_favorite,
+                 note_id))
+                record_revision(cursor, note_id, previous, (title, content), 'edit')
+                conn.commit()
+            finally:
+                conn.close()
             
             # Handle worksheet images if any
             if 'worksheet_images' in request.files:
@@ -251,6 +242,8 @@ def edit_note(note_id):
             flash('Note updated successfully!', 'success')
             return redirect(url_for('notes.view_note', note_id=note_id))
             
+        except HTTPException:
+            raise
         except Exception as e:
             flash(f'An error occurred: {str(e)}', 'error')
             return render_template('notes/edit.html', note={
@@ -274,7 +267,7 @@ def edit_note(note_id):
 @notes_bp.route('/<int:note_id>/content')
 def get_note_content(note_id):
     """Get the full content of a note by ID for search functionality"""
-    db = SQL("sqlite:///notes.db")
+    db = get_sql('notes')
     note = db.execute("SELECT content FROM notes WHERE id = ?", note_id)
     
     if not note:
@@ -282,10 +275,151 @@ def get_note_content(note_id):
         
     return {"content": note[0]['content']}
 
+# Worksheet files never change once stored (their names are content hashes
+# or UUIDs), so browsers may keep them for a year without revalidating
+WORKSHEET_MAX_AGE = 365 * 24 * 60 * 60
+
+def get_worksheet_etag(filename):
+    """Return a strong ETag for a stored worksheet, or None if unknown"""
+    stem = filename.rsplit('.', 1)[0]
+    if re.fullmatch(r'[0-9a-f]{64}', stem):
+        return stem
+    
+    # Files stored before content addressing may have a registered hash
+    conn = connect_db('notes')
+    try:
+        row = conn.execute("SELECT sha256 FROM worksheet_blobs WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+def set_worksheet_cache_headers(response, etag):
+    response.cache_control.public = True
+    response.cache_control.max_age = WORKSHEET_MAX_AGE
+    response.cache_control.immutable = True
+    if etag:
+        response.set_etag(etag)
+    return response
+
 @notes_bp.route('/worksheet/<filename>')
 def serve_worksheet(filename):
-    """Serve uploaded worksheet files"""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """Serve uploaded worksheet files.
+
+    Responses are cacheable forever and carry a strong ETag, so revisits
+    are answered with 304 before the file is touched. Range requests are
+    honoured for large PDFs. With WORKSHEET_SENDFILE set to 'x-sendfile' or
+    'x-accel-redirect', the front-end server sends the bytes instead.
+    """
+    path = safe_join(os.path.join(current_app.root_path, UPLOAD_FOLDER), filename)
+    if path is None:
+        abort(404)
+    
+    etag = get_worksheet_etag(filename)
+    if etag and request.if_none_match.contains(etag):
+        return set_worksheet_cache_headers(current_app.response_class(status=304), etag)
+    
+    if not os.path.isfile(path):
+        abort(404)
+    
+    sendfile_mode = current_app.config.get('WORKSHEET_SENDFILE')
+    if sendfile_mode in ('x-sendfile', 'x-accel-redirect'):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = current_app.response_class(mimetype=mimetype)
+        if sendfile_mode == 'x-sendfile':
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+        else:
+            prefix = current_app.config.get('WORKSHEET_ACCEL_PREFIX', '/protected/worksheets/')
+            response.headers['X-Accel-Redirect'] = prefix + filename
+        return set_worksheet_cache_headers(response, etag)
+    
+    response = send_from_directory(UPLOAD_FOLDER, filename,
+                                   max_age=WORKSHEET_MAX_AGE,
+                                   etag=etag if etag else True,
+                                   conditional=True)
+    return set_worksheet_cache_headers(response, etag)
+
+# Seconds a request waits for a new thumbnail before telling the browser to retry
+THUMBNAIL_WAIT = 2
+
+@notes_bp.route('/worksheet/<filename>/thumbnail/<int:size>')
+def worksheet_thumbnail(filename, size):
+    """Serve a resized preview of a worksheet image or the first page of a PDF"""
+    if size not in THUMBNAIL_SIZES:
+        abort(404)
+    
+    source = safe_join(UPLOAD_FOLDER, filename)
+    if source is None or not os.path.isfile(source):
+        abort(404)
+    
+    # No preview possible (e.g. PDFs without poppler); templates fall back to an icon
+    service = get_thumbnail_service()
+    if not service.can_preview(filename):
+        abort(404)
+    
+    # Key thumbnails by content so they can be cached forever
+    source_hash = get_worksheet_etag(filename)
+    if not source_hash:
+        stat = os.stat(source)
+        source_hash = hashlib.sha256(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    
+    accept_webp = any(mimetype == 'image/webp' for mimetype, _ in request.accept_mimetypes)
+    path = service.get(filename, source_hash, size, accept_webp=accept_webp, wait=THUMBNAIL_WAIT)
+    if path is None:
+        response = current_app.response_class(status=503)
+        response.headers['Retry-After'] = '1'
+        response.cache_control.no_store = True
+        return response
+    
+    response = send_file(os.path.abspath(path),
+                         max_age=WORKSHEET_MAX_AGE,
+                         etag=os.path.basename(path),
+                         conditional=True)
+    response.vary.add('Accept')
+    return set_worksheet_cache_headers(response, None)
+
+# Most note IDs bound in one statement, below SQLite's variable limit
+DELETE_CHUNK_SIZE = 500
+
+def delete_notes(note_ids):
+    """Delete notes and their worksheet rows in a single transaction.
+
+    Stored files that no note references any more are queued in
+    file_cleanup_queue for the background sweeper instead of being
+    unlinked here. Returns (notes deleted, files queued).
+    """
+    note_ids = list(dict.fromkeys(note_ids))
+    # connect_db turns foreign keys on, so revisions cascade with their notes
+    conn = connect_db('notes', isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = 0
+            unused = []
+            for start in range(0, len(note_ids), DELETE_CHUNK_SIZE):
+                chunk = note_ids[start:start + DELETE_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                
+                filenames = [row[0] for row in conn.execute(
+                    f"SELECT filename FROM worksheet_images WHERE note_id IN ({placeholders})", chunk)]
+                conn.execute(f"DELETE FROM worksheet_images WHERE note_id IN ({placeholders})", chunk)
+                cursor = conn.cursor()
+                unused.extend(filename for filename in filenames if release_file_reference(cursor, filename))
+                
+                deleted += conn.execute(f"DELETE FROM notes WHERE id IN ({placeholders})", chunk).rowcount
+            
+            queue_file_removal(conn.cursor(), unused)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    
+    if unused:
+        get_file_sweeper().wake()
+    return deleted, len(unused)
 
 @notes_bp.route('/<int:note_id>/delete', methods=['POST'])
 def delete_note(note_id):
@@ -295,25 +429,7 @@ def delete_note(note_id):
         return redirect(url_for('auth.login'))
     
     try:
-        db = SQL("sqlite:///notes.db")
-        
-        # First, delete any associated worksheet files and their database entries
-        worksheets = db.execute("""
-            SELECT filename FROM worksheet_images 
-            WHERE note_id = :note_id
-        """, note_id=note_id)
-        
-        # Delete the actual files
-        for worksheet in worksheets:
-            try:
-                file_path = os.path.join(UPLOAD_FOLDER, worksheet['filename'])
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                current_app.logger.error(f"Error deleting worksheet file {worksheet['filename']}: {str(e)}")
-        
-        # Delete the note from the database
-        db.execute("DELETE FROM notes WHERE id = :note_id", note_id=note_id)
+        delete_notes([note_id])
         
         flash('Note deleted successfully', 'success')
         return redirect(url_for('notes.index'))
@@ -323,6 +439,28 @@ def delete_note(note_id):
         flash('An error occurred while deleting the note', 'error')
         return redirect(url_for('notes.view_note', note_id=note_id))
 
+@notes_bp.route('/api/bulk_delete', methods=['POST'])
+def bulk_delete_notes():
+    """Delete many notes at once"""
+    if not session.get("name"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    data = request.get_json()
+    note_ids = data.get('note_ids') if data else None
+    if not isinstance(note_ids, list) or not all(isinstance(note_id, int) for note_id in note_ids):
+        return jsonify({"error": "note_ids must be a list of note IDs"}), 400
+    
+    try:
+        deleted, files_queued = delete_notes(note_ids)
+        return jsonify({
+            "success": True,
+            "deleted": deleted,
+            "files_queued": files_queued
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error bulk deleting notes: {str(e)}")
+        return jsonify({"error": "Failed to delete notes"}), 500
+
 @notes_bp.route('/<int:note_id>/duplicate', methods=['POST'])
 def duplicate_note(note_id):
     """Duplicate a note to a different unit"""
@@ -338,7 +476,7 @@ def duplicate_note(note_id):
     
     try:
         # Get the original note
-        db = SQL("sqlite:///notes.db")
+        db = get_sql('notes')
         note = db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
         
         if not note:
@@ -358,7 +496,7 @@ def duplicate_note(note_id):
         }
         
         # Insert the new note
-        conn = sqlite3.connect('notes.db')
+        conn = connect_db('notes')
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -376,40 +514,14 @@ def duplicate_note(note_id):
         
         new_note_id = cursor.lastrowid
         
-        # Handle worksheet images if requested
+        # Share worksheet files with the copy instead of copying them
         if include_worksheets and note.get('has_worksheet'):
-            # Get original worksheets
-            worksheets = db.execute("""
-                SELECT filename, original_filename 
-                FROM worksheet_images 
-                WHERE note_id = :note_id
-            """, note_id=note_id)
-            
-            # Copy worksheet files and create new records
-            for worksheet in worksheets:
-                original_path = os.path.join(UPLOAD_FOLDER, worksheet['filename'])
-                if os.path.exists(original_path):
-                    # Generate new filename to avoid conflicts
-                    file_ext = os.path.splitext(worksheet['filename'])[1]
-                    new_filename = f"{uuid.uuid4()}{file_ext}"
-                    new_path = os.path.join(UPLOAD_FOLDER, new_filename)
-                    
-                    # Copy the file
-                    import shutil
-                    shutil.copy2(original_path, new_path)
-                    
-                    # Create new worksheet record
-                    cursor.execute("""
-                        INSERT INTO worksheet_images (note_id, filename, original_filename)
-                        VALUES (?, ?, ?)
-                    """, (new_note_id, new_filename, worksheet['original_filename']))
-            
-            # Update has_worksheet flag
-            cursor.execute("""
-                UPDATE notes 
-                SET has_worksheet = 1 
-                WHERE id = ?
-            """, (new_note_id,))
+            if share_note_files(cursor, note_id, new_note_id):
+                cursor.execute("""
+                    UPDATE notes 
+                    SET has_worksheet = 1 
+                    WHERE id = ?
+                """, (new_note_id,))
         
         conn.commit()
         conn.close()
@@ -433,7 +545,7 @@ def delete_worksheet(worksheet_id):
     if not session.get("name"):
         return redirect("/auth/login")
     
-    db = SQL("sqlite:///notes.db")
+    db = get_sql('notes')
     
     # Get the worksheet to delete
     worksheet = db.execute("""
@@ -449,28 +561,31 @@ def delete_worksheet(worksheet_id):
     worksheet = worksheet[0]
     
     try:
-        # Delete the file
-        filepath = os.path.join(UPLOAD_FOLDER, worksheet['filename'])
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        # Delete the database record
-        db.execute("DELETE FROM worksheet_images WHERE id = :id", id=worksheet_id)
-        
-        # Check if there are any remaining worksheets for this note
-        remaining = db.execute("""
-            SELECT COUNT(*) as count 
-            FROM worksheet_images 
-            WHERE note_id = :note_id
-        """, note_id=worksheet['note_id'])
-        
-        # Update the has_worksheet flag if no more worksheets
-        if remaining and remaining[0]['count'] == 0:
-            db.execute("""
+        conn = connect_db('notes')
+        try:
+            cursor = conn.cursor()
+            
+            # Delete the database record and release the stored file
+            cursor.execute("DELETE FROM worksheet_images WHERE id = ?", (worksheet_id,))
+            unused = release_file_reference(cursor, worksheet['filename'])
+            
+            # Update the has_worksheet flag if no more worksheets
+            cursor.execute("""
                 UPDATE notes 
                 SET has_worksheet = 0 
-                WHERE id = :note_id
-            """, note_id=worksheet['note_id'])
+                WHERE id = ?
+                AND NOT EXISTS (SELECT 1 FROM worksheet_images WHERE note_id = ?)
+            """, (worksheet['note_id'], worksheet['note_id']))
+            
+            # Other notes may still share the file
+            if unused:
+                queue_file_removal(cursor, [worksheet['filename']])
+            conn.commit()
+        finally:
+            conn.close()
+        
+        if unused:
+            get_file_sweeper().wake()
         
         flash('Worksheet deleted successfully', 'success')
         return redirect(url_for('notes.edit_note', note_id=worksheet['note_id']))
@@ -483,28 +598,24 @@ def delete_worksheet(worksheet_id):
 def view_note(note_id):
     """View a specific note"""
     
-    db = SQL("sqlite:///notes.db")
+    # Notes, dictionary entries and worksheets come from one attached connection
+    db = get_db()
     
     # Get the note
-    note = db.execute("""
-        SELECT *,
-               strftime('%Y-%m-%d', created_at) as created_date,
-               strftime('%Y-%m-%d', last_updated) as last_updated
-        FROM notes 
-        WHERE id = :id
-    """, id=note_id)
+    note = db.execute(NOTE_SQL, (note_id,)).fetchone()
     
     if not note:
         abort(404)
     
-    note = note[0]
+    note = dict(note)
     
     # Increment view count
     db.execute("""
         UPDATE notes 
         SET views = COALESCE(views, 0) + 1 
-        WHERE id = :id
-    """, id=note_id)
+        WHERE id = ?
+    """, (note_id,))
+    db.commit()
     
     # Parse content for markdown-like formatting
     content = note['content']
@@ -559,13 +670,11 @@ def view_note(note_id):
     if note.get('related_entries'):
         entry_ids = [int(id_str.strip()) for id_str in note['related_entries'].split(',') if id_str.strip().isdigit()]
         if entry_ids:
-            # Connect to the dictionary database
-            dict_db = SQL("sqlite:///dictionary.db")
-            related_entries = dict_db.execute("""
+            related_entries = [dict(row) for row in db.execute("""
                 SELECT id, word_phrase 
-                FROM entries 
+                FROM dictionary.entries 
                 WHERE id IN ({})
-            """.format(','.join(['?'] * len(entry_ids))), *entry_ids)
+            """.format(','.join(['?'] * len(entry_ids))), entry_ids)]
     
     # Get worksheet images for this note
     worksheet_images = []
@@ -578,12 +687,97 @@ def view_note(note_id):
                          related_entries=related_entries,
                          worksheet_images=worksheet_images)
 
+@notes_bp.route('/<int:note_id>/revisions')
+def note_revisions(note_id):
+    """List a note's revisions, newest first"""
+    if not session.get("name"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    conn = connect_db('notes')
+    try:
+        revisions = list_revisions(conn.cursor(), note_id)
+    finally:
+        conn.close()
+    return jsonify({"note_id": note_id, "revisions": revisions})
+
+@notes_bp.route('/<int:note_id>/revisions/<int:revision>')
+def note_revision(note_id, revision):
+    """Return the title and content of one revision"""
+    if not session.get("name"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    conn = connect_db('notes')
+    try:
+        stored = get_revision(conn.cursor(), note_id, revision)
+    finally:
+        conn.close()
+    if stored is None:
+        return jsonify({"error": "Revision not found"}), 404
+    return jsonify({"note_id": note_id, "revision": revision, "title": stored[0], "content": stored[1]})
+
+@notes_bp.route('/<int:note_id>/revisions/diff')
+def note_revision_diff(note_id):
+    """Unified diff between two revisions (?from=<revision>&to=<revision>)"""
+    if not session.get("name"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    from_revision = request.args.get('from', type=int)
+    to_revision = request.args.get('to', type=int)
+    if from_revision is None or to_revision is None:
+        return jsonify({"error": "from and to revisions are required"}), 400
+    
+    conn = connect_db('notes')
+    try:
+        diff = diff_revisions(conn.cursor(), note_id, from_revision, to_revision)
+    finally:
+        conn.close()
+    if diff is None:
+        return jsonify({"error": "Revision not found"}), 404
+    return jsonify({"note_id": note_id, "from": from_revision, "to": to_revision, "diff": diff})
+
+@notes_bp.route('/<int:note_id>/revisions/<int:revision>/restore', methods=['POST'])
+def restore_note_revision(note_id, revision):
+    """Put a revision's title and content back into the note"""
+    if not session.get("name"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    conn = connect_db('notes')
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        stored = get_revision(cursor, note_id, revision)
+        cursor.execute("SELECT title, content FROM notes WHERE id = ?", (note_id,))
+        previous = cursor.fetchone()
+        if stored is None or previous is None:
+            conn.rollback()
+            return jsonify({"error": "Revision not found"}), 404
+        
+        cursor.execute("""
+            UPDATE notes SET title = ?, content = ?, last_updated = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (stored[0], stored[1], note_id))
+        new_revision = record_revision(cursor, note_id, previous, stored, 'restore')
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.error(f"Error restoring revision {revision} of note {note_id}: {str(e)}")
+        return jsonify({"error": "Failed to restore revision"}), 500
+    finally:
+        conn.close()
+    
+    return jsonify({
+        "success": True,
+        "revision": new_revision,
+        "title": stored[0],
+        "content": stored[1]
+    })
+
 @notes_bp.route('/<int:note_id>/enhance', methods=['POST'])
 def enhance_note(note_id):
     """Enhance a note using AI"""
     try:
         # Get the note from the database
-        db = SQL("sqlite:///notes.db")
+        db = get_sql('notes')
         note = db.execute("SELECT * FROM notes WHERE id = :id", id=note_id)
         
         if not note:
@@ -0,0 +1,147 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# scrypt cost: N (CPU/memory, a power of two), r (block size), p (parallelism).
+# Calibrate N for this machine with benchmark_hashing.py and set SCRYPT_N.
+SCRYPT_N = int(os.getenv('SCRYPT_N', 2 ** 15))
+SCRYPT_R = int(os.getenv('SCRYPT_R', 8))
+SCRYPT_P = int(os.getenv('SCRYPT_P', 1))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Hashes computed at once per process; more logins queue instead of
+# taking every core away from other requests
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+
+# Longest a login waits for its turn and its hash, in seconds
+VERIFY_TIMEOUT = 10
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+class ScryptHasher(object):
+    """scrypt from hashlib, stored as scrypt$n=..,r=..,p=..$salt$key.
+
+    The parameters travel with each hash, so raising the cost only
+    affects new hashes and old ones are upgraded as users log in.
+    """
+    algorithm = 'scrypt'
+
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.n, self.r, self.p = n, r, p
+
+    @staticmethod
+    def _derive(password, salt, n, r, p):
+        # scrypt needs 128 * n * r * p bytes; allow that plus some headroom
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+    def encode(self, password):
+        salt = os.urandom(SALT_BYTES)
+        key = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{self.algorithm}$n={self.n},r={self.r},p={self.p}${_b64encode(salt)}${_b64encode(key)}"
+
+    @staticmethod
+    def _parse(encoded):
+        _, params, salt, key = encoded.split('$')
+        params = dict(item.split('=') for item in params.split(','))
+        return int(params['n']), int(params['r']), int(params['p']), _b64decode(salt), _b64decode(key)
+
+    def verify(self, password, encoded):
+        n, r, p, salt, key = self._parse(encoded)
+        return hmac.compare_digest(self._derive(password, salt, n, r, p), key)
+
+    def needs_rehash(self, encoded):
+        n, r, p, _, _ = self._parse(encoded)
+        return (n, r, p) != (self.n, self.r, self.p)
+
+class LegacySha256Hasher(object):
+    """The original SHA-256 of password + ENCRYPTION_KEY; verify only"""
+    algorithm = 'sha256'
+    pattern = re.compile(r'^[0-9a-f]{64}$')
+
+    def verify(self, password, encoded):
+        from SarvAuth import hash
+        return hmac.compare_digest(hash(password), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+# Hashers by algorithm; the default creates every new hash
+HASHERS = {hasher.algorithm: hasher for hasher in (ScryptHasher(), LegacySha256Hasher())}
+DEFAULT_HASHER = HASHERS[os.getenv('PASSWORD_HASHER', 'scrypt')]
+if not hasattr(DEFAULT_HASHER, 'encode'):
+    raise RuntimeError(f"PASSWORD_HASHER={DEFAULT_HASHER.algorithm} can only verify existing hashes")
+
+def identify(encoded):
+    """Return the hasher that made a stored hash, or None"""
+    if not encoded:
+        return None
+    if LegacySha256Hasher.pattern.match(encoded):
+        return HASHERS['sha256']
+    return HASHERS.get(encoded.split('$', 1)[0])
+
+def hash_password(password):
+    """Hash a password with the default hasher"""
+    return DEFAULT_HASHER.encode(password)
+
+def check_password(password, encoded):
+    """Return (matches, needs_rehash) for a password and a stored hash.
+
+    With no stored hash (unknown user) a dummy hash is checked instead,
+    so the response takes as long as for a real account.
+    """
+    hasher = identify(encoded)
+    if hasher is None:
+        DEFAULT_HASHER.verify(password, _dummy_hash())
+        return False, False
+    try:
+        matches = hasher.verify(password, encoded)
+    except (ValueError, KeyError):
+        return False, False
+    return matches, matches and (hasher is not DEFAULT_HASHER or hasher.needs_rehash(encoded))
+
+_dummy = None
+
+def _dummy_hash():
+    global _dummy
+    if _dummy is None:
+        _dummy = DEFAULT_HASHER.encode(_b64encode(os.urandom(12)))
+    return _dummy
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_hash_executor():
+    """Return this process's bounded pool for password hashing"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Pool threads do not survive fork, so each worker process makes its own
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+            _executor_pid = os.getpid()
+        return _executor
+
+def verify_password(password, encoded, timeout=VERIFY_TIMEOUT):
+    """check_password on the hashing pool; the request thread only waits.
+
+    hashlib.scrypt releases the GIL, so other requests keep running while
+    at most HASH_WORKERS hashes are computed at a time. Returns None when
+    the pool is too busy to answer within timeout, so the login can be
+    retried; a check still queued is cancelled.
+    """
+    future = get_hash_executor().submit(check_password, password, encoded)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        return None
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Libraries that should only be imported when a feature needs them
+HEAVY_MODULES = ('openai', 'sqlalchemy', 'PIL', 'google.generativeai')
+
+# Imports app (or --module), builds the app, and reports the timings and
+# which heavy modules ended up loaded
+TIMING_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+if {create_app}:
+    {module}.create_app()
+created = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'loaded': [name for name in {heavy!r} if name in sys.modules],
+}}))
+'''
+
+def _code(module, create_app):
+    return TIMING_CODE.format(module=module, create_app=create_app, heavy=HEAVY_MODULES)
+
+def time_startup(module, create_app, runs):
+    """Median import and create_app times over fresh interpreters, and the heavy modules loaded"""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _code(module, create_app)], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return (statistics.median(result['import_ms'] for result in results),
+            statistics.median(result['create_ms'] for result in results),
+            results[-1]['loaded'])
+
+def import_times(module, create_app):
+    """Run once under -X importtime; return (self_us, cumulative_us, depth, name) per module"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', _code(module, create_app)], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nesting is shown by two spaces per level before the name
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Report what the app spends its start-up time importing')
+    parser.add_argument('--module', default='app', help='Module to import (default: app)')
+    parser.add_argument('--no-create-app', dest='create_app', action='store_false',
+                        help='Only import the module, without calling create_app()')
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts to time (median is used)')
+    parser.add_argument('--top', type=int, default=15, help='Modules to list')
+    parser.add_argument('--max-ms', type=float, help='Exit with an error if start-up takes longer than this')
+    args = parser.parse_args()
+    create_app = args.create_app and args.module == 'app'
+
+    import_ms, create_ms, loaded = time_startup(args.module, create_app, args.runs)
+    total_ms = import_ms + create_ms
+    print(f"import {args.module}: {import_ms:.0f}ms", end='')
+    if create_app:
+        print(f", create_app(): {create_ms:.0f}ms, total {total_ms:.0f}ms", end='')
+    print(f" (median of {args.runs} cold starts)")
+
+    rows = import_times(args.module, create_app)
+    print("\nSlowest imports including their dependencies (top level):")
+    top_level = sorted((row for row in rows if row[2] == 0), key=lambda row: -row[1])
+    for _, cumulative_us, _, name in top_level[:args.top]:
+        print(f"{cumulative_us / 1000:>9.1f}ms  {name}")
+
+    print("\nSlowest modules by their own import time:")
+    for self_us, _, _, name in sorted(rows, key=lambda row: -row[0])[:args.top]:
+        print(f"{self_us / 1000:>9.1f}ms  {name}")
+
+    print(f"\nHeavy libraries loaded at start-up: {', '.join(loaded) or 'none'}")
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"\nStart-up took {total_ms:.0f}ms, over the {args.max_ms:.0f}ms limit")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import random
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+
+from storage import connect_db
+
+# Number of wrong options kept per term for multiple-choice questions
+DISTRACTORS_PER_ENTRY = 3
+
+# Words too common to say anything about how similar two definitions are
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'into',
+    'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'to', 'was', 'which',
+    'with', 'who', 'when', 'where', 'not', 'any', 'has', 'have', 'this',
+}
+
+# Tokens shared by more than this share of a unit's definitions are ignored
+MAX_TOKEN_SHARE = 0.2
+
+# A unit's pool is rebuilt when either signature changes
+ENTRIES_SIGNATURE_SQL = """
+    SELECT COUNT(*), MAX(id), MAX(last_updated)
+    FROM entries WHERE unit_number = ?
+"""
+NOTES_SIGNATURE_SQL = """
+    SELECT COUNT(*), MAX(id), MAX(last_updated)
+    FROM notes WHERE unit_number = ?
+"""
+UNIT_ENTRIES_SQL = """
+    SELECT id, word_phrase, definition, example, unit_number
+    FROM entries WHERE unit_number = ?
+"""
+UNIT_NOTE_IDS_SQL = "SELECT id FROM notes WHERE unit_number = ?"
+
+def notes_by_id_sql(count):
+    """Fetch count sampled notes by primary key"""
+    return f"""
+        SELECT id, title, content, unit_number
+        FROM notes WHERE id IN ({','.join('?' * count)})
+    """
+
+def _tokens(text):
+    return {word for word in re.findall(r'[a-z]+', (text or '').lower())
+            if len(word) > 2 and word not in STOPWORDS}
+
+def _connect(name):
+    conn = connect_db(name, readonly=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def compute_distractors(entries, per_entry=DISTRACTORS_PER_ENTRY, rng=random):
+    """Pick the definitions most similar to each entry's own as its wrong options.
+
+    Similarity is the number of shared distinctive words, found through an
+    inverted index so only entries with something in common are compared.
+    Entries without enough similar definitions are topped up at random.
+    Returns a list of definition lists, aligned with entries.
+    """
+    token_sets = [_tokens(entry['definition']) for entry in entries]
+    postings = defaultdict(list)
+    for i, tokens in enumerate(token_sets):
+        for token in tokens:
+            postings[token].append(i)
+
+    max_postings = max(2, int(len(entries) * MAX_TOKEN_SHARE))
+    distractors = []
+    for i, tokens in enumerate(token_sets):
+        scores = defaultdict(int)
+        for token in tokens:
+            matches = postings[token]
+            if len(matches) > max_postings:
+                continue
+            for j in matches:
+                if j != i:
+                    scores[j] += 1
+
+        definition = entries[i]['definition']
+        chosen = []
+        for j in sorted(scores, key=lambda j: (-scores[j], j)):
+            if entries[j]['definition'] != definition and entries[j]['definition'] not in chosen:
+                chosen.append(entries[j]['definition'])
+                if len(chosen) == per_entry:
+                    break
+
+        # Top up with random definitions; bounded attempts keep this O(per_entry)
+        attempts = 0
+        while len(chosen) < per_entry and attempts < per_entry * 4 and len(entries) > 1:
+            attempts += 1
+            other = entries[rng.randrange(len(entries))]['definition']
+            if other != definition and other not in chosen:
+                chosen.append(other)
+        distractors.append(chosen)
+    return distractors
+
+class UnitPool(object):
+    """Question candidates for one unit, built once and reused until the unit changes"""
+
+    def __init__(self, signature, entries, distractors, note_ids):
+        self.signature = signature
+        self.entries = entries
+        self.distractors = distractors
+        self.note_ids = note_ids
+
+class QuizEngine(object):
+    """Samples test material per unit from cached candidate pools.
+
+    Each pool holds the unit's terms with precomputed distractor sets and the
+    unit's note IDs. A pool is rebuilt only when a cheap aggregate over the
+    unit (row count and latest update) changes, and sampling from it is
+    O(k) instead of an ORDER BY RANDOM() sort over the whole table.
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _signature(self, dict_conn, notes_conn, unit_number):
+        entries = dict_conn.execute(ENTRIES_SIGNATURE_SQL, (unit_number,)).fetchone()
+        notes = notes_conn.execute(NOTES_SIGNATURE_SQL, (unit_number,)).fetchone()
+        return tuple(entries) + tuple(notes)
+
+    def _build(self, dict_conn, notes_conn, unit_number, signature):
+        entries = [dict(row) for row in dict_conn.execute(UNIT_ENTRIES_SQL, (unit_number,))]
+        note_ids = [row[0] for row in notes_conn.execute(UNIT_NOTE_IDS_SQL, (unit_number,))]
+        return UnitPool(signature, entries, compute_distractors(entries, rng=self.rng), note_ids)
+
+    def get_pool(self, unit_number, dict_conn, notes_conn):
+        """Return the unit's pool, rebuilding it if the unit has changed"""
+        signature = self._signature(dict_conn, notes_conn, unit_number)
+        pool = self._pools.get(unit_number)
+        if pool is None or pool.signature != signature:
+            pool = self._build(dict_conn, notes_conn, unit_number, signature)
+            with self._lock:
+                self._pools[unit_number] = pool
+        return pool
+
+    def invalidate(self, unit_number=None):
+        """Drop cached pools for one unit, or for all units"""
+        with self._lock:
+            if unit_number is None:
+                self._pools.clear()
+            else:
+                self._pools.pop(unit_number, None)
+
+    def sample(self, unit_number, num_entries=20, num_notes=5, conn=None):
+        """Return (entries, notes) sampled at random from a unit.
+
+        Each entry dict carries a 'distractors' list of similar wrong
+        definitions. Notes are fetched by primary key after sampling IDs.
+        conn may be a connection with both databases attached (such as
+        storage.get_db()); otherwise read-only connections are opened.
+        """
+        if conn is not None:
+            dict_conn = notes_conn = conn
+        else:
+            dict_conn = _connect('dictionary')
+            notes_conn = _connect('notes')
+        try:
+            pool = self.get_pool(unit_number, dict_conn, notes_conn)
+
+            indexes = self.rng.sample(range(len(pool.entries)), min(num_entries, len(pool.entries)))
+            entries = [dict(pool.entries[i], distractors=pool.distractors[i]) for i in indexes]
+
+            notes = []
+            note_ids = self.rng.sample(pool.note_ids, min(num_notes, len(pool.note_ids)))
+            if note_ids:
+                notes = [dict(row) for row in notes_conn.execute(notes_by_id_sql(len(note_ids)), note_ids)]
+                self.rng.shuffle(notes)
+            return entries, notes
+        finally:
+            if conn is None:
+                dict_conn.close()
+                notes_conn.close()
+
+_engine = QuizEngine()
+
+def get_quiz_engine():
+    """Return the process-wide quiz engine"""
+    return _engine
@@ -0,0 +1,295 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from flask import current_app
+
+from storage import database_path
+
+# Default lifetime of an unfinished quiz, in seconds
+DEFAULT_TTL = 2 * 60 * 60
+
+# How long results of finished quizzes are kept, in seconds
+DEFAULT_RESULT_TTL = 90 * 24 * 60 * 60
+
+# How often (at most) expired sessions and old results are swept, in seconds
+SWEEP_INTERVAL = 60
+
+def _pack(value):
+    """Serialize a value to compact, compressed JSON"""
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+def _unpack(blob):
+    """Inverse of _pack"""
+    if blob is None:
+        return None
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def _new_session_id():
+    return f"quiz_{uuid.uuid4().hex}"
+
+class QuizStore(ABC):
+    """Interface for quiz session backends.
+
+    A quiz session holds the generated questions until the quiz is submitted
+    or its TTL runs out. Submitting records the result and removes the
+    session, so stores only ever hold quizzes that are still in progress.
+    Results are kept for a retention period and then pruned.
+    """
+
+    @abstractmethod
+    def create(self, user_id, questions, meta=None):
+        """Store a new quiz and return its session ID"""
+
+    @abstractmethod
+    def get(self, session_id):
+        """Return the quiz session as a dict, or None if missing or expired"""
+
+    @abstractmethod
+    def complete(self, session_id, answers, score, total_questions):
+        """Record the result of a quiz and drop its session; return False if not found"""
+
+    @abstractmethod
+    def evict_expired(self):
+        """Remove expired sessions and return how many were removed"""
+
+    @abstractmethod
+    def prune_results(self):
+        """Remove results older than the retention period and return how many were removed"""
+
+class MemoryQuizStore(QuizStore):
+    """Process-local store for development; bounded by TTL and session count"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=1000, result_ttl=DEFAULT_RESULT_TTL):
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.results = []
+
+    def create(self, user_id, questions, meta=None):
+        session_id = _new_session_id()
+        now = time.time()
+        with self._lock:
+            self._evict_locked(now)
+            self._prune_results_locked(now)
+            self._sessions[session_id] = {
+                'id': session_id,
+                'user_id': user_id,
+                'questions': _pack(questions),
+                'meta': meta,
+                'started_at': now,
+                'expires_at': now + self.ttl,
+            }
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id):
+        with self._lock:
+            quiz = self._sessions.get(session_id)
+            if not quiz or quiz['expires_at'] < time.time():
+                return None
+            return dict(quiz, questions=_unpack(quiz['questions']))
+
+    def complete(self, session_id, answers, score, total_questions):
+        with self._lock:
+            quiz = self._sessions.pop(session_id, None)
+            if not quiz or quiz['expires_at'] < time.time():
+                return False
+            self.results.append({
+                'session_id': session_id,
+                'user_id': quiz['user_id'],
+                'score': score,
+                'total_questions': total_questions,
+                'answers': answers,
+                'started_at': quiz['started_at'],
+                'completed_at': time.time(),
+            })
+            return True
+
+    def evict_expired(self):
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def _evict_locked(self, now):
+        expired = [key for key, quiz in self._sessions.items() if quiz['expires_at'] < now]
+        for key in expired:
+            del self._sessions[key]
+        return len(expired)
+
+    def prune_results(self):
+        with self._lock:
+            return self._prune_results_locked(time.time())
+
+    def _prune_results_locked(self, now):
+        # Results are appended in completion order, so old ones are at the front
+        cutoff = now - self.result_ttl
+        count = 0
+        while count < len(self.results) and self.results[count]['completed_at'] < cutoff:
+            count += 1
+        del self.results[:count]
+        return count
+
+class SQLiteQuizStore(QuizStore):
+    """Quiz sessions and results in a SQLite file shared by all worker processes"""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, result_ttl=DEFAULT_RESULT_TTL):
+        self.path = path or database_path('quizzes')
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self._last_sweep = 0
+        self._init_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS quiz_sessions (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    questions BLOB NOT NULL,        -- zlib-compressed JSON
+                    meta TEXT,                      -- JSON, e.g. context token usage
+                    started_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_quiz_sessions_expires
+                    ON quiz_sessions(expires_at);
+
+                CREATE TABLE IF NOT EXISTS quiz_results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    user_id INTEGER,
+                    score INTEGER,
+                    total_questions INTEGER,
+                    answers BLOB,                   -- zlib-compressed JSON
+                    questions BLOB,                 -- kept for later review
+                    started_at REAL,
+                    completed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_quiz_results_user
+                    ON quiz_results(user_id, completed_at);
+                CREATE INDEX IF NOT EXISTS idx_quiz_results_completed
+                    ON quiz_results(completed_at);
+            """)
+        finally:
+            conn.close()
+
+    def create(self, user_id, questions, meta=None):
+        session_id = _new_session_id()
+        now = time.time()
+        self._maybe_sweep(now)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT INTO quiz_sessions (id, user_id, questions, meta, started_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (session_id, user_id, _pack(questions),
+                      json.dumps(meta) if meta is not None else None,
+                      now, now + self.ttl))
+        finally:
+            conn.close()
+        return session_id
+
+    def get(self, session_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("""
+                SELECT id, user_id, questions, meta, started_at, expires_at
+                FROM quiz_sessions
+                WHERE id = ? AND expires_at >= ?
+            """, (session_id, time.time())).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'user_id': row[1],
+            'questions': _unpack(row[2]),
+            'meta': json.loads(row[3]) if row[3] else None,
+            'started_at': row[4],
+            'expires_at': row[5],
+        }
+
+    def complete(self, session_id, answers, score, total_questions):
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("""
+                    SELECT user_id, questions, started_at
+                    FROM quiz_sessions
+                    WHERE id = ? AND expires_at >= ?
+                """, (session_id, time.time())).fetchone()
+                if not row:
+                    return False
+                conn.execute("""
+                    INSERT INTO quiz_results (session_id, user_id, score, total_questions,
+                                              answers, questions, started_at, completed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (session_id, row[0], score, total_questions, _pack(answers),
+                      row[1], row[2], time.time()))
+                conn.execute("DELETE FROM quiz_sessions WHERE id = ?", (session_id,))
+            return True
+        finally:
+            conn.close()
+
+    def evict_expired(self):
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute("DELETE FROM quiz_sessions WHERE expires_at < ?", (time.time(),))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def prune_results(self):
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute("DELETE FROM quiz_results WHERE completed_at < ?",
+                                      (time.time() - self.result_ttl,))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _maybe_sweep(self, now):
+        # Sweep on writes, but not more than once per interval per process
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.evict_expired()
+            self.prune_results()
+
+def create_quiz_store(config):
+    """Build the quiz store described by an app config.
+
+    QUIZ_STORE_BACKEND selects 'sqlite' (default) or 'memory';
+    QUIZ_STORE_PATH, QUIZ_SESSION_TTL and QUIZ_RESULT_TTL tune the backend.
+    """
+    ttl = config.get('QUIZ_SESSION_TTL', DEFAULT_TTL)
+    result_ttl = config.get('QUIZ_RESULT_TTL', DEFAULT_RESULT_TTL)
+    if config.get('QUIZ_STORE_BACKEND', 'sqlite') == 'memory':
+        return MemoryQuizStore(ttl=ttl, result_ttl=result_ttl)
+    return SQLiteQuizStore(config.get('QUIZ_STORE_PATH', database_path('quizzes')),
+                           ttl=ttl, result_ttl=result_ttl)
+
+def init_app(app):
+    """Give the app its own quiz store, configured from app.config"""
+    app.extensions['quiz_store'] = create_quiz_store(app.config)
+
+def get_quiz_store(app=None):
+    """Return the quiz store of the given app, or of the current one"""
+    return (app or current_app).extensions['quiz_store']
@@ -0,0 +1,181 @@
+from datetime import date, timedelta
+
+# Grades a card can be given, SM-2 style: below PASSING_GRADE is a lapse
+GRADES = {'again': 1, 'hard': 3, 'good': 4, 'easy': 5}
+PASSING_GRADE = 3
+
+# SM-2 defaults: starting and minimum ease, and the first two intervals in days
+INITIAL_EASE = 2.5
+MINIMUM_EASE = 1.3
+FIRST_INTERVALS = (1, 6)
+
+# Cards per session, and how many never-seen terms a user starts per day
+SESSION_SIZE = 20
+NEW_CARDS_PER_DAY = 20
+
+# Grades accepted in one request: a session never serves more cards
+MAX_GRADES = SESSION_SIZE
+
+# Due cards come from the (user_id, due_date) index: (user_id, today, limit)
+DUE_CARDS_SQL = """
+    SELECT e.id, e.word_phrase, e.definition, e.example, e.unit_number, r.due_date, r.repetitions
+    FROM review_state r
+    JOIN entries e ON e.id = r.entry_id
+    WHERE r.user_id = ? AND r.due_date <= ?
+    ORDER BY r.due_date
+    LIMIT ?
+"""
+# New cards follow the watermark in id order: (last_new, limit)
+NEW_CARDS_SQL = """
+    SELECT id, word_phrase, definition, example, unit_number, NULL, 0
+    FROM entries
+    WHERE id > ?
+    ORDER BY id
+    LIMIT ?
+"""
+NEW_CARD_IDS_SQL = "SELECT id FROM entries WHERE id > ? ORDER BY id LIMIT ?"
+DUE_COUNT_SQL = "SELECT COUNT(*) FROM review_state WHERE user_id = ? AND due_date <= ?"
+
+def card_states_sql(count):
+    """States of count graded cards that are due: (user_id, *entry_ids, today)"""
+    return f"""
+        SELECT entry_id, ease, interval, repetitions, lapses
+        FROM review_state
+        WHERE user_id = ? AND entry_id IN ({','.join('?' * count)}) AND due_date <= ?
+    """
+
+def schedule(state, grade, today):
+    """Apply one SM-2 review to a card state; return the new state.
+
+    state is (ease, interval, repetitions, lapses), or None for a new card.
+    The result adds the due date (ISO) and the grade.
+    """
+    ease, interval, repetitions, lapses = state or (INITIAL_EASE, 0, 0, 0)
+    if grade < PASSING_GRADE:
+        repetitions = 0
+        interval = FIRST_INTERVALS[0]
+        lapses += 1
+    else:
+        if repetitions < len(FIRST_INTERVALS):
+            interval = FIRST_INTERVALS[repetitions]
+        else:
+            interval = max(interval + 1, round(interval * ease))
+        repetitions += 1
+    ease = max(MINIMUM_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    return {
+        'ease': round(ease, 4),
+        'interval': interval,
+        'repetitions': repetitions,
+        'lapses': lapses,
+        'due_date': (today + timedelta(days=interval)).isoformat(),
+        'grade': grade,
+    }
+
+def _progress(conn, user_id, today):
+    """Return (last new entry id started, new cards started today) for a user"""
+    row = conn.execute("""
+        SELECT last_new_entry_id, new_day, new_count FROM review_progress WHERE user_id = ?
+    """, (user_id,)).fetchone()
+    if row is None:
+        return 0, 0
+    return row[0], row[2] if row[1] == today else 0
+
+def next_cards(conn, user_id, today=None, limit=SESSION_SIZE):
+    """Return the cards for a review session: due cards first, then new ones.
+
+    Due cards come from the (user_id, due_date) index and new cards from
+    a per-user watermark over entry ids, so neither query grows with the
+    dictionary. Each card is a dict with is_new set for unseen terms.
+    """
+    today = (today or date.today()).isoformat()
+    columns = ('id', 'word_phrase', 'definition', 'example', 'unit_number', 'due_date', 'repetitions')
+    cards = [dict(zip(columns, row), is_new=False)
+             for row in conn.execute(DUE_CARDS_SQL, (user_id, today, limit))]
+
+    last_new, started_today = _progress(conn, user_id, today)
+    new_limit = min(limit - len(cards), NEW_CARDS_PER_DAY - started_today)
+    if new_limit > 0:
+        cards.extend(dict(zip(columns, row), due_date=None, repetitions=0, is_new=True)
+                     for row in conn.execute(NEW_CARDS_SQL, (last_new, new_limit)))
+    return cards
+
+def _new_card_window(conn, user_id, today):
+    """Ids of the new cards next_cards can serve a user today, in order"""
+    last_new, started_today = _progress(conn, user_id, today)
+    limit = min(SESSION_SIZE, NEW_CARDS_PER_DAY - started_today)
+    if limit <= 0:
+        return last_new, started_today, []
+    return last_new, started_today, [row[0] for row in conn.execute(NEW_CARD_IDS_SQL, (last_new, limit))]
+
+def grade_cards(conn, user_id, grades, today=None):
+    """Record a whole session's grades ({entry_id: grade}) in one transaction.
+
+    conn must be in autocommit mode (isolation_level=None). Only cards
+    next_cards could have served are graded: the user's due cards, and new
+    cards from the day's window after the watermark (worked out again
+    here, not taken from the client). Other ids are ignored, and more than
+    MAX_GRADES raise ValueError. Current states are read with one query
+    and written back with one executemany, so the cost depends on the
+    session, not on the dictionary. New cards skipped during the session
+    are queued for today rather than lost, and count towards the day's
+    new cards. Returns the new states by entry id.
+    """
+    today = today or date.today()
+    today_iso = today.isoformat()
+    if len(grades) > MAX_GRADES:
+        raise ValueError(f"At most {MAX_GRADES} grades can be recorded at once")
+    grades = {int(entry_id): int(grade) for entry_id, grade in grades.items()}
+    if not grades:
+        return {}
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        states = {row[0]: row[1:] for row in conn.execute(card_states_sql(len(grades)),
+                                                           [user_id, *grades, today_iso])}
+        last_new, started_today, window = _new_card_window(conn, user_id, today_iso)
+        # A card due today was served as a due card even if it is in the window
+        new_cards = [entry_id for entry_id in window if entry_id in grades and entry_id not in states]
+
+        updated = {entry_id: schedule(states.get(entry_id), grades[entry_id], today)
+                   for entry_id in list(states) + new_cards}
+        conn.executemany("""
+            INSERT INTO review_state
+                (user_id, entry_id, ease, interval, repetitions, lapses, due_date, last_grade, last_reviewed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id, entry_id) DO UPDATE SET
+                ease = excluded.ease,
+                interval = excluded.interval,
+                repetitions = excluded.repetitions,
+                lapses = excluded.lapses,
+                due_date = excluded.due_date,
+                last_grade = excluded.last_grade,
+                last_reviewed = excluded.last_reviewed
+        """, [(user_id, entry_id, state['ease'], state['interval'], state['repetitions'],
+               state['lapses'], state['due_date'], state['grade'])
+              for entry_id, state in updated.items()])
+
+        # Move the new-card watermark past the last new card graded; window
+        # cards before it that were skipped are queued for today
+        if new_cards:
+            consumed = window[:window.index(new_cards[-1]) + 1]
+            conn.executemany("""
+                INSERT OR IGNORE INTO review_state (user_id, entry_id, due_date) VALUES (?, ?, ?)
+            """, [(user_id, entry_id, today_iso) for entry_id in consumed if entry_id not in updated])
+            conn.execute("""
+                INSERT OR REPLACE INTO review_progress (user_id, last_new_entry_id, new_day, new_count)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, consumed[-1], today_iso, started_today + len(consumed)))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return updated
+
+def review_summary(conn, user_id, today=None):
+    """Counts of cards due now and started so far, for the review page"""
+    today = (today or date.today()).isoformat()
+    due = conn.execute(DUE_COUNT_SQL, (user_id, today)).fetchone()[0]
+    started = conn.execute("""
+        SELECT COUNT(*) FROM review_state WHERE user_id = ?
+    """, (user_id,)).fetchone()[0]
+    return {'due': due, 'started': started}
@@ -0,0 +1,236 @@
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+import storage
+
+# Defaults, each overridable from the environment or the command line.
+# SQLite allows one writer at a time, so a few processes with several
+# threads each beat many single-threaded processes; threads also cover
+# requests that wait on the OpenAI API.
+HOST = os.getenv('SERVE_HOST', '127.0.0.1')
+PORT = int(os.getenv('SERVE_PORT', 8000))
+WORKERS = int(os.getenv('WEB_WORKERS', min(2 * (os.cpu_count() or 1) + 1, 8)))
+THREADS = int(os.getenv('WEB_THREADS', 8))
+KEEP_ALIVE = int(os.getenv('WEB_KEEP_ALIVE', 5))
+GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+TIMEOUT = int(os.getenv('WEB_TIMEOUT', 120))
+MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 0))
+BACKLOG = 2048
+
+def load_app(preload=False):
+    from app import create_app
+    app = create_app()
+    if preload:
+        # The OpenAI library is otherwise imported on a worker's first AI
+        # request; importing it before forking lets the workers share it
+        import openai  # noqa: F401
+    return app
+
+def post_fork():
+    """Per-worker setup: connections opened before the fork must not be shared"""
+    storage.reset()
+
+# gunicorn (pre-fork with a thread pool per worker), used when installed
+
+def run_gunicorn(options):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': f"{options.host}:{options.port}",
+                'workers': options.workers,
+                'worker_class': 'gthread',
+                'threads': options.threads,
+                'keepalive': options.keep_alive,
+                'graceful_timeout': options.graceful_timeout,
+                'timeout': options.timeout,
+                'max_requests': options.max_requests,
+                'max_requests_jitter': options.max_requests // 10,
+                'backlog': BACKLOG,
+                'preload_app': options.preload,
+                'accesslog': '-' if options.access_log else None,
+                'post_fork': lambda server, worker: post_fork(),
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(preload=options.preload)
+
+    # SIGHUP reloads workers gracefully, SIGTERM stops them gracefully
+    Server().run()
+
+# Built-in pre-fork server: worker processes share one listening socket and
+# each serves a bounded number of threads with Werkzeug
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        # A line per request is left to a proxy in front unless asked for;
+        # errors are logged either way
+        if self.access_log:
+            super().log_request(code, size)
+
+class PoolServer(ThreadedWSGIServer):
+    """Werkzeug's threaded server capped at a number of concurrent connections.
+
+    When every thread is busy the worker stops accepting, so new
+    connections wait in the shared backlog for a worker with room.
+    """
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, *args, threads, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+def _serve_worker(app, sock, options):
+    post_fork()
+    KeepAliveHandler.timeout = options.keep_alive
+    KeepAliveHandler.access_log = options.access_log
+    server = PoolServer(options.host, options.port, app, handler=KeepAliveHandler,
+                        fd=sock.fileno(), threads=options.threads)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so it cannot run in this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    server.serve_forever()
+    # Waits for requests in progress to finish
+    server.server_close()
+    os._exit(0)
+
+def _spawn(app, sock, options):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _serve_worker(load_app() if app is None else app, sock, options)
+        except BaseException:
+            traceback.print_exc()
+        os._exit(1)
+    return pid
+
+def _stop_workers(pids, timeout):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    while pids and time.monotonic() < deadline:
+        for pid in list(pids):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                pids.discard(pid)
+        time.sleep(0.1)
+    for pid in pids:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+def run_builtin(options):
+    if options.max_requests:
+        print("--max-requests needs gunicorn; ignored", file=sys.stderr)
+    # Loading before forking shares the app's memory between workers and
+    # makes a broken app fail here rather than in every worker
+    app = load_app(preload=True) if options.preload else None
+
+    sock = socket.create_server((options.host, options.port), backlog=BACKLOG)
+    sock.set_inheritable(True)
+    print(f"Serving on http://{options.host}:{options.port} "
+          f"with {options.workers} worker(s) x {options.threads} thread(s)", flush=True)
+
+    signals = []
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: signals.append(signum))
+    workers = {_spawn(app, sock, options) for _ in range(options.workers)}
+
+    while True:
+        if signals:
+            signum = signals.pop(0)
+            old = workers
+            if signum == signal.SIGHUP:
+                # Graceful restart: new workers start taking connections, then
+                # the old ones finish what they are serving and exit
+                print("Restarting workers", flush=True)
+                app = load_app(preload=True) if options.preload else None
+                workers = {_spawn(app, sock, options) for _ in range(options.workers)}
+                _stop_workers(old, options.graceful_timeout)
+                continue
+            print("Shutting down", flush=True)
+            _stop_workers(old, options.graceful_timeout)
+            sock.close()
+            return
+        # Replace workers that died
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in workers:
+            workers.discard(pid)
+            workers.add(_spawn(app, sock, options))
+        time.sleep(0.2)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the app with a multi-process production server')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help=f'Worker processes (default: {WORKERS})')
+    parser.add_argument('-t', '--threads', type=int, default=THREADS,
+                        help=f'Concurrent requests per worker (default: {THREADS})')
+    parser.add_argument('--keep-alive', type=int, default=KEEP_ALIVE,
+                        help=f'Seconds an idle connection stays open (default: {KEEP_ALIVE})')
+    parser.add_argument('--graceful-timeout', type=int, default=GRACEFUL_TIMEOUT,
+                        help=f'Seconds workers get to finish requests on restart or stop (default: {GRACEFUL_TIMEOUT})')
+    parser.add_argument('--timeout', type=int, default=TIMEOUT,
+                        help=f'Seconds before a silent worker is restarted, gunicorn only (default: {TIMEOUT})')
+    parser.add_argument('--max-requests', type=int, default=MAX_REQUESTS,
+                        help='Restart a worker after this many requests, gunicorn only (default: never)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='Load the app in each worker instead of once before forking, '
+                             'so a restart (SIGHUP) picks up code changes')
+    parser.add_argument('--access-log', action='store_true', help='Log every request')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'builtin'), default='auto',
+                        help='gunicorn if installed (auto), or the built-in pre-fork server')
+    options = parser.parse_args()
+
+    server = options.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn'
+        except ImportError:
+            server = 'builtin'
+    if server == 'gunicorn':
+        run_gunicorn(options)
+    else:
+        run_builtin(options)
+
+if __name__ == '__main__':
+    main()
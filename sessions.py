@@ -0,0 +1,56 @@
+import os
+import secrets
+from datetime import timedelta
+
+from storage import DATA_DIR
+
+# File holding the generated signing key when SECRET_KEY is not set
+SECRET_KEY_FILE = os.path.join(DATA_DIR, 'secret_key')
+
+# How long a login lasts without visiting the site
+SESSION_LIFETIME = timedelta(days=31)
+
+def load_secret_key(path=SECRET_KEY_FILE):
+    """Return the session signing key: SECRET_KEY from the environment, or
+    one generated once and kept in path so restarts and every worker agree.
+    """
+    key = os.getenv('SECRET_KEY')
+    if key:
+        return key
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    # Write to a private temporary file, then link it into place: linking
+    # fails if another worker got there first, and then its key is used
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(secrets.token_hex(32))
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+    with open(path) as f:
+        return f.read().strip()
+
+def init_app(app):
+    """Keep sessions in signed cookies with a stable key.
+
+    The few values stored (user id and name, current quiz and tutor ids,
+    flashed messages) fit easily in a cookie, so sessions need no storage
+    on the server and any worker process can read any session.
+    Old keys listed in SECRET_KEY_FALLBACKS (comma-separated) still verify
+    existing cookies after the key is rotated.
+    """
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = load_secret_key()
+    fallbacks = os.getenv('SECRET_KEY_FALLBACKS')
+    if fallbacks:
+        app.config['SECRET_KEY_FALLBACKS'] = [key for key in fallbacks.split(',') if key]
+    app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_LIFETIME
+    app.config['SESSION_COOKIE_HTTPONLY'] = True
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
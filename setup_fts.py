@@ -1,70 +1,80 @@
-import sqlite3
+from storage import connect_db
+
+# Columns indexed for full-text search, per content table
+DICTIONARY_FTS_COLUMNS = ('word_phrase', 'definition', 'example')
+NOTES_FTS_COLUMNS = ('title', 'content', 'tags')
+
+def create_fts(conn, fts_table, content_table, columns):
+    """Create an external-content FTS5 index over a table and keep it in sync.
+
+    Triggers mirror every insert, update and delete on the content table,
+    so the index never goes stale. An index that is new (or empty) is
+    rebuilt from the table. Safe to run repeatedly, inside a transaction.
+    """
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f"new.{column}" for column in columns)
+    old_values = ', '.join(f"old.{column}" for column in columns)
 
-def setup_dictionary_fts():
-    """Set up FTS for the dictionary database"""
-    conn = sqlite3.connect('dictionary.db')
-    cursor = conn.cursor()
-    
     # Create FTS virtual table if it doesn't exist
-    cursor.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts 
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table}
         USING fts5(
-            word_phrase, 
-            definition, 
-            example, 
-            content='entries', 
+            {column_list},
+            content='{content_table}',
             content_rowid='id',
             tokenize='porter unicode61'
         )
     """)
-    
+
+    # Keep the index in step with the table
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {content_table} BEGIN
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {content_table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {content_table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END
+    """)
+
     # Check if the FTS table is empty
-    cursor.execute("SELECT COUNT(*) FROM entries_fts")
-    if cursor.fetchone()[0] == 0:
-        # Populate the FTS table with existing data
-        cursor.execute("""
-            INSERT INTO entries_fts (rowid, word_phrase, definition, example)
-            SELECT id, word_phrase, definition, example FROM entries
-        """)
-    
-    conn.commit()
-    conn.close()
+    if conn.execute(f"SELECT COUNT(*) FROM {fts_table}_docsize").fetchone()[0] == 0:
+        rebuild_fts(conn, fts_table)
+
+def rebuild_fts(conn, fts_table):
+    """Rebuild an external-content FTS index from its content table"""
+    conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+def setup_dictionary_fts():
+    """Set up FTS for the dictionary database"""
+    conn = connect_db('dictionary')
+    try:
+        create_fts(conn, 'entries_fts', 'entries', DICTIONARY_FTS_COLUMNS)
+        conn.commit()
+    finally:
+        conn.close()
 
 def setup_notes_fts():
     """Set up FTS for the notes database"""
-    conn = sqlite3.connect('notes.db')
-    cursor = conn.cursor()
-    
-    # Create FTS virtual table if it doesn't exist
-    cursor.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts 
-        USING fts5(
-            title, 
-            content, 
-            tags,
-            content='notes', 
-            content_rowid='id',
-            tokenize='porter unicode61'
-        )
-    """)
-    
-    # Check if the FTS table is empty
-    cursor.execute("SELECT COUNT(*) FROM notes_fts")
-    if cursor.fetchone()[0] == 0:
-        # Populate the FTS table with existing data
-        cursor.execute("""
-            INSERT INTO notes_fts (rowid, title, content, tags)
-            SELECT id, title, content, tags FROM notes
-        """)
-    
-    conn.commit()
-    conn.close()
+    conn = connect_db('notes')
+    try:
+        create_fts(conn, 'notes_fts', 'notes', NOTES_FTS_COLUMNS)
+        conn.commit()
+    finally:
+        conn.close()
 
 if __name__ == '__main__':
     print("Setting up full-text search for dictionary...")
     setup_dictionary_fts()
-    
+
     print("Setting up full-text search for notes...")
     setup_notes_fts()
-    
+
     print("Full-text search setup complete!")
@@ -0,0 +1,16 @@
+// Worksheet thumbnails answer 503 while a preview is still being made, and
+// 404 when none can be; retry a few times, then show the fallback icon
+const THUMBNAIL_RETRIES = 3;
+
+function retryThumbnail(img, fallback) {
+    const attempts = Number(img.dataset.attempts || 0);
+    if (attempts >= THUMBNAIL_RETRIES) {
+        img.replaceWith(fallback);
+        return;
+    }
+    img.dataset.attempts = attempts + 1;
+    // A new query string makes the browser request the thumbnail again
+    setTimeout(function() {
+        img.src = img.src.split('?')[0] + '?attempt=' + (attempts + 1);
+    }, 1000 * (attempts + 1));
+}
@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+
+# Directory holding the database files; defaults to the project root
+DATA_DIR = os.getenv('DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
+
+# Every database the app uses, by schema name
+DATABASES = {
+    'notes': 'notes.db',
+    'dictionary': 'dictionary.db',
+    'calendar': 'calendar.db',
+    'users': 'users.db',
+    'quizzes': 'quizzes.db',
+}
+
+# Databases attached to the per-request connection, after notes (the main schema)
+ATTACHED = ('dictionary', 'calendar', 'users')
+
+# How long a connection waits for a lock before failing, in seconds
+BUSY_TIMEOUT = 10
+
+# Applied to every connection (per schema where SQLite scopes them that way)
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}",
+    "PRAGMA temp_store=MEMORY",
+)
+SCHEMA_PRAGMAS = (
+    "PRAGMA {schema}.synchronous=NORMAL",
+)
+
+def database_path(name):
+    """Absolute path of a database file"""
+    return os.path.join(DATA_DIR, DATABASES[name])
+
+def database_url(name):
+    """URL of a database for the SQL class"""
+    return f"sqlite:///{database_path(name)}"
+
+def _configure(conn, schemas=('main',)):
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    for schema in schemas:
+        for pragma in SCHEMA_PRAGMAS:
+            conn.execute(pragma.format(schema=schema))
+
+def connect_db(name, readonly=False, **kwargs):
+    """Open a configured sqlite3 connection to one database.
+
+    Extra keyword arguments (isolation_level, ...) go to sqlite3.connect.
+    Read-only connections never take write locks, so they cannot block writers.
+    """
+    kwargs.setdefault('timeout', BUSY_TIMEOUT)
+    if readonly:
+        conn = sqlite3.connect(f"file:{database_path(name)}?mode=ro", uri=True, **kwargs)
+        conn.execute("PRAGMA query_only=ON")
+    else:
+        conn = sqlite3.connect(database_path(name), **kwargs)
+    _configure(conn)
+    return conn
+
+def enable_wal(name):
+    """Switch a database to write-ahead logging so readers and a writer run concurrently.
+
+    The journal mode is stored in the file, so this only has to happen once.
+    """
+    if not os.path.exists(database_path(name)):
+        return None
+    conn = sqlite3.connect(database_path(name), timeout=BUSY_TIMEOUT)
+    try:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    finally:
+        conn.close()
+
+def get_schema_version(conn, schema='main'):
+    return conn.execute(f"PRAGMA {schema}.user_version").fetchone()[0]
+
+def set_schema_version(conn, version, schema='main'):
+    conn.execute(f"PRAGMA {schema}.user_version={int(version)}")
+
+# SQL wrappers are cached per process: each one owns an engine and keeps a
+# connection per thread, so creating one per query wastes both
+_sql = {}
+_sql_lock = threading.Lock()
+_sql_pid = None
+
+def get_sql(name):
+    """Return the process-wide SQL wrapper for a database"""
+    global _sql_pid
+    with _sql_lock:
+        if _sql_pid != os.getpid():
+            # Connections must not be shared with a parent process
+            _sql.clear()
+            _sql_pid = os.getpid()
+        db = _sql.get(name)
+        if db is None:
+            from sql import SQL
+            db = SQL(database_url(name), connect_args={'timeout': BUSY_TIMEOUT})
+            _sql[name] = db
+        return db
+
+def reset():
+    """Forget cached connections, e.g. in a freshly forked worker"""
+    global _sql_pid
+    with _sql_lock:
+        _sql.clear()
+        _sql_pid = None
+
+def open_request_connection():
+    """Open one connection with notes as the main schema and the other databases attached.
+
+    Tables keep their unqualified names (entries, calendar_entries, users)
+    because no two databases share a table name; schema.table works too.
+    Rows are sqlite3.Row objects.
+    """
+    conn = sqlite3.connect(database_path('notes'), timeout=BUSY_TIMEOUT)
+    schemas = ['main']
+    for name in ATTACHED:
+        path = database_path(name)
+        # ATTACH would create a missing file; leave it unattached instead
+        if os.path.exists(path):
+            conn.execute("ATTACH DATABASE ? AS " + name, (path,))
+            schemas.append(name)
+    _configure(conn, schemas)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def get_db():
+    """Return this request's shared multi-database connection"""
+    from flask import g
+    if 'storage_db' not in g:
+        g.storage_db = open_request_connection()
+    return g.storage_db
+
+def close_db(exception=None):
+    from flask import g
+    conn = g.pop('storage_db', None)
+    if conn is not None:
+        conn.close()
+
+def init_app(app):
+    """Close request connections on teardown and make sure every database uses WAL"""
+    app.teardown_appcontext(close_db)
+    for name in DATABASES:
+        enable_wal(name)
@@ -0,0 +1,324 @@
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+
+from calendar_recurrence import next_occurrence, series_occurrences
+from storage import connect_db, database_path
+
+# Calendar entries whose title or description matches are treated as exams
+EXAM_PATTERN = re.compile(r'\b(exams?|tests?|quiz(?:zes)?|midterms?|finals?|assessments?)\b', re.IGNORECASE)
+
+# "Unit 3", "units 3, 4 and 6", "units 2-4"
+UNITS_PATTERN = re.compile(r'\bunits?\s*#?\s*(\d+(?:\s*(?:,|&|and|to|-|–)\s*\d+)*)', re.IGNORECASE)
+UNIT_RANGE = re.compile(r'(\d+)(?:\s*(?:-|–|to)\s*(\d+))?')
+MAX_UNITS_PER_EXAM = 20
+
+# Days before an exam on which each kind of review falls due: expanding
+# gaps, so material is revisited just as it starts to be forgotten
+REVIEW_OFFSETS = {
+    'terms': (14, 7, 3, 1),
+    'notes': (10, 2),
+}
+TASK_TITLES = {
+    'terms': 'Review unit {unit} terms',
+    'notes': 'Reread unit {unit} notes',
+}
+
+# Calendar entries handled per transaction
+BATCH_SIZE = 200
+
+# Pause between batches so requests get a turn at the write lock
+BATCH_PAUSE = 0.05
+
+# Seconds between catch-up runs when nobody has changed the calendar
+SCHEDULE_INTERVAL = 10 * 60
+
+# Occurrences of a series are scheduled once they are this many days away,
+# early enough for the first review
+LOOKAHEAD_DAYS = max(max(offsets) for offsets in REVIEW_OFFSETS.values())
+
+WATERMARK = 'calendar_entries'
+SERIES_WATERMARK = 'calendar_recurrences'
+
+# Entries written since the watermark, in commit order: (change_seq, limit)
+CHANGED_ENTRIES_SQL = """
+    SELECT id, user_id, entry_date, title, description, change_seq
+    FROM calendar_entries
+    WHERE change_seq > ?
+    ORDER BY change_seq
+    LIMIT ?
+"""
+# The same for series and their exceptions: (change_seq, limit)
+CHANGED_SERIES_SQL = """
+    SELECT id, user_id, dtstart, rrule, until, title, description, change_seq
+    FROM calendar_recurrences
+    WHERE change_seq > ?
+    ORDER BY change_seq
+    LIMIT ?
+"""
+# Exam series with an occurrence entering the look-ahead window: (today, limit)
+DUE_SERIES_SQL = """
+    SELECT id, user_id, dtstart, rrule, until, title, description, next_schedule_date
+    FROM calendar_recurrences
+    WHERE next_schedule_date <= ?
+    ORDER BY next_schedule_date
+    LIMIT ?
+"""
+SERIES_OVERRIDES_SQL = """
+    SELECT entry_date, title, description
+    FROM calendar_recurrence_exceptions
+    WHERE recurrence_id = ? AND cancelled = 0
+"""
+
+# Both read the partial index of pending tasks
+DUE_TASKS_SQL = """
+    SELECT id, unit_number, kind, due_date, exam_date, title
+    FROM study_tasks
+    WHERE user_id = ? AND status = 'pending' AND due_date <= ?
+    ORDER BY due_date
+    LIMIT ?
+"""
+UPCOMING_TASKS_SQL = """
+    SELECT id, unit_number, kind, due_date, exam_date, title
+    FROM study_tasks
+    WHERE user_id = ? AND status = 'pending' AND due_date > ? AND due_date <= ?
+    ORDER BY due_date
+    LIMIT ?
+"""
+
+logger = logging.getLogger(__name__)
+
+def exam_units(title, description=None):
+    """Return the unit numbers an exam entry covers, or [] if it is not an exam"""
+    text = f"{title or ''}\n{description or ''}"
+    if not EXAM_PATTERN.search(text):
+        return []
+    units = []
+    for match in UNITS_PATTERN.finditer(text):
+        for first, last in UNIT_RANGE.findall(match.group(1)):
+            first = int(first)
+            last = int(last) if last else first
+            units.extend(range(first, min(last, first + MAX_UNITS_PER_EXAM - 1) + 1))
+    return sorted(set(units))[:MAX_UNITS_PER_EXAM]
+
+def plan_tasks(exam_date, units, today):
+    """Return (unit, kind, due_date) for the reviews leading up to an exam.
+
+    Reviews that would already be overdue are dropped; if that leaves a
+    kind with none, one review of it falls due today.
+    """
+    if exam_date < today:
+        return []
+    tasks = []
+    for unit in units:
+        for kind, offsets in REVIEW_OFFSETS.items():
+            due_dates = [exam_date - timedelta(days=offset) for offset in offsets]
+            due_dates = [due for due in due_dates if due >= today] or [today]
+            tasks.extend((unit, kind, due) for due in due_dates)
+    return tasks
+
+def schedule_entry(cursor, entry, today):
+    """Replace the pending study tasks generated from one calendar entry.
+
+    Finished tasks are kept, and are not generated again.
+    """
+    entry_id, user_id, entry_date, title, description = entry
+    cursor.execute("DELETE FROM study_tasks WHERE source_entry_id = ? AND status = 'pending'", (entry_id,))
+    try:
+        exam_date = date.fromisoformat(entry_date[:10])
+    except (TypeError, ValueError):
+        return 0
+    tasks = plan_tasks(exam_date, exam_units(title, description), today)
+    cursor.executemany("""
+        INSERT OR IGNORE INTO study_tasks
+            (user_id, source_entry_id, unit_number, kind, due_date, exam_date, title)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(user_id, entry_id, unit, kind, due.isoformat(), exam_date.isoformat(),
+           TASK_TITLES[kind].format(unit=unit)) for unit, kind, due in tasks])
+    return len(tasks)
+
+def _next_schedule_date(conn, series, horizon):
+    """The day the first occurrence on or after horizon needs scheduling, or None.
+
+    None when neither the series nor any override of it looks like an
+    exam, so ordinary repeating entries cost nothing after their first run.
+    """
+    overrides = conn.execute(SERIES_OVERRIDES_SQL, (series['id'],)).fetchall()
+    if not exam_units(series['title'], series['description']) and not any(
+            exam_units(title or series['title'], description or series['description'])
+            for _, title, description in overrides):
+        return None
+    candidates = [date.fromisoformat(entry_date) for entry_date, _, _ in overrides
+                  if entry_date and entry_date >= horizon.isoformat()]
+    following = next_occurrence(series, horizon)
+    if following:
+        candidates.append(following)
+    if not candidates:
+        return None
+    return (min(candidates) - timedelta(days=LOOKAHEAD_DAYS)).isoformat()
+
+def schedule_series(conn, row, today, start=None):
+    """Schedule study tasks for a series' occurrences up to LOOKAHEAD_DAYS ahead.
+
+    Without start the series has changed: its pending tasks are replaced
+    from today on. With start (a date) only occurrences from there on are
+    added, as they enter the window. Returns the number of tasks planned.
+    """
+    series_id, user_id = row[0], row[1]
+    series = dict(zip(('id', 'dtstart', 'rrule', 'until', 'title', 'description'), (series_id, *row[2:7])))
+    if start is None:
+        conn.execute("DELETE FROM study_tasks WHERE source_series_id = ? AND status = 'pending'", (series_id,))
+        start = today
+    horizon = today + timedelta(days=LOOKAHEAD_DAYS + 1)
+    try:
+        occurrences = series_occurrences(conn, series, max(start, today).isoformat(), horizon.isoformat())
+        next_date = _next_schedule_date(conn, series, horizon)
+    except ValueError:
+        # A series stored before its rule was checked
+        return 0
+    rows = []
+    for occurrence in occurrences:
+        exam_date = date.fromisoformat(occurrence['entry_date'])
+        for unit, kind, due in plan_tasks(exam_date, exam_units(occurrence['title'], occurrence['description']), today):
+            rows.append((user_id, series_id, unit, kind, due.isoformat(), exam_date.isoformat(),
+                         TASK_TITLES[kind].format(unit=unit)))
+    conn.executemany("""
+        INSERT OR IGNORE INTO study_tasks
+            (user_id, source_series_id, unit_number, kind, due_date, exam_date, title)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    # next_schedule_date is not one of the columns that bump change_seq
+    conn.execute("UPDATE calendar_recurrences SET next_schedule_date = ? WHERE id = ?", (next_date, series_id))
+    return len(rows)
+
+def _watermark(conn, name):
+    mark = conn.execute("SELECT change_seq FROM study_scheduler_state WHERE name = ?", (name,)).fetchone()
+    return mark[0] if mark else 0
+
+def _set_watermark(conn, name, change_seq):
+    conn.execute("""
+        INSERT OR REPLACE INTO study_scheduler_state (name, change_seq)
+        VALUES (?, ?)
+    """, (name, change_seq))
+
+def materialize(conn, batch_size=BATCH_SIZE, today=None):
+    """Schedule the next batch of calendar entries and series changed since the watermarks.
+
+    Also adds tasks for exam series whose next occurrence has come within
+    LOOKAHEAD_DAYS. conn must be in autocommit mode (isolation_level=None).
+    The batch and the watermarks move forward in one transaction, so
+    concurrent workers never handle a change twice. Returns the number of
+    entries and series handled.
+    """
+    today = today or date.today()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(CHANGED_ENTRIES_SQL, (_watermark(conn, WATERMARK), batch_size)).fetchall()
+        cursor = conn.cursor()
+        for row in rows:
+            schedule_entry(cursor, row[:5], today)
+        if rows:
+            _set_watermark(conn, WATERMARK, rows[-1][5])
+
+        changed = conn.execute(CHANGED_SERIES_SQL, (_watermark(conn, SERIES_WATERMARK), batch_size)).fetchall()
+        for row in changed:
+            schedule_series(conn, row, today)
+        if changed:
+            _set_watermark(conn, SERIES_WATERMARK, changed[-1][7])
+
+        # Rescheduled series above have moved their next_schedule_date past today
+        reached = conn.execute(DUE_SERIES_SQL, (today.isoformat(), batch_size)).fetchall()
+        for row in reached:
+            schedule_series(conn, row, today,
+                            start=date.fromisoformat(row[7]) + timedelta(days=LOOKAHEAD_DAYS))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(rows) + len(changed) + len(reached)
+
+def due_tasks(conn, user_id, today, limit=50):
+    """Pending tasks due on or before today, oldest first"""
+    return conn.execute(DUE_TASKS_SQL, (user_id, today, limit)).fetchall()
+
+def upcoming_tasks(conn, user_id, today, days=7, limit=50):
+    """Pending tasks due in the next few days"""
+    last = (date.fromisoformat(today) + timedelta(days=days)).isoformat()
+    return conn.execute(UPCOMING_TASKS_SQL, (user_id, today, last, limit)).fetchall()
+
+def finish_task(cursor, user_id, task_id, status='done'):
+    """Mark a task done (or dismissed); returns whether it was pending"""
+    cursor.execute("""
+        UPDATE study_tasks SET status = ?, completed_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND user_id = ? AND status = 'pending'
+    """, (status, task_id, user_id))
+    return cursor.rowcount > 0
+
+class StudyScheduler(object):
+    """Background thread that turns calendar changes into study tasks.
+
+    Work is driven by watermarks over the change_seq of calendar_entries
+    and calendar_recurrences, which triggers set on every write in commit
+    order (timestamps are written in two formats and can tie), so each run
+    only looks at entries and series added or edited since the last one,
+    never at all content. Series are scheduled LOOKAHEAD_DAYS ahead; the
+    periodic run also adds their occurrences as they come within reach.
+    Calendar writes call wake(); the periodic run picks up changes made by
+    other processes.
+    """
+
+    def __init__(self, interval=SCHEDULE_INTERVAL, batch_size=BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        """Ask for a run soon, starting the thread in this process if needed"""
+        with self._lock:
+            # Threads do not survive fork, so each worker process starts its own
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._wakeup = threading.Event()
+                self._thread = threading.Thread(target=self._run, name='study-scheduler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.catch_up()
+            except Exception:
+                logger.exception("Error scheduling study tasks")
+
+    def catch_up(self):
+        """Process every pending calendar change in batches; return the number handled"""
+        if not os.path.exists(database_path('calendar')):
+            return 0
+        conn = connect_db('calendar', isolation_level=None)
+        try:
+            total = 0
+            while True:
+                handled = materialize(conn, self.batch_size)
+                total += handled
+                if handled < self.batch_size:
+                    return total
+                time.sleep(BATCH_PAUSE)
+        finally:
+            conn.close()
+
+_scheduler = StudyScheduler()
+
+def get_study_scheduler():
+    """Return the process-wide study scheduler"""
+    return _scheduler
+
+if __name__ == '__main__':
+    print(f"Scheduled {_scheduler.catch_up()} calendar entry(ies) and series.")
@@ -1,57 +1,66 @@
-from flask import Blueprint, render_template, request, session, redirect, url_for, flash, jsonify, current_app
-from sql import SQL
+from flask import Blueprint, render_template, request, session, redirect, url_for, flash, jsonify, current_app, Response, stream_with_context
+from storage import get_db, connect_db
 import random
-import openai
-from openai import OpenAI
 import json
 import os
+import threading
 import time
 from datetime import datetime
 from dotenv import load_dotenv
+from ai_context import build_study_context, DEFAULT_TOKEN_BUDGET
+from quiz_store import get_quiz_store
+from quiz_engine import get_quiz_engine
+from ai_stream import stream_chat_completion, sse_headers
+from tutor_store import get_tutor_store
+from review_engine import GRADES, MAX_GRADES, next_cards, grade_cards, review_summary
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+_openai_client = None
+_openai_pid = None
+_openai_lock = threading.Lock()
+
+def get_openai_client():
+    """Return this process's OpenAI client, importing the library on first use.
+
+    openai takes most of a second to import, so loading it here rather
+    than at module level keeps app startup (and every worker's) fast.
+    """
+    global _openai_client, _openai_pid
+    with _openai_lock:
+        # The client's connection pool must not be shared with a parent process
+        if _openai_client is None or _openai_pid != os.getpid():
+            from openai import OpenAI
+            _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            _openai_pid = os.getpid()
+        return _openai_client
 
 # Initialize Blueprint
 test_bp = Blueprint('tests', __name__, url_prefix='/tests')
 
-# In-memory storage for quiz sessions (in production, use a database)
-quiz_sessions = {}
+def get_quiz_sessions():
+    """Quiz session store shared by all worker processes"""
+    return get_quiz_store()
 
-def get_user_notes(user_id):
-    """Fetch user's notes from the database"""
-    db = SQL("sqlite:///notes.db")
-    return db.execute("SELECT * FROM notes WHERE user_id = ?", [user_id])
+def get_context_budget():
+    """Token budget for study materials in AI prompts"""
+    return current_app.config.get('AI_CONTEXT_TOKEN_BUDGET', DEFAULT_TOKEN_BUDGET)
 
-def get_dictionary_terms():
-    """Fetch dictionary terms from the database"""
-    db = SQL("sqlite:///dictionary.db")
-    return db.execute("SELECT * FROM dictionary")
+def generate_ai_quiz(user_id, num_questions=10, unit_number=None):
+    """Generate a quiz using OpenAI's API based on user's notes and dictionary terms
 
-def generate_ai_quiz(user_id, num_questions=10):
-    """Generate a quiz using OpenAI's API based on user's notes and dictionary terms"""
+    Returns a (questions, error, usage) tuple, where usage describes how much
+    of the context token budget the study materials used.
+    """
+    usage = None
     try:
-        # Get user's notes and dictionary terms
-        notes = get_user_notes(user_id)
-        terms = get_dictionary_terms()
-        
-        if not notes and not terms:
-            return None, "No content available to generate quiz"
+        # Pack the most viewed notes and terms under the token budget
+        context, usage = build_study_context(unit_number=unit_number,
+                                             token_budget=get_context_budget())
         
-        # Prepare context for the AI
-        context = ""
-        if notes:
-            context += "User's notes:\n"
-            for note in notes[:10]:  # Limit to first 10 notes to avoid context window issues
-                context += f"- {note.get('title', 'Untitled')}: {note.get('content', '')[:200]}...\n"
-        
-        if terms:
-            context += "\nLegal Terms:\n"
-            for term in terms[:20]:  # Limit to first 20 terms
-                context += f"- {term.get('term', '')}: {term.get('definition', '')[:150]}...\n"
+        if not usage['notes'] and not usage['dictionary_entries']:
+            return None, "No content available to generate quiz", usage
         
         # Generate quiz using OpenAI
         prompt = f"""
@@ -78,7 +87,7 @@ def generate_ai_quiz(user_id, num_questions=10):
         }}
         """
         
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-3.5-turbo-1106",
             messages=[
                 {"role": "system", "content": "You are a helpful legal studies tutor that creates educational quizzes."},
@@ -88,6 +97,10 @@ def generate_ai_quiz(user_id, num_questions=10):
             temperature=0.7
         )
         
+        if response.usage:
+            usage['prompt_tokens'] = response.usage.prompt_tokens
+        current_app.logger.info(f"AI quiz context usage: {usage}")
+        
         # Parse the response
         quiz_data = json.loads(response.choices[0].message.content)
         
@@ -95,11 +108,11 @@ def generate_ai_quiz(user_id, num_questions=10):
         for i, question in enumerate(quiz_data['questions']):
             question['id'] = f"q_{int(time.time())}_{i}"
         
-        return quiz_data['questions'], None
+        return quiz_data['questions'], None, usage
         
     except Exception as e:
         current_app.logger.error(f"Error generating AI quiz: {str(e)}")
-        return None, str(e)
+        return None, str(e), usage
 
 def generate_definition_question(word, definition):
     """Generate a definition-based question"""
@@ -153,39 +166,12 @@ def generate_test(unit_number):
         return redirect(url_for('auth.login', next=request.url))
     
     try:
-        print(f"\n=== Starting test generation for unit {unit_number} ===")
-        print("Current user:", session.get("name"))
-        # Connect to both databases
-        dict_db = SQL("sqlite:///dictionary.db")
-        notes_db = SQL("sqlite:///notes.db")
-        
-        # Get dictionary entries for the unit
-        print("Fetching dictionary entries...")
-        dictionary_entries = dict_db.execute("""
-            SELECT id, word_phrase, definition, example, unit_number
-            FROM entries 
-            WHERE unit_number = :unit_number
-            ORDER BY RANDOM()
-            LIMIT 20  # Limit to 20 terms to keep the test manageable
-        """, unit_number=unit_number)
-        print(f"Found {len(dictionary_entries)} dictionary entries")
-        
-        # Get notes for the unit
-        print("Fetching notes...")
-        notes = notes_db.execute("""
-            SELECT id, title, content, unit_number
-            FROM notes
-            WHERE unit_number = :unit_number
-            ORDER BY RANDOM()
-            LIMIT 5  # Limit to 5 notes to keep the test focused
-        """, unit_number=unit_number)
-        print(f"Found {len(notes)} notes")
+        # Sample terms (with precomputed distractors) and notes from the unit's pool
+        dictionary_entries, notes = get_quiz_engine().sample(
+            unit_number, num_entries=20, num_notes=5, conn=get_db())
         
         # Generate test questions from dictionary entries
         test_questions = []
-        all_definitions = [entry['definition'] for entry in dictionary_entries]
-        
-        print(f"Generating questions from {len(dictionary_entries)} dictionary entries...")
         for entry in dictionary_entries:
             # Add definition question
             test_questions.append(generate_definition_question(
@@ -202,17 +188,16 @@ def generate_test(unit_number):
                 if example_q:
                     test_questions.append(example_q)
             
-            # Add multiple choice question if we have enough definitions
+            # Add multiple choice question if we have enough distractors
             mcq = generate_mcq_question(
                 entry['word_phrase'],
                 entry['definition'],
-                all_definitions
+                [entry['definition']] + entry['distractors']
             )
             if mcq:
                 test_questions.append(mcq)
         
         # Add questions from notes (simple recall questions)
-        print(f"Generating questions from {len(notes)} notes...")
         for note in notes:
             # Simple question based on note title
             test_questions.append({
@@ -228,65 +213,12 @@ def generate_test(unit_number):
         # Limit to 15 questions total
         test_questions = test_questions[:15]
         
-        print(f"\n=== DEBUG: Generated {len(test_questions)} questions ===")
-        
-        # Debug: Print all questions
-        for i, q in enumerate(test_questions):
-            print(f"Question {i+1} (Type: {q['type']}): {q['question'][:100]}...")
-            if 'options' in q and q['options']:
-                print(f"  Options: {q['options']}")
-        
-        # Use forward slashes for template path (Jinja2 uses forward slashes on all platforms)
-        template_path = 'tests/generate.html'
-        print(f"\n=== DEBUG: Attempting to render template: {template_path}")
-        
-        # Debug: Check if template exists and can be rendered
-        from flask import current_app, render_template_string
-        with current_app.app_context():
-            try:
-                # Test template rendering with a simple string
-                test_render = render_template_string('Test template rendering: {{ test_var }}', test_var='SUCCESS')
-                print(f"Template rendering test: {test_render}")
-                
-                # Try to get the actual template
-                template = current_app.jinja_env.get_or_select_template(template_path)
-                print("Template found and loaded successfully")
-                
-                # Try rendering with test data
-                test_data = [
-                    {
-                        'type': 'test',
-                        'question': 'Test question',
-                        'answer': 'Test answer',
-                        'options': []
-                    }
-                ]
-                test_output = render_template(template_path, 
-                                          test_questions=test_data,
-                                          unit_number=unit_number)
-                print(f"Test render successful. Output length: {len(test_output) if test_output else 0} characters")
-                
-            except Exception as e:
-                print(f"\n=== TEMPLATE ERROR ===")
-                print(f"Error: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                print("====================\n")
-                raise
-        
-        # Render the actual template
-        print("\n=== Rendering actual template with real data ===")
-        return render_template(template_path,
+        return render_template('tests/generate.html',
                              test_questions=test_questions,
                              unit_number=unit_number)
                              
     except Exception as e:
-        import traceback
-        error_msg = f'Error generating test: {str(e)}\n\n{traceback.format_exc()}'
-        print("\n" + "="*50)
-        print("ERROR IN TEST GENERATION:")
-        print(error_msg)
-        print("="*50 + "\n")
+        current_app.logger.exception(f"Error generating test for unit {unit_number}: {str(e)}")
         flash('Error generating test. Please check the server logs for details.', 'error')
         return redirect(url_for('dictionary.index'))
 
@@ -305,39 +237,13 @@ def start_ai_test():
     data = request.json
     unit_number = data.get('unit_number')
     
-    # Get all relevant content for context
-    dict_db = SQL("sqlite:///dictionary.db")
-    notes_db = SQL("sqlite:///notes.db")
-    
-    # Get dictionary entries
-    dictionary_entries = dict_db.execute("""
-        SELECT word_phrase, definition, example, unit_number
-        FROM entries 
-        WHERE unit_number = :unit_number
-    """, unit_number=unit_number)
-    
-    # Get notes
-    notes = notes_db.execute("""
-        SELECT title, content, unit_number
-        FROM notes
-        WHERE unit_number = :unit_number
-    """, unit_number=unit_number)
-    
-    # Format the context
-    context = ""
-    
-    if dictionary_entries:
-        context += "Dictionary Terms:\n"
-        for entry in dictionary_entries:
-            context += f"- {entry['word_phrase']}: {entry['definition']}"
-            if entry['example']:
-                context += f" (Example: {entry['example']})"
-            context += "\n"
-    
-    if notes:
-        context += "\nNotes:\n"
-        for note in notes:
-            context += f"- {note['title']}: {note['content']}\n"
+    # Pack the most relevant study materials under the token budget
+    context, usage = build_study_context(
+        unit_number=unit_number,
+        token_budget=get_context_budget(),
+        rank=data.get('rank', 'views'),
+        query=data.get('query')
+    )
     
     # Initial prompt for the AI
     system_prompt = f"""You are a helpful AI tutor helping a law student study for their unit {unit_number} test. 
@@ -356,7 +262,7 @@ def start_ai_test():
     """
     
     # Start the conversation
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4",
         messages=[
             {"role": "system", "content": system_prompt},
@@ -365,39 +271,107 @@ def start_ai_test():
         temperature=0.7
     )
     
+    if response.usage:
+        usage['prompt_tokens'] = response.usage.prompt_tokens
+    
+    greeting = response.choices[0].message.content
+    
+    # Keep the conversation on the server with the system prompt pinned,
+    # so later turns only send the student's new message
+    store = get_tutor_store(current_app.config)
+    conversation_id = store.create(session["name"], system_prompt, unit_number=unit_number)
+    store.append(conversation_id, "assistant", greeting)
+    session['tutor_conversation'] = conversation_id
+    
     return jsonify({
+        "conversation_id": conversation_id,
         "messages": [
-            {"role": "assistant", "content": response.choices[0].message.content}
-        ]
+            {"role": "assistant", "content": greeting}
+        ],
+        "context_tokens": usage
     })
 
+# Model settings for the AI tutor chat
+CHAT_OPTIONS = {
+    'model': "gpt-4-turbo-preview",
+    'temperature': 0.7,
+    'max_tokens': 1000
+}
+
+# Model settings for folding old turns into the conversation summary
+SUMMARY_OPTIONS = {
+    'model': "gpt-3.5-turbo",
+    'temperature': 0.2,
+    'max_tokens': 300
+}
+
+# Longest summary kept when the summarizer fails and the transcript is
+# stored instead; the newest text is kept
+SUMMARY_FALLBACK_CHARS = 2000
+
+def summarize_turns(summary, messages):
+    """Fold messages into the running summary of a tutor conversation"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    try:
+        response = get_openai_client().chat.completions.create(
+            messages=[
+                {"role": "system", "content": "Summarize this tutoring session for the tutor's own reference. "
+                                              "Keep the questions asked, how the student answered and the running score. "
+                                              "Be brief."},
+                {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"}
+            ],
+            **SUMMARY_OPTIONS
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        current_app.logger.error(f"Error summarizing tutor conversation: {str(e)}")
+        # Fall back to keeping the transcript rather than losing the turns,
+        # capped so repeated failures cannot grow the summary without limit
+        combined = ((summary + "\n") if summary else "") + transcript
+        return combined[-SUMMARY_FALLBACK_CHARS:]
+
+def get_chat_conversation(data):
+    """Validate a chat request and record the student's message.
+
+    Returns (conversation_id, error_response).
+    """
+    if not data or not isinstance(data.get('message'), str) or not data['message'].strip():
+        return None, (jsonify({"error": "Invalid request data"}), 400)
+    
+    conversation_id = data.get('conversation_id') or session.get('tutor_conversation')
+    store = get_tutor_store(current_app.config)
+    if not conversation_id or store.owner(conversation_id) != session.get("name"):
+        return None, (jsonify({"error": "Conversation not found. Please restart the test."}), 404)
+    
+    store.append(conversation_id, "user", data['message'].strip())
+    return conversation_id, None
+
+def finish_chat_turn(conversation_id, reply):
+    """Store the tutor's reply and fold old turns into the summary"""
+    store = get_tutor_store(current_app.config)
+    store.append(conversation_id, "assistant", reply)
+    store.compact(conversation_id, summarize_turns)
+
 @test_bp.route('/api/ai_test/chat', methods=['POST'])
 def chat():
     if not session.get("name"):
         return jsonify({"error": "Not authenticated"}), 401
     
-    data = request.get_json()
-    if not data or 'messages' not in data:
-        return jsonify({"error": "Invalid request data"}), 400
-        
-    messages = data['messages']
-    if not isinstance(messages, list):
-        return jsonify({"error": "Messages must be an array"}), 400
+    conversation_id, error = get_chat_conversation(request.get_json())
+    if error:
+        return error
     
     try:
-        # Ensure we don't exceed context window (last 10 messages)
-        recent_messages = messages[-10:]
-        
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=recent_messages,
-            temperature=0.7,
-            max_tokens=1000
+        response = get_openai_client().chat.completions.create(
+            messages=get_tutor_store(current_app.config).build_messages(conversation_id),
+            **CHAT_OPTIONS
         )
         
         if not response.choices or not response.choices[0].message.content:
             return jsonify({"error": "No response from AI"}), 500
         
+        finish_chat_turn(conversation_id, response.choices[0].message.content)
+        
         return jsonify({
             "messages": [
                 {"role": "assistant", "content": response.choices[0].message.content}
@@ -409,29 +383,44 @@ def chat():
             "error": "Sorry, I encountered an error processing your request. Please try again."
         }), 500
 
+@test_bp.route('/api/ai_test/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the tutor's reply to the browser as server-sent events"""
+    if not session.get("name"):
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    conversation_id, error = get_chat_conversation(request.get_json())
+    if error:
+        return error
+    
+    events = stream_chat_completion(
+        get_openai_client(),
+        get_tutor_store(current_app.config).build_messages(conversation_id),
+        on_complete=lambda reply: finish_chat_turn(conversation_id, reply),
+        **CHAT_OPTIONS
+    )
+    return Response(stream_with_context(events),
+                    mimetype='text/event-stream',
+                    headers=sse_headers())
+
 @test_bp.route('/ai-quiz')
 def ai_quiz():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
     
-    # Generate a new quiz session ID
-    session_id = f"quiz_{int(time.time())}"
-    
     # Generate questions using AI
-    questions, error = generate_ai_quiz(session['user_id'])
+    questions, error, usage = generate_ai_quiz(session['user_id'])
     
     if error or not questions:
         flash('Failed to generate quiz. Please try again later.', 'error')
         return redirect(url_for('main.dashboard'))
     
-    # Store the quiz in the session
-    quiz_sessions[session_id] = {
-        'questions': questions,
-        'user_id': session['user_id'],
-        'started_at': datetime.now().isoformat(),
-        'answers': {},
-        'completed': False
-    }
+    # Store the quiz where any worker can serve it
+    session_id = get_quiz_sessions().create(
+        session['user_id'],
+        questions,
+        meta={'context_tokens': usage}
+    )
     
     # Store the session ID in the user's session
     session['current_quiz'] = session_id
@@ -443,12 +432,11 @@ def api_get_quiz():
     if 'user_id' not in session or 'current_quiz' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    session_id = session['current_quiz']
-    if session_id not in quiz_sessions:
+    quiz_data = get_quiz_sessions().get(session['current_quiz'])
+    if not quiz_data:
         return jsonify({'error': 'Quiz session not found'}), 404
     
     # Return only the questions (without answers)
-    quiz_data = quiz_sessions[session_id]
     questions = []
     
     for q in quiz_data['questions']:
@@ -470,27 +458,71 @@ def api_submit_quiz():
     if 'user_id' not in session or 'current_quiz' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    session_id = session['current_quiz']
-    if session_id not in quiz_sessions:
-        return jsonify({'error': 'Quiz session not found'}), 404
-    
     data = request.get_json()
     if not data or 'answers' not in data:
         return jsonify({'error': 'Invalid request data'}), 400
     
-    # Update the quiz session with the user's answers
-    quiz_sessions[session_id]['answers'] = data.get('answers', {})
-    quiz_sessions[session_id]['completed'] = True
-    quiz_sessions[session_id]['completed_at'] = datetime.now().isoformat()
-    quiz_sessions[session_id]['score'] = data.get('score', 0)
-    quiz_sessions[session_id]['total_questions'] = data.get('total', 0)
+    # Save the result and drop the finished quiz from the store
+    completed = get_quiz_sessions().complete(
+        session['current_quiz'],
+        answers=data.get('answers', {}),
+        score=data.get('score', 0),
+        total_questions=data.get('total', 0)
+    )
+    if not completed:
+        return jsonify({'error': 'Quiz session not found'}), 404
     
-    # Here you could save the results to a database
-    # save_quiz_results(session['user_id'], quiz_sessions[session_id])
+    session.pop('current_quiz', None)
     
     return jsonify({'success': True})
 
-def init_app(app):
-    # Register the blueprint with the app
-    app.register_blueprint(test_bp)
-    return test_bp
+@test_bp.route('/review')
+def review():
+    """Spaced-repetition review of dictionary terms"""
+    if 'user_id' not in session:
+        return redirect(url_for('auth.login', next=request.url))
+    
+    return render_template('tests/review.html',
+                           summary=review_summary(get_db(), session['user_id']),
+                           grades=GRADES)
+
+@test_bp.route('/api/review/next', methods=['GET'])
+def api_review_next():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({'cards': next_cards(get_db(), session['user_id'])})
+
+@test_bp.route('/api/review/grade', methods=['POST'])
+def api_review_grade():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('grades'), dict):
+        return jsonify({'error': 'Invalid request data'}), 400
+    if len(data['grades']) > MAX_GRADES:
+        return jsonify({'error': f'At most {MAX_GRADES} grades can be sent at once'}), 400
+    
+    # Grades may be given by name ('good') or as SM-2 numbers (0-5)
+    try:
+        grades = {int(entry_id): GRADES[grade] if grade in GRADES else int(grade)
+                  for entry_id, grade in data['grades'].items()}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid grade'}), 400
+    if not all(0 <= grade <= 5 for grade in grades.values()):
+        return jsonify({'error': 'Grades must be between 0 and 5'}), 400
+    
+    # The whole session is written in one transaction
+    conn = connect_db('dictionary', isolation_level=None)
+    try:
+        updated = grade_cards(conn, session['user_id'], grades)
+    finally:
+        conn.close()
+    
+    return jsonify({
+        'success': True,
+        'reviewed': len(updated),
+        'next_due': {entry_id: state['due_date'] for entry_id, state in updated.items()},
+        'summary': review_summary(get_db(), session['user_id'])
+    })
@@ -0,0 +1,34 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_context import CHARS_PER_TOKEN, MIN_TRUNCATED_TOKENS, _pack
+
+def _line(name, tokens):
+    return name + 'x' * (tokens * CHARS_PER_TOKEN - len(name) - 1) + '\n'
+
+def _usage():
+    return {'terms': 0, 'truncated': 0}
+
+def test_line_that_does_not_fit_is_kept_for_the_next_pass():
+    lines = iter([_line('first', 100), _line('second', 100), _line('third', 10)])
+    # Room for the first line, and too little left to truncate the second
+    budget = 100 + MIN_TRUNCATED_TOKENS - 1
+
+    text, rest = _pack(lines, '', budget, _usage(), 'terms')
+    more, rest = _pack(rest, '', 1000, _usage(), 'terms')
+
+    assert text.startswith('first') and 'second' not in text
+    assert more.startswith('second') and 'third' in more
+    assert rest is None
+
+def test_truncated_line_is_not_repeated():
+    lines = iter([_line('first', 200), _line('second', 10)])
+    usage = _usage()
+
+    text, rest = _pack(lines, '', 100, usage, 'terms')
+    more, _ = _pack(rest, '', 1000, _usage(), 'terms')
+
+    assert text.startswith('first') and usage['truncated'] == 1
+    assert more.startswith('second')
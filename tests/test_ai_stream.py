@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ai_stream import STREAM_ERROR_MESSAGE, stream_chat_completion
+
+openai = pytest.importorskip('openai')
+
+CHUNKS = ['Hello', ', ', 'world']
+
+def _chunk(content=None, finish_reason=None):
+    return {
+        'id': 'chatcmpl-test', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'test',
+        'choices': [{'index': 0, 'delta': {'content': content} if content else {},
+                     'finish_reason': finish_reason}],
+    }
+
+class FakeCompletions(BaseHTTPRequestHandler):
+    """Streams canned chat completion chunks the way the OpenAI API does"""
+    mode = 'ok'
+    disconnected = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, data):
+        self.wfile.write(f"data: {data}\n\n".encode())
+        self.wfile.flush()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self.mode == 'error':
+            body = json.dumps({'error': {'message': 'secret upstream detail', 'type': 'server_error'}}).encode()
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        if self.mode == 'ok':
+            for content in CHUNKS:
+                self._send(json.dumps(_chunk(content)))
+            self._send(json.dumps(_chunk(finish_reason='stop')))
+            self._send('[DONE]')
+            return
+
+        # 'endless': keep generating until the client goes away
+        try:
+            while True:
+                self._send(json.dumps(_chunk('token')))
+                threading.Event().wait(0.01)
+        except (BrokenPipeError, ConnectionResetError):
+            self.disconnected.set()
+
+@pytest.fixture
+def fake_api():
+    FakeCompletions.mode = 'ok'
+    FakeCompletions.disconnected = threading.Event()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCompletions)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = openai.OpenAI(api_key='test', base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                           max_retries=0)
+    yield client
+    server.shutdown()
+    server.server_close()
+
+def _parse(message):
+    lines = message.strip().split('\n')
+    event = lines[0][len('event: '):] if lines[0].startswith('event: ') else None
+    return event, json.loads(lines[-1][len('data: '):])
+
+def test_streams_start_deltas_and_done(fake_api):
+    completed = []
+    events = [_parse(message) for message in
+              stream_chat_completion(fake_api, [{'role': 'user', 'content': 'hi'}],
+                                     on_complete=completed.append, model='test')]
+
+    assert events == ([('start', {})]
+                      + [('delta', {'content': content}) for content in CHUNKS]
+                      + [('done', {'finish_reason': 'stop'})])
+    assert completed == [''.join(CHUNKS)]
+
+def test_upstream_error_is_logged_not_sent(fake_api, caplog):
+    FakeCompletions.mode = 'error'
+    completed = []
+    events = [_parse(message) for message in
+              stream_chat_completion(fake_api, [{'role': 'user', 'content': 'hi'}],
+                                     on_complete=completed.append, model='test')]
+
+    assert events == [('error', {'error': STREAM_ERROR_MESSAGE})]
+    assert 'secret upstream detail' not in json.dumps(events)
+    assert any(record.exc_info for record in caplog.records if record.name == 'ai_stream')
+    assert completed == []
+
+def test_client_disconnect_closes_upstream(fake_api):
+    FakeCompletions.mode = 'endless'
+    events = stream_chat_completion(fake_api, [{'role': 'user', 'content': 'hi'}], model='test')
+
+    assert _parse(next(events))[0] == 'start'
+    assert _parse(next(events))[0] == 'delta'
+    # What the WSGI server does when the client goes away
+    events.close()
+
+    assert FakeCompletions.disconnected.wait(5)
@@ -0,0 +1,56 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from calendar_ics import MAX_LINE_OCTETS, escape_text, fold_line, iter_events, unescape_text
+
+def _upload(*lines):
+    """An uploaded file as the import reads it: bytes, CRLF-terminated lines"""
+    return io.BytesIO(b''.join(line + b'\r\n' for line in lines))
+
+def test_fold_inside_a_multibyte_character_is_rejoined():
+    summary = 'é' * 40
+    line = f'SUMMARY:{summary}'.encode('utf-8')
+    # 'SUMMARY:' is 8 octets, so octet 75 falls inside an 'é'
+    assert line[75] >= 0x80 and line[74] >= 0x80
+    upload = _upload(b'BEGIN:VCALENDAR', b'BEGIN:VEVENT', b'DTSTART;VALUE=DATE:20260105',
+                     line[:75], b' ' + line[75:], b'END:VEVENT', b'END:VCALENDAR')
+
+    events = list(iter_events(upload))
+
+    assert [event['summary'] for event in events] == [summary]
+
+@pytest.mark.parametrize('value', ['a;b,c\\d', 'two\nlines', ''])
+def test_escaped_text_reads_back(value):
+    assert unescape_text(escape_text(value)) == value
+
+@pytest.mark.parametrize('line', ['SUMMARY:' + 'x' * 200, 'SUMMARY:' + 'é' * 100, 'SUMMARY:' + '€x' * 60])
+def test_folded_pieces_fit_and_unfold_to_the_line(line):
+    folded = fold_line(line)
+    pieces = folded.split('\r\n')
+
+    assert folded.endswith('\r\n') and pieces[-1] == ''
+    assert all(len(piece.encode('utf-8')) <= MAX_LINE_OCTETS for piece in pieces)
+    assert all(piece.startswith(' ') for piece in pieces[1:-1])
+    events = list(iter_events(_upload(b'BEGIN:VEVENT', folded[:-2].encode('utf-8'), b'END:VEVENT')))
+    assert events[0]['summary'] == line[len('SUMMARY:'):]
+
+def test_event_properties_are_parsed_and_alarms_ignored():
+    upload = _upload(b'BEGIN:VCALENDAR', b'BEGIN:VEVENT', b'UID:exam-1',
+                     b'DTSTART;TZID="Europe/Paris:x":20260105T090000', b'SUMMARY:Unit 3\\, test',
+                     b'RRULE:FREQ=WEEKLY;COUNT=4', b'EXDATE:20260112,20260119T090000,bad',
+                     b'BEGIN:VALARM', b'DESCRIPTION:Reminder', b'END:VALARM',
+                     b'END:VEVENT', b'BEGIN:VEVENT', b'UID:exam-1', b'DTSTART:20260127',
+                     b'RECURRENCE-ID;VALUE=DATE:20260126', b'END:VEVENT', b'END:VCALENDAR')
+
+    first, moved = iter_events(upload)
+
+    assert first['dtstart'] == '2026-01-05' and first['summary'] == 'Unit 3, test'
+    assert first['rrule'] == 'FREQ=WEEKLY;COUNT=4'
+    assert first['exdates'] == ['2026-01-12', '2026-01-19']
+    assert first['description'] is None
+    assert (moved['uid'], moved['dtstart'], moved['recurrence_id']) == ('exam-1', '2026-01-27', '2026-01-26')
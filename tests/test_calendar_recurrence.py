@@ -0,0 +1,87 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from calendar_recurrence import (MAX_COUNT, MAX_INTERVAL, expand, format_rrule, last_occurrence,
+                                 next_occurrence, parse_rrule)
+
+def test_rule_is_read_and_written_back_canonically():
+    rule = parse_rrule('RRULE:freq=weekly;BYDAY=TU,MO;INTERVAL=2;COUNT=3')
+
+    assert rule['byday'] == (0, 1)
+    assert format_rrule(rule) == 'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TU;COUNT=3'
+
+def test_huge_count_and_interval_are_clamped():
+    rule = parse_rrule(f'FREQ=DAILY;INTERVAL=99999;COUNT={10 ** 12}')
+
+    assert rule['interval'] == MAX_INTERVAL
+    assert rule['count'] == MAX_COUNT
+
+@pytest.mark.parametrize('text', [
+    'FREQ=HOURLY',
+    'FREQ=DAILY;COUNT=2;UNTIL=20240101',
+    'FREQ=MONTHLY;BYDAY=MO',
+    'FREQ=WEEKLY;BYDAY=XX',
+    'FREQ=DAILY;INTERVAL=0',
+    'FREQ=DAILY;BYMONTH=1',
+])
+def test_unsupported_rules_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_rrule(text)
+
+def test_weekly_rule_expands_to_its_weekdays_every_other_week():
+    rule = parse_rrule('FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH')
+    # Wednesday 3 January 2024: that week only has its Thursday
+    days = expand(date(2024, 1, 3), rule, date(2024, 1, 1), date(2024, 2, 1))
+
+    assert [day.isoformat() for day in days] == [
+        '2024-01-04', '2024-01-15', '2024-01-18', '2024-01-29',
+    ]
+
+def test_monthly_rule_skips_months_without_the_day():
+    rule = parse_rrule('FREQ=MONTHLY')
+    days = expand(date(2024, 1, 31), rule, date(2024, 1, 1), date(2024, 6, 1))
+
+    assert [day.isoformat() for day in days] == ['2024-01-31', '2024-03-31', '2024-05-31']
+
+def test_window_far_into_a_series_starts_at_the_window():
+    rule = parse_rrule('FREQ=DAILY;INTERVAL=3')
+    days = expand(date(2000, 1, 1), rule, date(2024, 1, 1), date(2024, 1, 10))
+
+    assert days and all(date(2024, 1, 1) <= day < date(2024, 1, 10) for day in days)
+    assert all((day - date(2000, 1, 1)).days % 3 == 0 for day in days)
+
+@pytest.mark.parametrize('dtstart, text', [
+    (date(2024, 1, 3), 'FREQ=DAILY;INTERVAL=5;COUNT=7'),
+    (date(2024, 1, 3), 'FREQ=WEEKLY;BYDAY=MO,WE,FR;COUNT=8'),
+    (date(2024, 1, 5), 'FREQ=WEEKLY;INTERVAL=3;BYDAY=MO,TU;COUNT=5'),
+    (date(2024, 1, 31), 'FREQ=MONTHLY;COUNT=4'),
+    (date(2024, 2, 29), 'FREQ=YEARLY;COUNT=2'),
+])
+def test_last_occurrence_of_a_count_rule_is_its_last_expanded_date(dtstart, text):
+    rule = parse_rrule(text)
+    days = expand(dtstart, {**rule, 'count': None}, dtstart, date(2100, 1, 1))
+
+    assert last_occurrence(dtstart, rule) == days[rule['count'] - 1]
+
+def test_last_occurrence_past_the_last_date_is_refused():
+    with pytest.raises(ValueError):
+        last_occurrence(date(9999, 12, 1), parse_rrule('FREQ=DAILY;COUNT=100'))
+    with pytest.raises(ValueError):
+        last_occurrence(date(9990, 1, 1), parse_rrule('FREQ=YEARLY;COUNT=20'))
+
+def test_expansion_stops_at_the_last_date():
+    rule = parse_rrule('FREQ=YEARLY')
+    days = expand(date(9990, 6, 1), rule, date(9995, 1, 1), date.max)
+
+    assert [day.year for day in days] == list(range(9995, 10000))
+
+def test_next_occurrence_respects_until():
+    series = {'dtstart': '2024-01-01', 'rrule': 'FREQ=WEEKLY', 'until': '2024-01-15'}
+
+    assert next_occurrence(series, date(2024, 1, 2)) == date(2024, 1, 8)
+    assert next_occurrence(series, date(2024, 1, 16)) is None
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import passwords
+from passwords import HASHERS, ScryptHasher, check_password, identify
+
+@pytest.fixture
+def hasher(monkeypatch):
+    """A cheap scrypt default, so the tests do not pay the real cost"""
+    hasher = ScryptHasher(n=16, r=1, p=1)
+    monkeypatch.setitem(HASHERS, 'scrypt', hasher)
+    monkeypatch.setattr(passwords, 'DEFAULT_HASHER', hasher)
+    monkeypatch.setattr(passwords, '_dummy', None)
+    return hasher
+
+def test_parameters_travel_with_the_hash(hasher):
+    encoded = hasher.encode('secret')
+
+    assert encoded.startswith('scrypt$n=16,r=1,p=1$')
+    assert ScryptHasher._parse(encoded)[:3] == (16, 1, 1)
+    assert check_password('secret', encoded) == (True, False)
+    assert check_password('Secret', encoded) == (False, False)
+
+def test_hash_made_with_other_parameters_is_upgraded(hasher):
+    encoded = ScryptHasher(n=8, r=1, p=1).encode('secret')
+
+    assert check_password('secret', encoded) == (True, True)
+    # Only a correct password triggers the upgrade
+    assert check_password('wrong', encoded) == (False, False)
+
+@pytest.mark.parametrize('encoded', ['scrypt$nonsense', 'scrypt$n=16,r=1$c2FsdA$a2V5', 'scrypt$n=x,r=1,p=1$$'])
+def test_malformed_hash_does_not_match(hasher, encoded):
+    assert check_password('secret', encoded) == (False, False)
+
+def test_unknown_user_is_checked_against_a_dummy_hash(hasher):
+    assert check_password('secret', None) == (False, False)
+    assert passwords._dummy.startswith('scrypt$n=16,')
+
+@pytest.mark.parametrize('encoded, algorithm', [
+    ('a' * 64, 'sha256'),
+    ('scrypt$n=16,r=1,p=1$c2FsdA$a2V5', 'scrypt'),
+    ('md5$abc', None),
+    ('A' * 64, None),
+    ('', None),
+])
+def test_identify(encoded, algorithm):
+    hasher = identify(encoded)
+
+    assert (hasher.algorithm if hasher else None) == algorithm
+
+def test_legacy_hashes_always_need_rehashing():
+    assert HASHERS['sha256'].needs_rehash('a' * 64)
@@ -0,0 +1,159 @@
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import ai_context
+import calendar_recurrence
+import calendar_service
+import dictionary_routes
+import note_revisions
+import notes_routes
+import quiz_engine
+import review_engine
+import storage
+import study_scheduler
+import user_store
+import worksheet_storage
+
+# Hot queries from the blueprints and the helpers they call:
+# (database, where it runs, SQL, parameters, full scan expected).
+# The SQL is the code's own constant (or the builder it calls), so a
+# changed query is checked as it is; only the parameters are made up.
+HOT_QUERIES = [
+    ('dictionary', 'quiz_engine QuizEngine._signature', quiz_engine.ENTRIES_SIGNATURE_SQL, (1,), False),
+    ('notes', 'quiz_engine QuizEngine._signature', quiz_engine.NOTES_SIGNATURE_SQL, (1,), False),
+    ('dictionary', 'quiz_engine QuizEngine._build', quiz_engine.UNIT_ENTRIES_SQL, (1,), False),
+    ('notes', 'quiz_engine QuizEngine._build', quiz_engine.UNIT_NOTE_IDS_SQL, (1,), False),
+    ('notes', 'quiz_engine QuizEngine.sample', quiz_engine.notes_by_id_sql(3), (1, 2, 3), False),
+    ('dictionary', "ai_context build_study_context (rank='views')",
+     ai_context.ranked_rows_sql('entries', ai_context.ENTRY_COLUMNS, 1, 'views'), (1,), False),
+    ('notes', "ai_context build_study_context (rank='views')",
+     ai_context.ranked_rows_sql('notes', ai_context.NOTE_COLUMNS, 1, 'views'), (1,), False),
+    ('notes', "ai_context build_study_context (rank='recent')",
+     ai_context.ranked_rows_sql('notes', ai_context.NOTE_COLUMNS, 1, 'recent'), (1,), False),
+    ('dictionary', "ai_context build_study_context (rank='search')",
+     ai_context.search_rows_sql('entries', ai_context.ENTRY_COLUMNS, 1), ('"term"', 1), False),
+    ('notes', "ai_context build_study_context (rank='search')",
+     ai_context.search_rows_sql('notes', ai_context.NOTE_COLUMNS, 1), ('"term"', 1), False),
+    ('dictionary', 'dictionary_routes index', dictionary_routes.INDEX_SQL, (), False),
+    ('dictionary', 'dictionary_routes render_entry', dictionary_routes.ENTRY_SQL, {'id': 1}, False),
+    ('notes', 'notes_routes view_note', notes_routes.NOTE_SQL, (1,), False),
+    ('notes', 'notes_routes get_worksheet_images', notes_routes.WORKSHEET_IMAGES_SQL, (1,), False),
+    ('notes', 'worksheet_storage release_file_reference', worksheet_storage.FILE_REFERENCES_SQL,
+     ('x.png',), False),
+    ('notes', 'note_revisions get_revision', note_revisions.REVISION_CHAIN_SQL, (1, 5, 1, 5), False),
+    ('calendar', 'calendar_service range_etag', calendar_service.RANGE_ETAG_SQL,
+     (1, '2024-01-01', '2024-02-01'), False),
+    ('calendar', 'calendar_service get_entries', calendar_service.RANGE_ENTRIES_SQL,
+     (1, '2024-01-01', '2024-02-01'), False),
+    ('calendar', 'calendar_recurrence recurrence_signature', calendar_recurrence.SIGNATURE_SQL, (1,), False),
+    ('calendar', 'calendar_recurrence _expand_window (series)', calendar_recurrence.WINDOW_SERIES_SQL,
+     (1, '2024-02-01', '2024-01-01'), False),
+    ('calendar', 'calendar_recurrence _expand_window (exceptions)', calendar_recurrence.WINDOW_EXCEPTIONS_SQL,
+     (1, '2024-01-01', '2024-02-01'), False),
+    ('calendar', 'calendar_recurrence _expand_window (moved in)', calendar_recurrence.MOVED_IN_SQL,
+     ('2024-01-01', '2024-02-01', 1), False),
+    ('calendar', 'study_scheduler materialize', study_scheduler.CHANGED_ENTRIES_SQL, (0, 200), False),
+    ('calendar', 'study_scheduler materialize (series)', study_scheduler.CHANGED_SERIES_SQL, (0, 200), False),
+    ('calendar', 'study_scheduler materialize (look-ahead)', study_scheduler.DUE_SERIES_SQL,
+     ('2024-01-01', 200), False),
+    ('calendar', 'study_scheduler schedule_series (overrides)', study_scheduler.SERIES_OVERRIDES_SQL, (1,), False),
+    ('calendar', 'calendar_recurrence series_occurrences (moved in)', calendar_recurrence.SERIES_MOVED_IN_SQL,
+     (1, '2024-01-01', '2024-02-01'), False),
+    ('calendar', 'study_scheduler due_tasks', study_scheduler.DUE_TASKS_SQL, (1, '2024-01-01', 50), False),
+    ('calendar', 'study_scheduler upcoming_tasks', study_scheduler.UPCOMING_TASKS_SQL,
+     (1, '2024-01-01', '2024-01-08', 50), False),
+    ('dictionary', 'review_engine next_cards (due)', review_engine.DUE_CARDS_SQL, (1, '2024-01-01', 20), False),
+    ('dictionary', 'review_engine next_cards (new)', review_engine.NEW_CARDS_SQL, (0, 20), False),
+    ('dictionary', 'review_engine grade_cards (new card window)', review_engine.NEW_CARD_IDS_SQL,
+     (0, 20), False),
+    ('dictionary', 'review_engine grade_cards (states)', review_engine.card_states_sql(3),
+     (1, 1, 2, 3, '2024-01-01'), False),
+    ('dictionary', 'review_engine review_summary', review_engine.DUE_COUNT_SQL, (1, '2024-01-01'), False),
+    ('users', 'user_store get_user', user_store.USER_SQL, ('someone',), False),
+    # The notes list shows every note, sorted by an expression
+    ('notes', 'notes_routes index', notes_routes.INDEX_SQL, (), True),
+]
+
+# A plan step that reads every row of a table, as opposed to SCAN ... USING INDEX
+# (older SQLite versions print "SCAN TABLE name")
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+def schema_copy(name):
+    """An empty in-memory database with a database's schema but none of its statistics.
+
+    Without sqlite_stat1 the planner assumes every table is large, so a
+    plan that scans a table here would scan it at any size, however few
+    rows the checked database has.
+    """
+    source = storage.connect_db(name, readonly=True)
+    try:
+        schema = source.execute("""
+            SELECT sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            ORDER BY rowid
+        """).fetchall()
+    finally:
+        source.close()
+    conn = sqlite3.connect(':memory:')
+    for (sql,) in schema:
+        try:
+            conn.execute(sql)
+        except sqlite3.OperationalError as e:
+            # Full-text tables create their shadow tables themselves
+            if 'already exists' not in str(e):
+                raise
+    return conn
+
+def query_plan(conn, sql, params):
+    """Return the EXPLAIN QUERY PLAN steps of a statement as strings"""
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def build_fresh_databases(directory):
+    """Create empty databases from the create scripts and migrate them"""
+    import migrate
+
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'databases')
+    for script in ('createNotesDB.py', 'createDictDB.py', 'createCalendarDB.py', 'createDatabase.py'):
+        subprocess.run([sys.executable, os.path.join(scripts, script)], cwd=directory,
+                       check=True, stdout=subprocess.DEVNULL)
+    storage.DATA_DIR = directory
+    for name in ('notes', 'dictionary', 'calendar', 'users'):
+        migrate.upgrade(name)
+
+@pytest.fixture(scope='module')
+def schemas(tmp_path_factory):
+    """Schema copies of freshly created and migrated databases.
+
+    With QUERY_PLANS_DATA_DIR set, the databases there are checked instead.
+    """
+    original = storage.DATA_DIR
+    try:
+        directory = os.environ.get('QUERY_PLANS_DATA_DIR')
+        if directory:
+            storage.DATA_DIR = directory
+        else:
+            build_fresh_databases(str(tmp_path_factory.mktemp('databases')))
+        copies = {name: schema_copy(name) for name in {query[0] for query in HOT_QUERIES}
+                  if os.path.exists(storage.database_path(name))}
+    finally:
+        storage.DATA_DIR = original
+    yield copies
+    for conn in copies.values():
+        conn.close()
+
+@pytest.mark.parametrize('name, source, sql, params, full_scan_ok', HOT_QUERIES,
+                         ids=[f"{source} [{name}]" for name, source, *_ in HOT_QUERIES])
+def test_hot_query_uses_an_index(schemas, name, source, sql, params, full_scan_ok):
+    if name not in schemas:
+        pytest.skip(f"no {name} database")
+    plan = query_plan(schemas[name], sql, params)
+    print('\n'.join(plan))
+    scans = [step for step in plan if FULL_SCAN.match(step)]
+    assert full_scan_ok or not scans, f"{source} scans a whole table: {'; '.join(scans)}"
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from migrations import add_review_state
+from review_engine import (FIRST_INTERVALS, GRADES, INITIAL_EASE, MINIMUM_EASE, NEW_CARDS_PER_DAY,
+                           SESSION_SIZE, _new_card_window, grade_cards, schedule)
+
+TODAY = date(2024, 3, 1)
+
+def _state(result):
+    return result['ease'], result['interval'], result['repetitions'], result['lapses']
+
+def test_passing_grades_follow_the_first_intervals_then_grow_by_ease():
+    first = schedule(None, GRADES['good'], TODAY)
+    second = schedule(_state(first), GRADES['good'], TODAY)
+    third = schedule(_state(second), GRADES['good'], TODAY)
+
+    assert [first['interval'], second['interval']] == list(FIRST_INTERVALS)
+    assert first['due_date'] == '2024-03-02' and first['ease'] == INITIAL_EASE
+    assert third['interval'] == round(FIRST_INTERVALS[1] * third['ease'])
+    assert third['repetitions'] == 3
+
+def test_lapse_starts_the_card_over():
+    result = schedule((2.5, 40, 5, 0), GRADES['again'], TODAY)
+
+    assert (result['interval'], result['repetitions'], result['lapses']) == (FIRST_INTERVALS[0], 0, 1)
+    assert result['ease'] < 2.5
+
+def test_ease_never_drops_below_the_minimum():
+    state = None
+    for _ in range(20):
+        state = _state(schedule(state, GRADES['again'], TODAY))
+
+    assert state[0] == MINIMUM_EASE
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY)")
+    conn.executemany("INSERT INTO entries (id) VALUES (?)", [(entry_id,) for entry_id in range(1, 101)])
+    add_review_state.upgrade(conn)
+    yield conn
+    conn.close()
+
+def test_new_card_window_follows_the_watermark(conn):
+    assert _new_card_window(conn, 1, TODAY.isoformat())[2] == list(range(1, SESSION_SIZE + 1))
+
+    conn.execute("INSERT INTO review_progress VALUES (1, 30, ?, 5)", (TODAY.isoformat(),))
+    last_new, started_today, window = _new_card_window(conn, 1, TODAY.isoformat())
+
+    assert (last_new, started_today) == (30, 5)
+    assert window == list(range(31, 31 + min(SESSION_SIZE, NEW_CARDS_PER_DAY - 5)))
+
+def test_new_card_window_is_empty_once_the_day_is_used_up(conn):
+    conn.execute("INSERT INTO review_progress VALUES (1, 30, ?, ?)", (TODAY.isoformat(), NEW_CARDS_PER_DAY))
+
+    assert _new_card_window(conn, 1, TODAY.isoformat())[2] == []
+    # The daily count starts again the next day
+    assert _new_card_window(conn, 1, '2024-03-02')[1] == 0
+
+def test_grading_ignores_cards_outside_the_window_and_queues_skipped_ones(conn):
+    updated = grade_cards(conn, 1, {2: GRADES['good'], 4: GRADES['easy'], 99: GRADES['good']}, TODAY)
+
+    assert sorted(updated) == [2, 4]
+    queued = conn.execute("""
+        SELECT entry_id FROM review_state WHERE user_id = 1 AND due_date = ? ORDER BY entry_id
+    """, (TODAY.isoformat(),)).fetchall()
+    assert queued == [(1,), (3,)]
+    assert conn.execute("SELECT last_new_entry_id, new_count FROM review_progress").fetchone() == (4, 4)
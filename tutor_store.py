@@ -0,0 +1,203 @@
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from storage import database_path
+
+# Conversations idle for longer than this are discarded, in seconds
+DEFAULT_TTL = 6 * 60 * 60
+
+# Number of most recent messages always sent to the model verbatim
+RECENT_WINDOW = 8
+
+# Fold older messages into the summary once this many have piled up beyond the window
+FOLD_THRESHOLD = 4
+
+# How often (at most) expired conversations are swept, in seconds
+SWEEP_INTERVAL = 60
+
+class TutorStore(object):
+    """Server-side AI tutor conversations.
+
+    Each conversation pins the system prompt (with the study materials) once,
+    keeps the most recent messages verbatim and folds older ones into a
+    rolling summary, so the model input stays bounded however long the
+    conversation runs and the browser only ever sends its new message.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path or database_path('quizzes')
+        self.ttl = ttl
+        self._last_sweep = 0
+        self._init_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tutor_conversations (
+                    id TEXT PRIMARY KEY,
+                    user TEXT NOT NULL,
+                    unit_number INTEGER,
+                    system_prompt BLOB NOT NULL,    -- zlib-compressed, pinned for the conversation
+                    summary TEXT,                   -- rolling summary of folded messages
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tutor_conversations_expires
+                    ON tutor_conversations(expires_at);
+
+                CREATE TABLE IF NOT EXISTS tutor_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    FOREIGN KEY (conversation_id) REFERENCES tutor_conversations (id) ON DELETE CASCADE
+                );
+                CREATE INDEX IF NOT EXISTS idx_tutor_messages_conversation
+                    ON tutor_messages(conversation_id, id);
+            """)
+        finally:
+            conn.close()
+
+    def create(self, user, system_prompt, unit_number=None):
+        """Start a conversation and return its ID"""
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        self._maybe_sweep(now)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT INTO tutor_conversations (id, user, unit_number, system_prompt, created_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (conversation_id, user, unit_number,
+                      zlib.compress(system_prompt.encode('utf-8')), now, now + self.ttl))
+        finally:
+            conn.close()
+        return conversation_id
+
+    def owner(self, conversation_id):
+        """Return the user a live conversation belongs to, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("""
+                SELECT user FROM tutor_conversations
+                WHERE id = ? AND expires_at >= ?
+            """, (conversation_id, time.time())).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def append(self, conversation_id, role, content):
+        """Add a message and extend the conversation's lifetime"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT INTO tutor_messages (conversation_id, role, content)
+                    VALUES (?, ?, ?)
+                """, (conversation_id, role, content))
+                conn.execute("""
+                    UPDATE tutor_conversations SET expires_at = ? WHERE id = ?
+                """, (time.time() + self.ttl, conversation_id))
+        finally:
+            conn.close()
+
+    def build_messages(self, conversation_id):
+        """Return the bounded message list to send to the model"""
+        conn = self._connect()
+        try:
+            row = conn.execute("""
+                SELECT system_prompt, summary FROM tutor_conversations WHERE id = ?
+            """, (conversation_id,)).fetchone()
+            if not row:
+                return None
+            recent = conn.execute("""
+                SELECT role, content FROM (
+                    SELECT id, role, content FROM tutor_messages
+                    WHERE conversation_id = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ) ORDER BY id
+            """, (conversation_id, RECENT_WINDOW + FOLD_THRESHOLD)).fetchall()
+        finally:
+            conn.close()
+
+        messages = [{'role': 'system', 'content': zlib.decompress(row[0]).decode('utf-8')}]
+        if row[1]:
+            messages.append({'role': 'system',
+                             'content': f"Summary of the conversation so far:\n{row[1]}"})
+        messages.extend({'role': role, 'content': content} for role, content in recent)
+        return messages
+
+    def compact(self, conversation_id, summarize):
+        """Fold messages older than the recent window into the rolling summary.
+
+        summarize(summary, messages) must return the new summary text. Nothing
+        happens until FOLD_THRESHOLD messages have piled up beyond the window,
+        so the summarizer runs once every few turns rather than every turn.
+        """
+        conn = self._connect()
+        try:
+            summary = conn.execute("""
+                SELECT summary FROM tutor_conversations WHERE id = ?
+            """, (conversation_id,)).fetchone()
+            if summary is None:
+                return False
+            rows = conn.execute("""
+                SELECT id, role, content FROM tutor_messages
+                WHERE conversation_id = ?
+                ORDER BY id
+            """, (conversation_id,)).fetchall()
+            old = rows[:-RECENT_WINDOW]
+            if len(old) < FOLD_THRESHOLD:
+                return False
+
+            new_summary = summarize(summary[0], [{'role': role, 'content': content} for _, role, content in old])
+            with conn:
+                conn.execute("UPDATE tutor_conversations SET summary = ? WHERE id = ?",
+                             (new_summary, conversation_id))
+                conn.execute("DELETE FROM tutor_messages WHERE conversation_id = ? AND id <= ?",
+                             (conversation_id, old[-1][0]))
+            return True
+        finally:
+            conn.close()
+
+    def evict_expired(self):
+        """Remove expired conversations and return how many were removed"""
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute("DELETE FROM tutor_conversations WHERE expires_at < ?", (time.time(),))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def _maybe_sweep(self, now):
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.evict_expired()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_tutor_store(config=None):
+    """Return the process-wide tutor conversation store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = config or {}
+                _store = TutorStore(config.get('TUTOR_STORE_PATH', database_path('quizzes')),
+                                    ttl=config.get('TUTOR_SESSION_TTL', DEFAULT_TTL))
+    return _store
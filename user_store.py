@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from storage import connect_db
+
+# Users looked up recently, kept briefly so repeated logins skip the database
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60
+
+# Failed logins allowed per window before further attempts are refused:
+# per username and client address together, and per address alone
+MAX_FAILURES_PER_ACCOUNT = 5
+MAX_FAILURES_PER_ADDRESS = 30
+FAILURE_WINDOW = 5 * 60
+
+# Throttle keys kept in memory; the oldest are forgotten beyond this
+MAX_THROTTLE_KEYS = 10000
+
+USER_COLUMNS = ('id', 'username', 'password', 'salt', 'name', 'accountStatus', 'role')
+USER_SQL = f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE username = ?"
+
+_local = threading.local()
+
+def _connection():
+    """This thread's read connection to users.db, so lookups stay prepared"""
+    conn = getattr(_local, 'conn', None)
+    # A connection must not be shared with a parent process
+    if conn is None or _local.pid != os.getpid():
+        conn = connect_db('users', readonly=True)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+class UserCache(object):
+    """Small LRU of user rows by username with a time-to-live.
+
+    Entries are dropped on password changes in this process; the TTL
+    bounds how long another process's change can go unnoticed.
+    """
+
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            item = self._items.get(username)
+            if item is None or item[0] < time.monotonic():
+                return None
+            self._items.move_to_end(username)
+            return item[1]
+
+    def put(self, username, user):
+        with self._lock:
+            self._items[username] = (time.monotonic() + self.ttl, user)
+            self._items.move_to_end(username)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def discard(self, username):
+        with self._lock:
+            self._items.pop(username, None)
+
+_user_cache = UserCache()
+
+def get_user(username):
+    """Return a user as a dict by (lower-case) username, or None"""
+    user = _user_cache.get(username)
+    if user is not None:
+        return user
+    try:
+        row = _connection().execute(USER_SQL, (username,)).fetchone()
+    except sqlite3.Error:
+        # Drop a connection left broken (e.g. the file was replaced by a restore)
+        _local.conn = None
+        raise
+    if row is None:
+        return None
+    user = dict(zip(USER_COLUMNS, row))
+    _user_cache.put(username, user)
+    return user
+
+def forget_user(username):
+    """Drop a cached user after changing its row"""
+    _user_cache.discard(username)
+
+def set_password_hash(user, password_hash):
+    """Store a new password hash for a user (a dict from get_user)"""
+    conn = connect_db('users')
+    try:
+        conn.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user['id']))
+        conn.commit()
+    finally:
+        conn.close()
+    forget_user(user['username'])
+
+class LoginThrottle(object):
+    """In-memory count of recent failed logins per key.
+
+    Checking happens before any database or hashing work, so a client
+    hammering the login form costs a dictionary lookup per request. The
+    counts live per process, which is enough to blunt guessing without
+    adding a write to every failed attempt.
+    """
+
+    def __init__(self, window=FAILURE_WINDOW, max_keys=MAX_THROTTLE_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, key, now):
+        item = self._failures.get(key)
+        if item is None or item[0] + self.window < now:
+            return 0, 0
+        return item
+
+    def retry_after(self, key, limit):
+        """Seconds until key may try again, or 0 if it is under its limit"""
+        now = time.monotonic()
+        with self._lock:
+            started, failures = self._count(key, now)
+            if failures < limit:
+                return 0
+            return max(1, int(started + self.window - now))
+
+    def failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            started, failures = self._count(key, now)
+            self._failures[key] = (started if failures else now, failures + 1)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+_throttle = LoginThrottle()
+
+def login_retry_after(username, address):
+    """Seconds a login for username from address must wait (0 if allowed)"""
+    return max(_throttle.retry_after(('account', username, address), MAX_FAILURES_PER_ACCOUNT),
+               _throttle.retry_after(('address', address), MAX_FAILURES_PER_ADDRESS))
+
+def record_login(username, address, success):
+    """Count a failed login, or clear the account's failures after a success"""
+    if success:
+        _throttle.reset(('account', username, address))
+    else:
+        _throttle.failure(('account', username, address))
+        _throttle.failure(('address', address))
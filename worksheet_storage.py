@@ -0,0 +1,212 @@
+import hashlib
+import os
+import uuid
+
+# Configure upload folder and allowed extensions
+UPLOAD_FOLDER = os.path.join('uploads', 'worksheets')
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'txt'}
+
+# Uploads are copied to disk in pieces of this size, in bytes
+CHUNK_SIZE = 64 * 1024
+
+# Worksheet rows still using a file that has no blob row
+FILE_REFERENCES_SQL = "SELECT COUNT(*) FROM worksheet_images WHERE filename = ?"
+
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def stream_to_disk(file, upload_folder=UPLOAD_FOLDER):
+    """Copy an uploaded file to a temporary file in chunks while hashing it.
+
+    Returns a dict with the temporary path, the content-addressed filename
+    the file will be stored under (<sha256>.<ext>), its digest and size.
+    The file is moved into place by place_upload.
+    """
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    os.makedirs(upload_folder, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(upload_folder, f".upload-{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    sha256 = digest.hexdigest()
+    return {
+        'tmp_path': tmp_path,
+        'filename': f"{sha256}.{ext}",
+        'sha256': sha256,
+        'size': size,
+        'created': False,
+        'original_filename': file.filename,
+    }
+
+def place_upload(upload, filename, upload_folder=UPLOAD_FOLDER):
+    """Move a streamed upload to its stored name unless that file already exists.
+
+    Must run inside the transaction that references the file, after its
+    first write, so it cannot interleave with the cleanup sweeper.
+    """
+    final_path = os.path.join(upload_folder, filename)
+    if not os.path.exists(final_path):
+        os.replace(upload['tmp_path'], final_path)
+        upload['created'] = True
+        upload['stored_as'] = filename
+
+def add_blob_reference(cursor, sha256, filename, size):
+    """Count one more reference to a blob and return its canonical filename.
+
+    If the same content was stored before (possibly under another
+    extension), the existing file is reused.
+    """
+    cursor.execute("""
+        INSERT INTO worksheet_blobs (sha256, filename, size, refcount)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1
+    """, (sha256, filename, size))
+    cursor.execute("SELECT filename FROM worksheet_blobs WHERE sha256 = ?", (sha256,))
+    return cursor.fetchone()[0]
+
+def save_uploads(conn, note_id, uploads, upload_folder=UPLOAD_FOLDER):
+    """Stream uploads to disk and record them for a note in one transaction.
+
+    Returns a list of dicts describing the saved worksheet rows. If the
+    transaction fails, files created by this call are removed again.
+    """
+    stored = []
+    try:
+        for file in uploads:
+            if file and file.filename and allowed_file(file.filename):
+                stored.append(stream_to_disk(file, upload_folder))
+        if not stored:
+            return []
+
+        saved_files = []
+        cursor = conn.cursor()
+        for upload in stored:
+            filename = add_blob_reference(cursor, upload['sha256'], upload['filename'], upload['size'])
+            cursor.execute("""
+                INSERT INTO worksheet_images (note_id, filename, original_filename)
+                VALUES (?, ?, ?)
+            """, (note_id, filename, upload['original_filename']))
+            saved_files.append({
+                'id': cursor.lastrowid,
+                'filename': filename,
+                'original_filename': upload['original_filename']
+            })
+
+            # The file may be waiting for the sweeper; claim it back
+            cursor.execute("DELETE FROM file_cleanup_queue WHERE filename = ?", (filename,))
+            place_upload(upload, filename, upload_folder)
+
+        cursor.execute("UPDATE notes SET has_worksheet = 1 WHERE id = ?", (note_id,))
+        conn.commit()
+        return saved_files
+    except Exception:
+        # Remove files we placed while still holding the write lock, so no
+        # other upload can start referencing them in between
+        for upload in stored:
+            if upload['created']:
+                os.remove(os.path.join(upload_folder, upload['stored_as']))
+        conn.rollback()
+        raise
+    finally:
+        for upload in stored:
+            if os.path.exists(upload['tmp_path']):
+                os.remove(upload['tmp_path'])
+
+def queue_file_removal(cursor, filenames):
+    """Record files nothing references any more, for the sweeper to delete"""
+    cursor.executemany("""
+        INSERT OR IGNORE INTO file_cleanup_queue (filename) VALUES (?)
+    """, [(filename,) for filename in filenames])
+
+def sweep_removed_files(conn, upload_folder=UPLOAD_FOLDER, batch_size=100):
+    """Delete up to batch_size queued files from disk; return how many were processed.
+
+    Runs under an immediate write transaction so uploads that reuse a queued
+    file are serialized with it, and re-checks each file for references
+    before unlinking it.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("""
+            SELECT id, filename FROM file_cleanup_queue ORDER BY id LIMIT ?
+        """, (batch_size,)).fetchall()
+        done = []
+        for queue_id, filename in rows:
+            referenced = conn.execute("""
+                SELECT EXISTS (SELECT 1 FROM worksheet_blobs WHERE filename = ?)
+                    OR EXISTS (SELECT 1 FROM worksheet_images WHERE filename = ?)
+            """, (filename, filename)).fetchone()[0]
+            if not referenced:
+                try:
+                    os.remove(os.path.join(upload_folder, filename))
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    # Leave it queued and try again on the next sweep
+                    continue
+            done.append((queue_id,))
+        conn.executemany("DELETE FROM file_cleanup_queue WHERE id = ?", done)
+        conn.execute("COMMIT")
+        return len(done)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def share_note_files(cursor, source_note_id, target_note_id):
+    """Give target note references to all of source note's stored files.
+
+    No file is copied: the new worksheet rows point at the same blobs and
+    their reference counts go up, in two statements however many files
+    there are. Returns the number of worksheet rows created.
+    """
+    cursor.execute("""
+        INSERT INTO worksheet_images (note_id, filename, original_filename)
+        SELECT ?, filename, original_filename
+        FROM worksheet_images
+        WHERE note_id = ?
+    """, (target_note_id, source_note_id))
+    shared = cursor.rowcount
+    if shared:
+        cursor.execute("""
+            UPDATE worksheet_blobs
+            SET refcount = refcount + (
+                SELECT COUNT(*) FROM worksheet_images w
+                WHERE w.note_id = ? AND w.filename = worksheet_blobs.filename
+            )
+            WHERE filename IN (SELECT filename FROM worksheet_images WHERE note_id = ?)
+        """, (target_note_id, target_note_id))
+    return shared
+
+def release_file_reference(cursor, filename):
+    """Drop one reference to a stored file; return True if nothing uses it any more.
+
+    Call after the worksheet row itself has been deleted. Files uploaded
+    before blobs were tracked have no blob row; for those the remaining
+    worksheet rows are counted instead.
+    """
+    cursor.execute("""
+        UPDATE worksheet_blobs SET refcount = refcount - 1 WHERE filename = ?
+    """, (filename,))
+    if cursor.rowcount:
+        cursor.execute("SELECT refcount FROM worksheet_blobs WHERE filename = ?", (filename,))
+        if cursor.fetchone()[0] > 0:
+            return False
+        cursor.execute("DELETE FROM worksheet_blobs WHERE filename = ?", (filename,))
+        return True
+
+    cursor.execute(FILE_REFERENCES_SQL, (filename,))
+    return cursor.fetchone()[0] == 0
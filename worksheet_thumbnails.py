@@ -0,0 +1,194 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow is optional; without it only PDFs (via pdftoppm) get previews.
+# It is imported with the first ThumbnailService, not when the app starts.
+Image = ImageOps = None
+
+def _load_pillow():
+    """Import Pillow if it is installed; return whether it is available"""
+    global Image, ImageOps
+    if Image is None:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            pass
+    return Image is not None
+
+from worksheet_storage import UPLOAD_FOLDER
+
+THUMBNAIL_FOLDER = os.path.join('uploads', 'thumbnails')
+
+# Longest edge, in pixels, of the sizes templates may ask for
+THUMBNAIL_SIZES = (160, 480)
+
+# Total size of cached thumbnails before the least recently used are evicted
+MAX_CACHE_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+class ThumbnailService(object):
+    """Lazily derives and caches resized previews of worksheet uploads.
+
+    Thumbnails are keyed by the source file's content hash and the requested
+    size, so a cached thumbnail never goes stale. Work runs on a small
+    thread pool; concurrent requests for the same thumbnail share one job.
+    The cache directory is kept under max_bytes by evicting the thumbnails
+    that were used least recently.
+    """
+
+    def __init__(self, source_folder=UPLOAD_FOLDER, cache_folder=THUMBNAIL_FOLDER,
+                 max_bytes=MAX_CACHE_BYTES, workers=2):
+        self.source_folder = source_folder
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._cache_bytes = None
+        self._webp = _load_pillow() and 'WEBP' in _pillow_save_formats()
+
+    def can_preview(self, filename):
+        ext = filename.rsplit('.', 1)[-1].lower()
+        if ext in IMAGE_EXTENSIONS:
+            return Image is not None
+        if ext == 'pdf':
+            return shutil.which('pdftoppm') is not None
+        return False
+
+    def cache_path(self, source_hash, size, fmt):
+        return os.path.join(self.cache_folder, f"{source_hash}_{size}.{fmt}")
+
+    def get(self, filename, source_hash, size, accept_webp=False, wait=0):
+        """Return the path of a cached thumbnail, starting a job if there is none.
+
+        Waits up to `wait` seconds for a new job; returns None if the
+        thumbnail is not ready (or cannot be made).
+        """
+        fmt = 'webp' if accept_webp and self._webp else 'jpg'
+        path = self.cache_path(source_hash, size, fmt)
+        if os.path.exists(path):
+            # Record the hit for least-recently-used eviction
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+
+        future = self.submit(filename, source_hash, size, fmt)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=wait)
+        except Exception:
+            return None
+
+    def submit(self, filename, source_hash, size, fmt='jpg'):
+        """Queue generation of a thumbnail unless it is already queued"""
+        if not self.can_preview(filename):
+            return None
+        key = (source_hash, size, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._generate, filename, source_hash, size, fmt)
+                future.add_done_callback(lambda _: self._forget(key))
+                self._pending[key] = future
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _generate(self, filename, source_hash, size, fmt):
+        source = os.path.join(self.source_folder, filename)
+        target = self.cache_path(source_hash, size, fmt)
+        os.makedirs(self.cache_folder, exist_ok=True)
+
+        # Write to a temporary file so readers never see half a thumbnail
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_folder, suffix='.tmp')
+        os.close(fd)
+        try:
+            if filename.rsplit('.', 1)[-1].lower() == 'pdf':
+                self._render_pdf(source, tmp_path, size)
+                if fmt == 'webp':
+                    self._resize(tmp_path, tmp_path, size, fmt)
+            else:
+                self._resize(source, tmp_path, size, fmt)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._account(os.path.getsize(target))
+        return target
+
+    def _resize(self, source, target, size, fmt):
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            if fmt == 'webp':
+                image.save(target, 'WEBP', quality=80, method=4)
+            else:
+                image.save(target, 'JPEG', quality=80, optimize=True, progressive=True)
+
+    def _render_pdf(self, source, target, size):
+        """Render the first page of a PDF to JPEG with poppler's pdftoppm"""
+        # pdftoppm names its own output; keep it in a directory of its own so
+        # the cache scan never counts or evicts a page still being written
+        with tempfile.TemporaryDirectory(dir=self.cache_folder, suffix='.tmp') as directory:
+            prefix = os.path.join(directory, 'page')
+            subprocess.run(
+                ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+                 '-scale-to', str(size), source, prefix],
+                check=True, timeout=30, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            os.replace(prefix + '.jpg', target)
+
+    def _account(self, added):
+        """Track the cache size and evict old thumbnails once it is too big"""
+        with self._lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(entry.stat().st_size for entry in self._scan())
+            else:
+                self._cache_bytes += added
+            if self._cache_bytes <= self.max_bytes:
+                return
+
+            # Evict down to 90% so a full cache is not rescanned on every write
+            entries = sorted(self._scan(), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self._cache_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self._cache_bytes -= size
+                except OSError:
+                    pass
+
+    def _scan(self):
+        return [entry for entry in os.scandir(self.cache_folder)
+                if entry.is_file() and not entry.name.endswith('.tmp')]
+
+def _pillow_save_formats():
+    from PIL import features
+    return {'WEBP'} if features.check('webp') else set()
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_thumbnail_service():
+    """Return the process-wide thumbnail service"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ThumbnailService()
+    return _service